@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Probabilities of constancy of the lightcurves                        #
+#                                                                      #
+########################################################################
+"""
+Chi-square and Kolmogorov-Smirnov probabilities of constancy of binned
+lightcurves, the ones printed by lcstats, without launching it twice per
+source. The lightcurves of all the sources of an observation share their
+bins, so that the tests are computed for all of them at once on arrays of
+shape (sources, bins). Only the bins entirely within the good time
+intervals are used, as the window file of lcstats does.
+"""
+
+# Built-in imports
+
+import sys
+import argparse
+
+# Third-party imports
+
+import numpy as np
+from astropy.io import fits
+
+# Internal imports
+
+from fits_extractor import in_gti
+
+# Maximal number of values of a block of lightcurves processed at once
+CHUNK_VALUES = 1 << 24
+
+########################################################################
+#                                                                      #
+# Tests                                                                #
+#                                                                      #
+########################################################################
+
+def good_bins(t_start, n_bins, bin_size, gti) :
+    """
+    Bins entirely within the good time intervals.
+    @param t_start: Start time of the first bin
+    @param gti: Good time intervals, with START and STOP
+    @return: mask of the bins
+    """
+    starts = t_start + bin_size * np.arange(n_bins)
+
+    return in_gti(starts, gti) & in_gti(starts + bin_size * (1 - 1e-9), gti)
+
+
+def chisq_constancy(rates, errors) :
+    """
+    Chi-square test of the rates against their mean, with n-1 degrees of
+    freedom. A constant rate has the same variance in every bin, estimated
+    by the mean of the squared errors: the error of a single bin, null for
+    an empty one, is too poor an estimate with a few counts per bin.
+    @param rates, errors: arrays of shape (sources, bins)
+    @return: P_chisq of each source, 1 if the test is not defined
+    """
+    from scipy.stats import chi2
+
+    n_bins   = rates.shape[1]
+    if n_bins == 0 :
+        return np.ones(len(rates))
+    variance = np.mean(errors**2, axis=1)
+    mean     = np.mean(rates, axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        statistic = np.sum((rates - mean)**2, axis=1) / variance
+    defined = (variance > 0) & (n_bins > 1)
+
+    return np.where(defined, chi2.sf(np.where(defined, statistic, 0.0), max(n_bins - 1, 1)), 1.0)
+
+
+def ks_constancy(rates, bin_size) :
+    """
+    Kolmogorov-Smirnov test of the cumulative counts against the cumulative
+    good time, the number of counts of a source giving the size of its sample.
+    @param rates: array of shape (sources, bins)
+    @return: P_KS of each source, 1 if the test is not defined
+    """
+    from scipy.stats import kstwo
+
+    n_bins  = rates.shape[1]
+    if n_bins == 0 :
+        return np.ones(len(rates))
+    counts  = np.clip(rates, 0, None) * bin_size
+    total   = np.sum(counts, axis=1)
+    defined = total > 0
+
+    with np.errstate(divide='ignore', invalid='ignore') :
+        observed = np.cumsum(counts, axis=1) / total[:, None]
+    expected = np.arange(1, n_bins + 1) / n_bins
+    # The counts of a bin may be anywhere within it
+    distance = np.max(np.maximum(np.abs(observed - expected), np.abs(observed - (expected - 1.0 / n_bins))), axis=1)
+    n        = np.maximum(np.rint(total), 1).astype(np.int64)
+
+    return np.where(defined, kstwo.sf(np.where(defined, np.minimum(distance, 1.0), 0.0), n), 1.0)
+
+
+def constancy(rates, errors, t_start, bin_size, gti, chunk=CHUNK_VALUES) :
+    """
+    Probabilities of constancy of lightcurves sharing the same bins.
+    @param rates, errors: arrays or lists of arrays, one lightcurve per source
+    @param t_start: Start time of the first bin
+    @param bin_size: Duration of a bin in seconds
+    @param gti: Good time intervals, with START and STOP
+    @param chunk: Maximal number of values processed at once
+    @return: P_chisq, P_KS arrays, one value per source
+    """
+    if len(rates) == 0 :
+        return np.empty(0), np.empty(0)
+
+    good = good_bins(t_start, len(rates[0]), bin_size, gti)
+    step = max(1, chunk // max(1, np.count_nonzero(good)))
+    p_chisq, p_ks = [], []
+    for i in range(0, len(rates), step) :
+        block_rates  = np.array([np.asarray(r, dtype=float)[good] for r in rates[i:i + step]])
+        block_errors = np.array([np.asarray(e, dtype=float)[good] for e in errors[i:i + step]])
+        # Empty lightcurves (no bin within the GTI) have no defined tests
+        block_rates  = np.nan_to_num(block_rates.reshape(len(block_rates), -1))
+        block_errors = np.nan_to_num(block_errors.reshape(len(block_errors), -1))
+        p_chisq.append(chisq_constancy(block_rates, block_errors))
+        p_ks.append(ks_constancy(block_rates, bin_size))
+
+    return np.concatenate(p_chisq), np.concatenate(p_ks)
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-lc", dest="lc", help="Lightcurves, those sharing the same bins being tested together", nargs='+', type=str)
+    parser.add_argument("-gti", dest="gti", help="Good time intervals file", type=str)
+    args = parser.parse_args()
+
+    # Lightcurves grouped by their bins, each one read with its own binning
+    groups = {}
+    for n, file in enumerate(args.lc) :
+        hdulist = fits.open(file)
+        data, header = hdulist[1].data, hdulist[1].header
+        bin_size = header.get('TIMEDEL', float(data['TIME'][1] - data['TIME'][0]) if len(data) > 1 else 1.0)
+        t_start  = float(data['TIME'][0]) - header.get('TIMEPIXR', 0.5) * bin_size if len(data) else header['TSTART']
+        group = groups.setdefault((t_start, bin_size, len(data)), ([], [], []))
+        group[0].append(n)
+        group[1].append(np.array(data['RATE'], dtype=float))
+        group[2].append(np.array(data['ERROR'], dtype=float))
+        hdulist.close()
+
+    gti = fits.getdata(args.gti, 1)
+    results = [None] * len(args.lc)
+    for (t_start, bin_size, n_bins), (indices, rates, errors) in groups.items() :
+        for n, p_chisq, p_ks in zip(indices, *constancy(rates, errors, t_start, bin_size, gti)) :
+            results[n] = (p_chisq, p_ks)
+
+    # One line "P_chisq P_KS" per lightcurve, in the order of the arguments, for the shell scripts
+    for p_chisq, p_ks in results :
+        print("{0:.6g} {1:.6g}".format(p_chisq, p_ks))
+
+    sys.exit(0)
@@ -19,27 +19,27 @@ import sys
 import os
 import time
 from functools import partial
+from collections import OrderedDict
 
 # Third-party imports
 
 from math import *
 from multiprocessing import Pool
-from astropy.io import fits
-from astropy.table import Table
-from astropy import wcs
-from astropy.coordinates import SkyCoord
-from astropy import units as u
 import numpy as np
 import argparse
-import matplotlib.pyplot as plt
 
 # Internal imports
+# The renderer (matplotlib) and the geometrical transformations (scipy,
+# skimage) are imported by the stages that need them, keeping the start-up
+# of the detector short.
 
 from fits_extractor import *
 from variability_utils import *
+from variability_statistics import STATISTICS
+from triage import TRIAGE_LEVEL, triage_scores
 import file_names as FileNames
 from file_utils import *
-from renderer import *
+import manifest as Manifest
 
 ########################################################################
 #                                                                      #
@@ -47,43 +47,516 @@ from renderer import *
 #                                                                      #
 ########################################################################
 
-parser = argparse.ArgumentParser()
-
-# Path to files
-parser.add_argument("-evts", help="Name of the clean observation file", type=str, nargs='?', default=FileNames.CLEAN_FILE)
-parser.add_argument("-gti", help="Name of the GTI file", type=str, nargs='?', default=FileNames.GTI_FILE)
-parser.add_argument("-img", help="Name of the image file", type=str, nargs='?', default=FileNames.IMG_FILE)
-parser.add_argument("-path", help="Path to the folder containing the observation files", type=str)
-parser.add_argument("-out", help="Path to the folder where the output files will be stored", default=None, type=str)
-
-# Variability parameters
-parser.add_argument("-bs", "--box-size", dest="bs", help="Size of the detection box in pixel^2.\nDefault: 5", default=5, nargs='?', type=int)
-parser.add_argument("-dl", "--detection-level", dest="dl", help="The number of times the median variability is required to trigger a detection.\nDefault: 10", default=10, nargs='?', type=float)
-parser.add_argument("-tw", "--time-window", dest="tw", help="The duration of the time windows.\n Default: 100", default=100.0, nargs='?', type=float)
-parser.add_argument("-gtr", "--good-time-ratio", dest="gtr", help="Ratio of acceptability for a time window. Shall be between 0.0 and 1.0.\nDefault: 1.0", default=1.0, nargs='?', type=float)
-parser.add_argument("-mta", "--max-threads-allowed", dest="mta", help="Maximal number of CPUs the program is allowed to use.\nDefault: 12", nargs='?', default=12, type=int)
-
-# Arguments set by default
-parser.add_argument("-creator", dest="creator", help="User creating the variability files", nargs='?', default=os.environ['USER'], type=str)
-parser.add_argument("-obs", "--observation", dest="obs", help="Observation ID", default=None, nargs='?', type=str)
-
-# Boolean flags
-parser.add_argument('--render', help='Plot variability output, produce pdf', action='store_true')
-parser.add_argument('--ds9', help='Plot variability output in emerging ds9 window', action='store_true')
-parser.add_argument("--novar", help='Skip variability computation if already done', action='store_true')
-
-args = parser.parse_args()
-
-# Modifying arguments
-if args.path[-1] != '/' :
-    args.path = args.path + '/'
-if args.out != None and args.out[-1] != '/' :
-    args.out = args.out + '/'
-if args.out == None :
-    args.out = args.path + '{}_{}_{}_{}/'.format(int(args.dl), int(args.tw), args.bs, args.gtr)
-args.evts = args.path + args.evts
-args.gti  = args.path + args.gti
-args.img  = args.path + args.img
+def parse_arguments(argv=None) :
+    """
+    Parsing the detector's command line arguments.
+    @param argv: list of arguments, sys.argv[1:] if None
+    @return: argparse.Namespace with the paths completed
+    """
+    parser = argparse.ArgumentParser()
+
+    # Path to files
+    parser.add_argument("-evts", help="Name of the clean observation file", type=str, nargs='?', default=FileNames.CLEAN_FILE)
+    parser.add_argument("--raw", help="EVTS is a raw events file (e.g. the .FTZ of the archive), cleaned with the GTI while being read", action='store_true')
+    parser.add_argument("-gti", help="Name of the GTI file", type=str, nargs='?', default=FileNames.GTI_FILE)
+    parser.add_argument("-img", help="Name of the image file", type=str, nargs='?', default=FileNames.IMG_FILE)
+    parser.add_argument("-path", help="Path to the folder containing the observation files", type=str)
+    parser.add_argument("-out", help="Path to the folder where the output files will be stored", default=None, type=str)
+
+    # Variability parameters
+    parser.add_argument("-bs", "--box-size", dest="bs", help="Size of the detection box in pixel^2.\nDefault: 5", default=5, nargs='?', type=int)
+    parser.add_argument("-dl", "--detection-level", dest="dl", help="The number of times the median variability is required to trigger a detection.\nDefault: 10", default=10, nargs='?', type=float)
+    parser.add_argument("-tw", "--time-window", dest="tw", help="The duration of the time windows.\n Default: 100", default=100.0, nargs='?', type=float)
+    parser.add_argument("-gtr", "--good-time-ratio", dest="gtr", help="Ratio of acceptability for a time window. Shall be between 0.0 and 1.0.\nDefault: 1.0", default=1.0, nargs='?', type=float)
+    parser.add_argument("-mta", "--max-threads-allowed", dest="mta", help="Maximal number of CPUs the program is allowed to use.\nDefault: 12", nargs='?', default=12, type=int)
+    parser.add_argument("-bands", dest="bands", help="Edges of the PI energy bands with a variability map of their own, e.g. 500 2000 12000.\nDefault: none", default=None, nargs='+', type=int)
+    parser.add_argument("-stats", dest="stats", help="Statistics of variability with a map of their own, among {0}.\nDefault: none".format(", ".join(STATISTICS)), default=None, nargs='+', choices=list(STATISTICS), type=str)
+    parser.add_argument("-step", dest="step", help="Step in seconds between the starts of overlapping time windows, dividing the time window, e.g. half of it.\nDefault: windows following each other", default=None, type=float)
+    parser.add_argument("-target", dest="target", help="Adaptive time windows: target number of counts per time window of a pixel, its window being chosen between TW and 128 TW.\nDefault: the same time window for all the pixels", default=None, type=float)
+
+    # Arguments set by default
+    parser.add_argument("-creator", dest="creator", help="User creating the variability files", nargs='?', default=os.environ.get('USER'), type=str)
+    parser.add_argument("-obs", "--observation", dest="obs", help="Observation ID", default=None, nargs='?', type=str)
+
+    # Boolean flags
+    parser.add_argument('--render', help='Plot variability output, produce pdf', action='store_true')
+    parser.add_argument('--ds9', help='Plot variability output in emerging ds9 window', action='store_true')
+    parser.add_argument("--novar", help='Skip variability computation if already done with the same files, parameters and code', action='store_true')
+    parser.add_argument("--incremental", help='Save the counts of the time windows, and only count again the windows with new events the next time', action='store_true')
+    parser.add_argument("--triage", help='Coarse pass first, the full detection being run only on the CCDs that may hold a flare', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    # Modifying arguments
+    if args.path[-1] != '/' :
+        args.path = args.path + '/'
+    if args.out != None and args.out[-1] != '/' :
+        args.out = args.out + '/'
+    if args.out == None :
+        args.out = output_folder(args.path, args.dl, args.tw, args.bs, args.gtr)
+    args.evts = args.path + args.evts
+    args.gti  = args.path + args.gti
+    args.img  = args.path + args.img
+
+    return args
+
+########################################################################
+#                                                                      #
+# In-process detector                                                  #
+#                                                                      #
+########################################################################
+
+# Source files of the detection stage, recorded in the manifest of its products
+DETECTION_CODE = ['detector.py', 'variability_utils.py', 'variability_statistics.py', 'triage.py', 'fits_extractor.py', 'file_utils.py']
+
+def output_folder(path, dl, tw, bs, gtr) :
+    """
+    Default output folder of a set of detection parameters.
+    @param path: path to the folder containing the observation files
+    @return: path/DL_TW_BS_GTR/
+    """
+    return os.path.join(path, '{}_{}_{}_{}/'.format(int(dl), int(tw), bs, gtr))
+
+
+def read_state(state_file, tw, bands, t0_observation) :
+    """
+    Counts of the time windows of a CCD saved by the previous incremental detection.
+    @return: state of the CCD (see variability_utils.update_counts), or None
+    if there is no state usable with these parameters
+    """
+    if not os.path.isfile(state_file) :
+        return None
+    state = np.load(state_file)
+    if state['TW'] != tw or list(state['BANDS']) != list(bands if bands != None else []) or state['START'] != t0_observation :
+        return None
+
+    counts = np.zeros(tuple(state['SHAPE']), dtype=np.int32)
+    counts.reshape(-1)[state['INDEX']] = state['COUNTS']
+
+    return counts, state['LAST'][()], state['N_EVENTS'][()], state['CHECKSUM'][()]
+
+
+def write_state(state_file, tw, bands, start, state) :
+    """
+    Saving the counts of the time windows of a CCD for the next incremental
+    detection. Only the non-null counts are saved, so that the file grows
+    with the events rather than with the pixels and time windows.
+    """
+    counts, last, n_events, checksum = state
+    index = np.flatnonzero(counts)
+    np.savez_compressed(state_file, TW=tw, BANDS=np.array(bands if bands != None else [], dtype=float), START=start,
+                        SHAPE=np.array(counts.shape), INDEX=index.astype(np.uint32 if counts.size <= np.iinfo(np.uint32).max else np.int64),
+                        COUNTS=counts.reshape(-1)[index], LAST=last, N_EVENTS=n_events, CHECKSUM=np.uint32(checksum))
+
+
+def _incremental_ccd(variability, state_file, tw, bands, start, ccd) :
+    """
+    Incremental variability of a CCD, its state being read and saved by the
+    process computing it: only the maps are sent back.
+    @param variability: incremental_variability with its parameters
+    @param state_file: File of the state of the CCD
+    @param ccd: (events of the CCD, number of the CCD)
+    """
+    data, n = ccd
+    v_matrix, maps, state = variability((data, read_state(state_file.format(n), tw, bands, start)))
+    write_state(state_file.format(n), tw, bands, start, state)
+
+    return v_matrix, maps
+
+
+def _skipped_ccd(tw, bands, statistics, target) :
+    """
+    Result of variability_computation for a CCD left out by the triage: null
+    maps, and the time window tw in the TW map of the adaptive windows.
+    """
+    v_matrix = np.zeros((len(bands), 64, 200)) if bands != None else np.zeros((64, 200))
+    if statistics == None and target == None :
+        return v_matrix
+    maps = {name : np.zeros((64, 200)) for name in (statistics if statistics != None else [])}
+    if target != None :
+        maps['TW'] = np.full((64, 200), tw)
+
+    return v_matrix, maps
+
+########################################################################
+
+class DetectionResult(object):
+    """
+    Datastructure returned by Detector.detect.\n
+
+    Attributes:\n
+    obs:       The observation identifier\n
+    v_matrix:  The variability per CCD, array of shape (12, 64, 200)\n
+    image:     The variability projected on the sky\n
+    median:    The median variability used for the detection\n
+    sources:   astropy.table.Table of the detected sources\n
+    lightcurves: Quick-look lightcurves of the sources, array of shape (sources, time windows)\n
+    epochs:    Index of the time window of the flare of each source\n
+    var_file:  The variability fits file written\n
+    reg_file:  The ds9 region file written\n
+    timing:    Execution time of each stage in seconds
+    """
+
+    def __init__(self, obs, v_matrix, image, median, sources, var_file, reg_file, timing, lightcurves=None, epochs=None):
+        super(DetectionResult, self).__init__()
+
+        self.obs      = obs
+        self.v_matrix = v_matrix
+        self.image    = image
+        self.median   = median
+        self.sources  = sources
+        self.var_file = var_file
+        self.reg_file = reg_file
+        self.timing   = timing
+        self.lightcurves = lightcurves
+        self.epochs      = epochs
+
+########################################################################
+
+class Detector(object):
+    """
+    Detector applied in-process to any number of observations.
+    The extracted events and GTI of the last observations and the pool of
+    processes are kept between two calls, so that several parameter sets
+    applied to the same observation only read it once, and batch drivers
+    do not pay the interpreter and imports start-up for each job.
+    """
+
+    def __init__(self, mta=1, cache_size=1):
+        """
+        Constructor for Detector class.
+        @param mta: Maximal number of CPUs used to process the CCDs of an observation
+        @param cache_size: Number of observations kept in memory
+        """
+        super(Detector, self).__init__()
+
+        self.mta        = mta
+        self.cache_size = cache_size
+        self._cache     = OrderedDict()
+        self._pool      = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Terminating the pool of processes and emptying the caches.
+        """
+        if self._pool != None :
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._cache.clear()
+
+    def _map(self, fct, iterable):
+        """
+        Applying fct to each CCD, in the pool of processes if mta > 1.
+        """
+        if self.mta <= 1 :
+            return list(map(fct, iterable))
+        if self._pool == None :
+            self._pool = Pool(self.mta)
+        return self._pool.map(fct, iterable)
+
+    def _cached(self, name, loader, file):
+        """
+        Returning loader(file), reading the file only if it changed since the last call.
+        """
+        stat = os.stat(file)
+        key  = (name, os.path.abspath(file), stat.st_mtime, stat.st_size)
+        if key in self._cache :
+            self._cache.move_to_end(key)
+        else :
+            self._cache[key] = loader(file)
+            # Two entries (events, GTI) per observation
+            while len(self._cache) > 2 * self.cache_size :
+                self._cache.popitem(last=False)
+
+        return self._cache[key]
+
+    def load_events(self, evts_file, gti_file=None):
+        """
+        Extracting the events per CCD and the time span of the observation.
+        @param gti_file: If given, the events are cleaned while being read,
+        for raw events files
+        @return: data, header, t0_observation, tf_observation
+        """
+        def extraction(file) :
+            gti = self.load_gti(gti_file) if gti_file != None else None
+            data, header = extraction_photons(file, gti)
+            times = [ccd['TIME'] for ccd in data if len(ccd)]
+            t0_observation = min(t.min() for t in times)
+            tf_observation = max(t.max() for t in times)
+            return data, header, t0_observation, tf_observation
+
+        if gti_file == None :
+            return self._cached('events', extraction, evts_file)
+
+        stat = os.stat(gti_file)
+        return self._cached(('clean events', os.path.abspath(gti_file), stat.st_mtime), extraction, evts_file)
+
+    def load_gti(self, gti_file):
+        """
+        Extracting the GTI of the observation.
+        """
+        return self._cached('gti', extraction_deleted_periods, gti_file)
+
+    def read_result(self, out) :
+        """
+        Reading the products of a previous detection.
+        @param out: Output folder of the detection
+        @return: DetectionResult, without the variability per CCD
+        """
+        from astropy.table import Table
+
+        hdulist = fits.open(out + FileNames.VARIABILITY)
+        image   = hdulist[0].data
+        header  = hdulist[0].header
+        sources = Table(hdulist[1].data)
+        lightcurves = epochs = None
+        if 'LIGHTCURVES' in hdulist :
+            lightcurves = np.array(hdulist['LIGHTCURVES'].data['COUNTS'])
+            epochs      = np.array(hdulist['LIGHTCURVES'].data['PEAK'])
+        hdulist.close()
+        print(" Using existing variability file {0}".format(out + FileNames.VARIABILITY))
+
+        return DetectionResult(header['OBS_ID'], None, image, None, sources, out + FileNames.VARIABILITY, out + FileNames.REGION, OrderedDict(), lightcurves, epochs)
+
+    def detect(self, path, evts=FileNames.CLEAN_FILE, gti=FileNames.GTI_FILE, img=FileNames.IMG_FILE, out=None,
+               bs=5, dl=10, tw=100.0, gtr=1.0, obs=None, creator=None, reuse=False, raw=False, bands=None, statistics=None, step=None, target=None, incremental=False, triage=False, ccds=None) :
+        """
+        Computing the variability and detecting the variable sources of an observation.
+        @param path: Path to the folder containing the observation files
+        @param evts, gti, img: Names of the clean events, GTI and image files, relative to path
+        @param out: Output folder, path/DL_TW_BS_GTR/ if None
+        @param bs, dl, tw, gtr: Box size, detection level, time window and good time ratio
+        @param obs: Observation ID, read from the events file if None
+        @param creator: User creating the variability file
+        @param reuse: Reading the existing products if their manifest matches
+        the input files, the parameters and the code
+        @param raw: evts is a raw events file, possibly compressed (.FTZ), cleaned
+        with the GTI while being read instead of being filtered by SAS first
+        @param bands: Edges of PI energy bands, a variability map being written
+        for each band next to the one of all the events
+        @param statistics: Names of statistics of variability_statistics.STATISTICS,
+        a map of each one being written next to the variability
+        @param step: Step between the starts of overlapping time windows, dividing
+        tw, the counts of the windows being computed from prefix sums. The
+        windows follow each other if None
+        @param target: Target number of counts per time window: the time window
+        of each pixel is then chosen from its count rate, between tw and 128 tw,
+        and written in the TW extension
+        @param incremental: Saving the counts of the time windows, and only
+        counting again the windows with new events the next time, the result
+        being the same as without it
+        @param triage: Scoring the CCDs on coarse binned pixels first, see
+        triage.py: the variability of the CCDs scoring less than TRIAGE_LEVEL
+        is not computed and left null
+        @param ccds: Indices of the CCDs kept by a triage already made, see
+        triage.triage_observation: the variability of the other CCDs is not
+        computed and left null, as with triage
+        @return: DetectionResult
+        @raise Exception: if the events or the GTI cannot be extracted
+        """
+        evts = os.path.join(path, evts)
+        gti  = os.path.join(path, gti)
+        img  = os.path.join(path, img)
+        if path[-1] != '/' :
+            path = path + '/'
+        if out == None :
+            out = output_folder(path, dl, tw, bs, gtr)
+        if out[-1] != '/' :
+            out = out + '/'
+
+        # Manifest of the products
+        inputs       = [evts, gti, img]
+        outputs      = [out + FileNames.VARIABILITY, out + FileNames.REGION]
+        stage_params = {'DL' : dl, 'TW' : tw, 'GTR' : gtr, 'BS' : bs, 'RAW' : raw, 'BANDS' : bands, 'STATS' : statistics, 'STEP' : step, 'TARGET' : target, 'INCREMENTAL' : incremental, 'TRIAGE' : triage, 'CCDS' : ccds}
+        manifest     = Manifest.manifest_file(out, 'detection')
+        if reuse and Manifest.is_up_to_date(manifest, inputs, stage_params, DETECTION_CODE, outputs) :
+            return self.read_result(out)
+        Manifest.remove_manifest(manifest)
+
+        timing = OrderedDict()
+        t_start = time.time()
+        def lap(stage, t) :
+            timing[stage] = time.time() - t
+            return time.time()
+
+        # Opening the output files, printing to the log file
+        log_f, var_f, reg_f = open_files(out)
+        original = sys.stdout
+        sys.stdout = Tee(original, log_f)
+
+        try :
+            # Recovering the EVENTS list
+            t = time.time()
+            print(" Recovering the events list\t {:7.2f} s".format(time.time() - t_start))
+            try :
+                data, header, t0_observation, tf_observation = self.load_events(evts, gti if raw else None)
+            except Exception as e :
+                print(" !!!!\nImpossible to extract photons. ABORTING.")
+                raise
+
+            if obs == None :
+                obs = header['OBS_ID']
+
+            # Parameters ready
+            params = {
+                      "CREATOR" : creator if creator != None else os.environ.get('USER'),
+                      "DATE"    : time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+                      "OBS_ID"  : obs,
+                      "TW"      : tw,
+                      "GTR"     : gtr,
+                      "DL"      : dl,
+                      "BS"      : bs,
+                      "STEP"    : step,
+                      "TARGET"  : target
+                     }
+
+            # Recovering GTI list
+            try :
+                print(" Extracting data\t\t {:7.2f} s".format(time.time() - t_start))
+                gti_list = self.load_gti(gti)
+            except Exception as e :
+                print(" !!!!\nImpossible to extract gti. ABORTING.")
+                raise
+            t = lap('extraction', t)
+
+            # Computing variability
+            print(" Computing variability\t\t {:7.2f} s".format(time.time() - t_start))
+            computed = list(range(len(data)))
+            if incremental :
+                if step != None or target != None or triage or ccds != None :
+                    raise ValueError("The incremental detection uses the time windows of the full detection, without step, target or triage")
+                saved = sum(os.path.isfile(out + FileNames.STATE.format(n)) for n in range(len(data)))
+                print("\tCounts of the time windows saved for {0} of {1} CCDs".format(saved, len(data)))
+                var_calc_partial = partial(incremental_variability, gti_list, tw, gtr, t0_observation, tf_observation, bands, statistics if statistics != None else [])
+                ccd_partial = partial(_incremental_ccd, var_calc_partial, out + FileNames.STATE, tw, bands, t0_observation)
+                v_matrix = self._map(ccd_partial, list(zip(data, range(len(data)))))
+                v_matrix = [v if statistics != None else v[0] for v in v_matrix]
+            else :
+                if triage :
+                    scores   = triage_scores(data, gti_list, t0_observation, tf_observation)
+                    computed = [ccd for ccd in range(len(data)) if scores[ccd] >= TRIAGE_LEVEL]
+                elif ccds != None :
+                    computed = [ccd for ccd in range(len(data)) if ccd in ccds]
+                if triage or ccds != None :
+                    print("\tTriage\t\t{0} of {1} CCDs kept".format(len(computed), len(data)))
+                var_calc_partial = partial(variability_computation, gti_list, tw, gtr, t0_observation, tf_observation, bands=bands, statistics=statistics, step=step, target=target)
+                v_matrix = [_skipped_ccd(tw, bands, statistics, target)] * len(data)
+                for ccd, v in zip(computed, self._map(var_calc_partial, [data[ccd] for ccd in computed])) :
+                    v_matrix[ccd] = v
+
+            # Maps of the other statistics, from the same counts, and of the adaptive time windows
+            img_stats = OrderedDict()
+            if statistics != None or target != None :
+                for name in (statistics if statistics != None else []) + (['TW'] if target != None else []) :
+                    img_stats[name] = data_transformation(ccd_config([v[1][name] for v in v_matrix]), header)
+                v_matrix = [v[0] for v in v_matrix]
+
+            # Variability of all the events, then of each energy band
+            img_bands = []
+            if bands != None :
+                v_bands  = [[v[b] for v in v_matrix] for b in range(1, len(bands))]
+                v_matrix = [v[0] for v in v_matrix]
+                img_bands = [data_transformation(ccd_config(v_band), header) for v_band in v_bands]
+
+            # Aplying CCD configuration
+            data_v = ccd_config(v_matrix)
+            img_v  = data_transformation(data_v, header)
+            t = lap('variability', t)
+
+            # Detecting variable areas and sources
+            print(" Detecting variable sources\t {:7.2f} s".format(time.time() - t_start))
+            # Median of the CCDs whose variability is computed, not the ones left out by the triage
+            median = np.median([v_matrix[ccd] for ccd in computed]) if computed else 0.0
+
+            # Avoiding a too small median value for detection
+            print("\n\tMedian\t\t{0}".format(median))
+            if median < 0.75 :
+                median = 0.75
+                print(" Median switched to 0.75. \n")
+
+            # Currying the function for the pool of threads
+            variable_areas_detection_partial = partial(variable_areas_detection, median, bs, dl)
+            print("\tBox counts\t{0}".format(dl * ((bs**2))))
+            # Performing parallel detection on each CCD
+            variable_areas = self._map(variable_areas_detection_partial, v_matrix)
+
+            # Variable sources
+            sources = variable_sources_position(variable_areas, obs, path, reg_f, log_f, img)
+            print("\tNb of sources\t{0}\n".format(len(sources)))
+            t = lap('detection', t)
+
+            # Quick-look lightcurves of the sources, from the events in memory
+            time_windows, projection_ratio = good_time_windows(gti_list, tw, gtr, t0_observation, tf_observation)
+            lightcurves, time_windows = quick_look_lightcurves(data, source_areas(variable_areas), time_windows, projection_ratio, tw, gtr)
+            epochs = flare_epochs(lightcurves)
+            t = lap('quick-look', t)
+
+            # Writing data to fits file
+            fits_writer(img_v, sources, img, params, var_f, (time_windows, lightcurves, epochs), (bands, img_bands) if bands != None else None, img_stats)
+            Manifest.write_manifest(manifest, inputs, stage_params, DETECTION_CODE, outputs)
+            t = lap('writing', t)
+            timing['total'] = time.time() - t_start
+
+        finally :
+            sys.stdout = original
+            log_f.close()
+
+        return DetectionResult(obs, np.array(v_matrix), img_v, median, sources, var_f, reg_f, timing, lightcurves, epochs)
+
+########################################################################
+
+_worker_detector = None
+
+def _init_worker(mta, cache_size) :
+    """
+    Creating the detector of a worker process of detect_batch.
+    """
+    global _worker_detector
+    _worker_detector = Detector(mta=mta, cache_size=cache_size)
+
+
+def _detect_jobs(jobs) :
+    """
+    Applying the worker's detector to jobs of the same observation.
+    @return: list of (job, DetectionResult or Exception)
+    """
+    results = []
+    for job in jobs :
+        try :
+            results.append((job, _worker_detector.detect(**job)))
+        except Exception as e :
+            results.append((job, e))
+
+    return results
+
+
+def detect_batch(jobs, processes=12, mta=1) :
+    """
+    Applying the detector to many jobs with a long-lived pool of processes.
+    The jobs of the same observation are sent to the same worker, one after
+    the other, so that its events are only extracted once.
+    @param jobs: iterable of dictionaries of arguments of Detector.detect
+    @param processes: Number of worker processes
+    @param mta: Number of CPUs used by each worker. Shall be 1 for processes > 1,
+    the workers of a pool cannot start their own pool.
+    @return: generator of (job, DetectionResult or Exception), in order of completion
+    """
+    groups = OrderedDict()
+    for job in jobs :
+        key = os.path.join(job['path'], job.get('evts', FileNames.CLEAN_FILE))
+        groups.setdefault(key, []).append(job)
+
+    with Pool(processes, initializer=_init_worker, initargs=(mta, 1)) as p :
+        for results in p.imap_unordered(_detect_jobs, groups.values()) :
+            for result in results :
+                yield result
 
 ########################################################################
 #                                                                      #
@@ -91,9 +564,10 @@ args.img  = args.path + args.img
 #                                                                      #
 ########################################################################
 
-def main_fct() :
+def main_fct(args) :
     """
     Main function of the detector
+    @param args: parsed arguments, see parse_arguments
     """
 ###
 # Preliminaries
@@ -112,112 +586,29 @@ def main_fct() :
     # Counter for the overall execution time
     original_time = time.time()
 
-    # Opening the output files
-    log_f, var_f, reg_f = open_files(args.out)
-    original = sys.stdout
-    sys.stdout = Tee(sys.stdout, log_f)
+    var_f = args.out + FileNames.VARIABILITY
+    reg_f = args.out + FileNames.REGION
 
     ###
-    # Skipping variability computation if already done
-    ###
-    vf = False
-    if args.novar :
-        print(" Checking if variability has been computed.")
-        var_f = args.out + FileNames.VARIABILITY
-        vf = os.path.isfile(var_f)
-        if vf :
-            print(" Using existing variability file {0}".format(var_f))
-        else :
-            print(" No variability file. Applying detector.")
-    ###
-    # Starting variability computation
+    # Computing the variability, unless already done with the same
+    # input files, parameters and code (--novar)
     ###
 
-    if not args.novar and not vf:
+    try :
+        with Detector(mta=args.mta) as detector :
+            result = detector.detect(args.path, evts=os.path.abspath(args.evts), gti=os.path.abspath(args.gti), img=os.path.abspath(args.img), out=args.out,
+                                     bs=args.bs, dl=args.dl, tw=args.tw, gtr=args.gtr,
+                                     obs=args.obs, creator=args.creator, reuse=args.novar, raw=args.raw, bands=args.bands, statistics=args.stats, step=args.step, target=args.target, incremental=args.incremental, triage=args.triage)
+    except Exception as e :
+        print(e, file=sys.stderr)
+        exit(-2)
 
-        # Recovering the EVENTS list
-        print(" Recovering the events list\t {:7.2f} s".format(time.time() - original_time))
-        try :
-            data, header = extraction_photons(args.evts)
-
-            if args.obs == None :
-                args.obs = header['OBS_ID']
-
-        except Exception as e:
-            print(" !!!!\nImpossible to extract photons. ABORTING.")
-            close_files(log_f, var_f, var_per_tw_f, detected_var_areas_f, tws_f, detected_var_sources_f)
-            exit(-2)
-
-        # Parameters ready
-        params = {
-                  "CREATOR" : args.creator,
-                  "DATE"    : time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
-                  "OBS_ID"  : args.obs,
-                  "TW"      : args.tw,
-                  "GTR"     : args.gtr,
-                  "DL"      : args.dl,
-                  "BS"      : args.bs
-                 }
-
-        # Recovering GTI list
-        try:
-            print(" Extracting data\t\t {:7.2f} s".format(time.time() - original_time))
-            gti_list = extraction_deleted_periods(args.gti)
-
-        except Exception as e:
-            print(" !!!!\nImpossible to extract gti. ABORTING.")
-            close_files(log_f, var_f, var_per_tw_f, detected_var_areas_f, tws_f, detected_var_sources_f)
-            exit(-2)
-
-        time_windows = []
-        t0_observation = min([evt['TIME'] for ccd in data for evt in ccd])
-        tf_observation = max([evt['TIME'] for ccd in data for evt in ccd])
+    args.obs = result.obs
 
-    ###
-    # Computing variability
-    ###
-        print(" Computing variability\t\t {:7.2f} s".format(time.time() - original_time))
-        # Computing v_matrix
-        v_matrix = []
-
-        var_calc_partial = partial(variability_computation, gti_list, args.tw, args.gtr, t0_observation, tf_observation)
-
-        with Pool(args.mta) as p:
-            v_matrix = p.map(var_calc_partial, data)
-
-        # Aplying CCD configuration
-        data_v = ccd_config(v_matrix)
-        img_v  = data_transformation(data_v, header)
-
-    ###
-    # Detecting variable areas and sources
-    ###
-
-        print(" Detecting variable sources\t {:7.2f} s".format(time.time() - original_time))
-        median = np.median([v_matrix[ccd][i][j] for ccd in range(12) for i in range(len(v_matrix[ccd])) for j in range(len(v_matrix[ccd][i]))])
-
-        # Avoiding a too small median value for detection
-        print("\n\tMedian\t\t{0}".format(median))
-        if median < 0.75 :
-            median = 0.75
-            print(" Median switched to 0.75. \n")
-
-        variable_areas = []
-
-        # Currying the function for the pool of threads
-        variable_areas_detection_partial = partial(variable_areas_detection, median, args.bs, args.dl)
-        print("\tBox counts\t{0}".format(args.dl * ((args.bs**2))))
-        # Performing parallel detection on each CCD
-        with Pool(args.mta) as p:
-            variable_areas = p.map(variable_areas_detection_partial, v_matrix)
-
-        # Variable sources
-        sources = variable_sources_position(variable_areas, args.obs, args.path, reg_f, log_f, args.img)
-
-        print("\tNb of sources\t{0}\n".format(len(sources)))
-
-        # Writing data to fits file
-        fits_writer(img_v, sources, args.img, params, var_f)
+    # The log is continued by the rendering stages
+    log_f = open(args.out + FileNames.LOG, 'a')
+    original = sys.stdout
+    sys.stdout = Tee(sys.stdout, log_f)
 
 ###
 # Plotting variability
@@ -227,16 +618,19 @@ def main_fct() :
     if args.render :
 
         print(" Rendering variability image\t {:7.2f} s".format(time.time() - original_time))
+        from renderer import render_variability
 
         render_variability(var_f, args.out + FileNames.OUTPUT_IMAGE, sources=False, maximum_value=10)
         render_variability(var_f, args.out + FileNames.OUTPUT_IMAGE_SRCS, sources=True, maximum_value=10)
 
     # ds9
     if args.ds9 :
+        from renderer import ds9_renderer
         ds9_renderer(var_f, reg_f)
 
     # Ending program
     print(" # Total execution time OBS {0} : {1:.2f} s\n".format(args.obs, (time.time() - original_time)))
+    sys.stdout = original
     log_f.close()
 
 ########################################################################
@@ -251,4 +645,4 @@ if __name__ == '__main__':
     original_time = time.time()
     original_date = time.strftime("%d/%m/%Y %H:%M:%S", time.gmtime())
 
-    main_fct()
+    main_fct(parse_arguments())
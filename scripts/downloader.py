@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Downloading observations from the XMM-Newton Science Archive         #
+#                                                                      #
+########################################################################
+"""
+Downloading the files of observations needed by the pipeline: the raw
+events lists, the SAS summary file and the background time series.
+The files are downloaded by a bounded number of threads. An interrupted
+download is resumed from its partial file, and a file is only moved in
+place once its size is the one announced by the server and it can be read
+to its end (the CRC of a gzip file, the structure of a tar file): no
+checksum given by the archive is compared. prefetch() downloads the next
+observations while the current one is processed.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import glob
+import gzip
+import time
+import shutil
+import tarfile
+import zlib
+import argparse
+import urllib.request
+import urllib.error
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+# Internal imports
+
+import file_names as FileNames
+
+# Archive queries of the event lists, by instrument
+EVENT_LISTS = {
+    'PN' : ('P{0}PNS001PIEVLI.FTZ', {'instname' : 'PN', 'level' : 'PPS', 'name' : 'PIEVLI'}),
+    'M1' : ('P{0}M1S002MIEVLI.FTZ', {'instname' : 'M1', 'level' : 'PPS', 'name' : 'MIEVLI'}),
+    'M2' : ('P{0}M2S003MIEVLI.FTZ', {'instname' : 'M2', 'level' : 'PPS', 'name' : 'MIEVLI'}),
+}
+SUMMARY  = ('sas.TAR', {'level' : 'ODF', 'extension' : 'SAS'})
+BKG_TS   = ('P{0}PNS001FBKTSR0000.FTZ', {'name' : 'FBKTSR', 'instname' : 'PN', 'level' : 'PPS', 'extension' : 'FTZ'})
+
+# Errors raised when reading a corrupted file
+READ_ERRORS = (OSError, EOFError, tarfile.TarError, zlib.error)
+
+# Members of the SAS tarball not needed by the pipeline
+SUMMARY_UNUSED = ('ATS.FIT', 'TCS.FIT', 'RAS.ASC', 'ROS.ASC', 'MANIFEST')
+
+########################################################################
+#                                                                      #
+# Files                                                                #
+#                                                                      #
+########################################################################
+
+def observation_files(obs, modes=('PN',), archive=FileNames.ARCHIVE_URL) :
+    """
+    Files of an observation to download.
+    @param obs: Observation identifier
+    @param modes: Instruments whose event lists are downloaded, among PN, M1, M2 and MOS
+    @param archive: URL of the archive
+    @return: list of (file name, URL)
+    """
+    modes = set(modes)
+    if 'MOS' in modes :
+        modes |= {'M1', 'M2'}
+
+    queries = [EVENT_LISTS[m] for m in ('PN', 'M1', 'M2') if m in modes] + [SUMMARY, BKG_TS]
+
+    return [(name.format(obs), '{0}?{1}'.format(archive, urlencode(dict(obsno=obs, **query)))) for name, query in queries]
+
+
+def is_downloaded(path, obs) :
+    """
+    Checking whether the files needed by the pipeline are already there.
+    """
+    return all(glob.glob(os.path.join(path, pattern)) for pattern in ('*{0}PN*PIEVLI*'.format(obs), '*FBKTSR*', '*SUM.ASC'))
+
+
+def check_file(file, name=None) :
+    """
+    Verifying that a downloaded file can be read: the CRC of a gzip file is
+    checked by reading it entirely, a tar file shall be readable to its end.
+    This tells truncated and garbled downloads, not a wrong file.
+    @param name: Final name of the file, telling a tar file, file if None
+    @raise IOError: if the file is corrupted
+    """
+    name = file if name == None else name
+    try :
+        with open(file, 'rb') as f :
+            magic = f.read(262)
+        if magic[:2] == b'\x1f\x8b' :
+            with gzip.open(file, 'rb') as f :
+                while f.read(1 << 20) :
+                    pass
+        elif name.upper().endswith('.TAR') or magic[257:262] == b'ustar' :
+            with tarfile.open(file) as tar :
+                tar.getmembers()
+    except READ_ERRORS as e :
+        raise IOError("Corrupted download {0}: {1}".format(file, e))
+
+
+def download_file(url, file, retries=3, timeout=60, block=1 << 20) :
+    """
+    Downloading a file, resuming from the partial file of a previous attempt.
+    @param url: URL of the file
+    @param file: Destination
+    @param retries: Number of times a failed download is attempted again
+    @param timeout: Timeout of the connection in seconds
+    @param block: Size of the blocks read
+    @return: path to the file
+    @raise IOError: if the file could not be downloaded
+    """
+    part = file + '.part'
+    for attempt in range(retries + 1) :
+        try :
+            start   = os.path.getsize(part) if os.path.isfile(part) else 0
+            request = urllib.request.Request(url, headers={'Range' : 'bytes={0}-'.format(start)} if start else {})
+            try :
+                response = urllib.request.urlopen(request, timeout=timeout)
+            except urllib.error.HTTPError as e :
+                # The partial file is already complete
+                if e.code == 416 and start :
+                    response = None
+                else :
+                    raise
+            if response != None :
+                with response :
+                    # A server ignoring the range sends the whole file again
+                    mode   = 'ab' if response.status == 206 else 'wb'
+                    length = response.headers.get('Content-Length')
+                    size   = (start if mode == 'ab' else 0) + int(length) if length != None else None
+                    with open(part, mode) as f :
+                        shutil.copyfileobj(response, f, block)
+                if size != None and os.path.getsize(part) != size :
+                    raise IOError("Incomplete download of {0}".format(url))
+            try :
+                check_file(part, file)
+            except IOError :
+                os.remove(part)
+                raise
+            os.replace(part, file)
+            return file
+        except (IOError, urllib.error.URLError) as e :
+            if attempt == retries :
+                raise IOError("Download of {0} failed: {1}".format(url, e))
+            time.sleep(2 ** attempt)
+
+
+def extract_summary(path, tar_file) :
+    """
+    Extracting the SAS summary file from the tarball, without the unused files.
+    """
+    with tarfile.open(tar_file) as tar :
+        members = [m for m in tar.getmembers() if m.isfile() and not any(u in m.name for u in SUMMARY_UNUSED)]
+        for m in members :
+            m.name = os.path.basename(m.name)
+        tar.extractall(path, members)
+    os.remove(tar_file)
+
+########################################################################
+#                                                                      #
+# Observations                                                         #
+#                                                                      #
+########################################################################
+
+def download_observation(folder, obs, modes=('PN',), executor=None, force=False, archive=FileNames.ARCHIVE_URL) :
+    """
+    Downloading the files of an observation, unless they are already there.
+    @param folder: Folder containing the observations
+    @param obs: Observation identifier
+    @param modes: Instruments whose event lists are downloaded
+    @param executor: Threads downloading the files, a new one per file if None
+    @param force: Downloading even if the files are already there
+    @param archive: URL of the archive
+    @return: obs
+    """
+    path = os.path.join(folder, obs)
+    os.makedirs(path, exist_ok=True)
+    if not force and is_downloaded(path, obs) :
+        return obs
+
+    # Only the files missing, the other ones being complete once in place
+    files = observation_files(obs, modes, archive)
+    if not force :
+        files = [(name, url) for name, url in files if not is_complete(path, name)]
+    if executor == None :
+        with ThreadPoolExecutor(max_workers=max(len(files), 1)) as local :
+            return _download_files(path, obs, files, local)
+
+    return _download_files(path, obs, files, executor)
+
+
+def is_complete(path, name) :
+    """
+    Checking whether a file of an observation is already in place, the SAS
+    tarball being replaced by the summary file extracted from it.
+    """
+    if name == SUMMARY[0] :
+        return bool(glob.glob(os.path.join(path, '*SUM.ASC')))
+
+    return os.path.isfile(os.path.join(path, name))
+
+
+def _download_files(path, obs, files, executor, retries=1) :
+    futures = [executor.submit(download_file, url, os.path.join(path, name)) for name, url in files]
+    for future in futures :
+        future.result()
+
+    # A tarball readable to its end may still fail to extract, it is downloaded again
+    urls = dict(files)
+    if SUMMARY[0] in urls :
+        tar_file = os.path.join(path, SUMMARY[0])
+        for attempt in range(retries + 1) :
+            try :
+                extract_summary(path, tar_file)
+                break
+            except READ_ERRORS as e :
+                if os.path.isfile(tar_file) :
+                    os.remove(tar_file)
+                if attempt == retries :
+                    raise IOError("Corrupted download {0}: {1}".format(tar_file, e))
+                download_file(urls[SUMMARY[0]], tar_file)
+
+    return obs
+
+
+def prefetch(folder, observations, modes=('PN',), threads=4, ahead=2, force=False, archive=FileNames.ARCHIVE_URL) :
+    """
+    Downloading observations in order, ahead of their processing.
+    The consumer processes an observation while the next ones are downloaded.
+    @param observations: Observation identifiers, in processing order
+    @param threads: Maximal number of files downloaded at the same time
+    @param ahead: Number of observations downloaded in advance
+    @return: generator of (obs, error), error being None if the download succeeded
+    """
+    observations = list(observations)
+    with ThreadPoolExecutor(max_workers=threads) as files, ThreadPoolExecutor(max_workers=ahead) as obs_pool :
+        pending = [obs_pool.submit(download_observation, folder, obs, modes, files, force, archive) for obs in observations[:ahead]]
+        for i, obs in enumerate(observations) :
+            future = pending.pop(0)
+            if i + ahead < len(observations) :
+                pending.append(obs_pool.submit(download_observation, folder, observations[i + ahead], modes, files, force, archive))
+            try :
+                yield future.result(), None
+            except READ_ERRORS as e :
+                yield obs, e
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--folder", dest="folder", help="Folder containing the observations", type=str)
+    parser.add_argument("-obs", "--observations", dest="obs", help="Observations to download", nargs='+', type=str)
+    parser.add_argument("-modes", dest="modes", help="Instruments whose event lists are downloaded.\nDefault: PN", nargs='*', default=['PN'], choices=['PN', 'M1', 'M2', 'MOS'], type=str)
+    parser.add_argument("-threads", dest="threads", help="Maximal number of files downloaded at the same time.\nDefault: 4", default=4, type=int)
+    parser.add_argument("-ahead", dest="ahead", help="Number of observations downloaded at the same time.\nDefault: 2", default=2, type=int)
+    parser.add_argument("-archive", dest="archive", help="URL of the archive", default=FileNames.ARCHIVE_URL, type=str)
+    parser.add_argument("--force", help="Downloading even if the files are already there", action='store_true')
+    args = parser.parse_args()
+
+    # The identifier of each downloaded observation is written as soon as it
+    # is available, so that a consumer can start processing it
+    status = 0
+    for obs, error in prefetch(args.folder, args.obs, args.modes, args.threads, args.ahead, args.force, args.archive) :
+        if error != None :
+            print(" !!!! {0}".format(error), file=sys.stderr)
+            status = 1
+        else :
+            print(obs)
+        sys.stdout.flush()
+
+    sys.exit(status)
@@ -17,7 +17,7 @@
 ################################################################################
 
 # Default variables
-DL=8 ; TW=100 ; GTR=1.0 ; BS=3 ; CPUS=12
+DL=8 ; TW=100 ; GTR=1.0 ; BS=3 ; CPUS=12 ; TRIAGE=""
 # Default folders
 FOLDER=/mnt/data/Ines/data
 SCRIPTS=/mnt/data/Ines/EXOD
@@ -36,6 +36,8 @@ case "$1" in
   shift; shift ;;
   -cpus|--cpus)           CPUS=${2:-$CPUS}
   shift; shift ;;
+  -triage|--triage)       TRIAGE="--triage"
+  shift ;;
   # Folders
   -f|--folder)            FOLDER=${2:-$FOLDER}
   shift; shift ;;
@@ -51,6 +53,7 @@ echo -e "\tTIME WINDOW     = ${TW}"
 echo -e "\tGOOD TIME RATIO = ${GTR}" 
 echo -e "\tBOX SIZE        = ${BS}"
 echo -e "\tCPUS            = ${CPUS}"
+echo -e "\tTRIAGE          = ${TRIAGE:-no}"
 
 ################################################################################
 #                                                                              #
@@ -82,82 +85,6 @@ var(){
   echo $out
 }
 
-waitForFinish()
-{
-  STRING=$1;
-  # wait until jobs have started
-  sleep 1
-  # check, twice, whether all done
-  for i in 1 2 ; do
-    job=99
-    while [ $job -gt 0 ] ; do sleep 10; job=`top -b | head -n 40 | grep ${STRING} | wc -l`; done
-  done
-}
-
-
-# Variability computation functions
-################################################################################
-
-filtering(){
-  obs=$1
-
-  if [ ! -f $FOLDER/$obs/PN_clean.fits ] ; then
-    echo "bash $SCRIPTS/filtering.sh -f $FOLDER -o $obs" >> $FOLDER/process_flt_${DL}_${TW}_${GTR}_${BS}
-  fi
-}
-
-variabilitectron(){
-
-  ###
-  # Defining files and directories
-  ###
-  obs=$1
-
-  # File names
-  path=$FOLDER/$obs
-  events_file=$path/$(var CLEAN_FILE)
-  gti_file=$path/$(var GTI_FILE)
- img_file=$path/$(var IMG_FILE)
-
-  ###
-  # Variability computation
-  ###
-  # writing detector and renderer commands to file that will be run in parallel
-  echo "python3 -W"ignore" $SCRIPTS/detector.py -evts $events_file -gti $gti_file -img $img_file -path $path -out $path/${DL}_${TW}_${GTR}_${BS} -bs $BS -dl $DL -tw $TW -gtr $GTR -mta 1 --render >> $FOLDER/process_det_${DL}_${TW}_${GTR}_${BS}"
-  ((++count))
-}
-
-lightcurves(){
-
-  # Output file
-  echo "Observation Source DL TW P_chisq P_KS" >> $FOLDER/sources_variability_${DL}_${TW}_${GTR}_${BS}
-
-  # Reading file
-  let i=0
-  while read line ; do
-    line_data[$i]="${line}"
-    ((++i))
-    echo $i
-  done < $FOLDER/variable_sources_${DL}_${TW}_${GTR}_${BS}
-
-  # Starting loop
-  for data in "${line_data[@]:1:i-1}"; do
-
-    IFS=' ' read -r -a array <<< "$data"
-    obs=${array[0]}
-    src=${array[1]}
-    dl=${array[2]}
-    tw=${array[3]}
-    echo "Number of sources $obs : $src"
-
-    count=1
-    while [[ $count -le $src ]] ; do
-      echo "bash $SCRIPTS/lightcurve.sh -f $FOLDER -s $SCRIPTS -o $obs -dl $DL -tw $TW -gtr $GTR -bs $BS -id $count" >> $FOLDER/process_lc_${DL}_${TW}_${GTR}_${BS}
-      ((++count))
-    done
-    #fi
-  done
-}
 
 ################################################################################
 #                                                                              #
@@ -168,14 +95,11 @@ lightcurves(){
 # Retrieving a list of observations
 cd $FOLDER
 observations=(0*)
-count=1
 
 # Removing existing log files to avoid overwriting them
-logs=(detected_sources_${DL}_${TW}_${GTR}_${BS} process_flt_${DL}_${TW}_${GTR}_${BS} process_det_${DL}_${TW}_${GTR}_${BS} process_ren_${DL}_${TW}_${GTR}_${BS} process_lc_${DL}_${TW}_${GTR}_${BS} sources_variability_${DL}_${TW}_${GTR}_${BS} variable_sources_${DL}_${TW}_${GTR}_${BS})
+# The lightcurve results are kept, finished stages are not run again
+logs=(detected_sources_${DL}_${TW}_${GTR}_${BS})
 for l in ${logs[@]} ; do if [ -f $l ]; then rm $l; fi; done
-#rm process_lc_${DL}_${TW}_${GTR}_${BS}
-
-echo "Observation sources DL TW" >> variable_sources_${DL}_${TW}_${GTR}_${BS}
 
 ###
 # Launching the variability computation
@@ -186,29 +110,11 @@ time {
   nb_img=${#observations[@]}
   echo $nb_img
 
-  Title "Writing commands to files"
-  # Writing commands to files to run them in parallel
-  for obs in "${observations[@]}"; do
-    # Filtering observations
-    filtering $obs
-    # Variability computation
-    variabilitectron $obs
-  done
-
-  # Filtering observations
-  Title "Filtering observations"
-  bash $SCRIPTS/parallel.sh $FOLDER/process_flt_${DL}_${TW}_${GTR}_${BS} $CPUS
-  waitForFinish 'evselect'
-
-  # Running detector
-  Title "Applying detector"
-  bash $SCRIPTS/parallel.sh $FOLDER/process_det_${DL}_${TW}_${GTR}_${BS} $CPUS
-  waitForFinish 'python'
-
-  # Running renderer
-  Title "Applying renderer"
-  bash $SCRIPTS/parallel.sh $FOLDER/process_ren_${DL}_${TW}_${GTR}_${BS} $CPUS
-  waitForFinish 'python'
+  # Filtering, detection, rendering and lightcurves of each observation are
+  # run as soon as the previous stage of the same observation is over.
+  # Stages whose manifest matches their inputs, parameters and code are skipped.
+  Title "Processing observations"
+  python3 -W"ignore" $SCRIPTS/pipeline.py -f $FOLDER -dl $DL -tw $TW -gtr $GTR -bs $BS -cpus $CPUS $TRIAGE -obs ${observations[@]}
 
   Title "Creating big pdf with observations"
   files=()
@@ -219,28 +125,13 @@ time {
   done
   gs -dBATCH -dNOPAUSE -q -sDEVICE=pdfwrite -sOutputFile=$FOLDER/variability_observations_${DL}_${TW}_${GTR}_${BS}.pdf ${files[@]}
 
-  # Generating lightcurves
-  Title "Generating lightcurves"
-  lightcurves 
-  bash $SCRIPTS/parallel.sh $FOLDER/process_lc_${DL}_${TW}_${GTR}_${BS} $CPUS
-  sleep 10; waitForFinish 'evince'
-  sleep 10; waitForFinish 'arfgen'
-  sleep 10; waitForFinish 'epiclccorr'
-  sleep 10; waitForFinish 'python'
-  sleep 10
-
   Title "Creating big pdf with sources"
+  # The lightcurves of each observation are the pages of a single file
   files=()
-  let i=0
-  while read line ; do
-    if [[ $line == [0-9]* ]]; then 
-      IFS=' ' read -r -a array <<< "$line"
-      obs=${array[0]}
-      src=${array[2]}
-      fil=$FOLDER/$obs/lcurve_${TW}/${src}_lc_${TW}.pdf
-      if [ -f $fil ]; then files+=($fil); fi
-    fi
-  done < $FOLDER/sources_variability_${DL}_${TW}_${GTR}_${BS}
+  for obs in ${observations[@]}; do
+    fil=$FOLDER/$obs/lcurve_${TW}/lightcurves_${TW}.pdf
+    if [ -f $fil ]; then files+=($fil); fi
+  done
   gs -dBATCH -dNOPAUSE -q -sDEVICE=pdfwrite -sOutputFile=$FOLDER/lightcurves_${DL}_${TW}_${GTR}_${BS}.pdf ${files[@]}
 
   echo -e "\nTotal execution time for $nb_img obs. : "
@@ -18,6 +18,7 @@
 
 # Default variables
 CPUS=12
+F=false
 # Default folders
 DIR=/mnt/data/Ines/data
 SCRIPTS=/mnt/data/Ines/EXOD
@@ -93,37 +94,26 @@ waitForFinish()
 ########################################################################
 
 # Downloading files
+# Skipped if the files are already there
 
-if [ -f $DIR/$obs/*PIEVLI.FTZ -a -f $DIR/$obs/*FBKTSR*.FTZ -a -f $DIR/$obs/*SUM.ASC ] && [ $F = false ]; then
-  echo "Files downloaded. Skipping"
-else
-
-  Title "DOWNLOADING FILES"
-  bash $SCRIPTS/download_observation.sh $DIR $obs
-
-fi
+Title "DOWNLOADING FILES"
+if [ $F = false ]; then force=""; else force="--force"; fi
+python3 $SCRIPTS/downloader.py -f $DIR -obs $obs $force
 
 cd $DIR/$obs
 
 # Filtering events
+# Skipped if the manifest of the filtered files matches the raw events file
 
-if [ -f PN_clean.fits -a -f PN_gti.fits -a -f PN_image.fits ] && [ $F = false ]; then
-  echo "Files filtered. Skipping"
-else
-
-  Title "FILTERING EVENTS"
-  bash $SCRIPTS/filtering.sh -f $DIR -o $obs -s $SCRIPTS
-
-fi
+Title "FILTERING EVENTS"
+python3 -W"ignore" $SCRIPTS/pipeline.py -f $DIR -obs $obs -stages filtering $force
 
 # Applying detector
 
 Title "APPLYING DETECTOR"
 
-if [ -f $(var CLEAN_FILE) -a -f $(var GTI_FILE) -a -f $(var IMG_FILE) ] && [ $F = false ]; then
-  echo "Variability computed. Rendering"
-  nv="--novar"
-else nv=""; fi
+# The variability is only computed again if the events, parameters or code changed
+if [ $F = false ]; then nv="--novar"; else nv=""; fi
 
   # 8 100 3 1.0
   python3 -W"ignore" $SCRIPTS/detector.py -path $DIR/$obs -bs 3 -dl 8 -tw 100 -gtr 1.0 -mta $CPUS --render $nv
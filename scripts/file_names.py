@@ -19,12 +19,17 @@ Declaration of the file names handled both by the detector and the renderer
 LOG               = "log.txt"
 
 VARIABILITY       = "variability_file.fits"
+CATALOGUE         = "sources_catalogue.fits"
 REGION            = "ds9_variable_sources.reg"
 
 OUTPUT_IMAGE      = "variability.pdf"
 OUTPUT_IMAGE_SRCS = "sources.pdf"
 OUTPUT_IMAGE_ALL  = "variability_whole.pdf"
 
+MANIFEST          = "manifest_{0}.json"
+STATE             = "variability_state_{0:02d}.npz"
+TRIAGE            = "triage.json"
+
 # Observation files
 
 CLEAN_FILE        = "PN_clean.fits"
@@ -32,6 +37,10 @@ GTI_FILE          = "PN_gti.fits"
 IMG_FILE          = "PN_image.fits"
 RATE_FILE         = "PN_rate.fits"
 
+# XMM-Newton Science Archive
+
+ARCHIVE_URL = "http://nxsa.esac.esa.int/nxsa-sl/servlet/data-action-aio"
+
 # software installation paths
 
 HEADAS = "/usr/local/heasoft-6.22.1/x86_64-unknown-linux-gnu-libc2.19"
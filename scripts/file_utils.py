@@ -16,7 +16,6 @@ Various resources for both detector and renderer
 # Built-in imports
 
 import sys
-sys.path.append('/usr/local/lib/python2.7/dist-packages/skimage')
 import os
 import time
 from functools import partial
@@ -25,12 +24,7 @@ import subprocess
 # Third-party imports
 
 from math import *
-from astropy.table import Table
-from astropy import wcs
-from astropy.io import fits
 import numpy as np
-import scipy.ndimage as nd
-import skimage
 
 # Internal imports
 
@@ -230,13 +224,14 @@ class Source(object):
         """
 
         # Launching SAS commands, writing to output file
-        out_file = path + 'variable_sources.txt'
+        out_file = path + 'variable_sources_{0}.txt'.format(os.getpid())
         # The out_file will be temporarily written to the output directory, then removed.
+        # Its name is unique to the process, several detections may run on the same observation.
 
         if self.id_src == 0 : s = '>'
         else :      s = '>>'
 
-        command = """
+        command = f"""
         export SAS_ODF={path};
         export SAS_CCF={path}ccf.cif;
         export HEADAS={FileNames.HEADAS};
@@ -250,7 +245,7 @@ class Source(object):
         process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
         #log_f.write('\n * Source position *\n')
         log_f.write(" * Variable source {0} * ".format(self.id_src))
-        time.sleep(0.5)
+        process.wait()
         with open(out_file) as f:
             for line in f:
                 log_f.write(line)
@@ -323,6 +318,10 @@ def data_transformation(data, header) :
     @return: transformed variability data
     """
 
+    # Imported here, only needed once the variability has been computed
+    import scipy.ndimage as nd
+    from skimage.transform import resize
+
     # Header information
     angle = header['PA_PNT']
     dlim = [header['REFXLMIN'], header['REFXLMAX'], header['REFYLMIN'], header['REFYLMAX']]
@@ -346,7 +345,7 @@ def data_transformation(data, header) :
     ## Rotation
     dataR = np.flipud(nd.rotate(data, angle, reshape = True))
     ## Resizing
-    dataT = skimage.transform.resize(dataR, (pixY, pixX), mode='constant', cval=0.0) # xy reversed
+    dataT = resize(dataR, (pixY, pixX), mode='constant', cval=0.0) # xy reversed
     ## Padding
     dataP = np.pad(dataT, (padY, padX), 'constant', constant_values=0) # xy reversed
 
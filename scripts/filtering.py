@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Events file filtering                                                #
+#                                                                      #
+########################################################################
+"""
+Filtering of the EPIC-pn events without SAS, from a single read of the raw
+events file: the 10-12 keV rate curve, the good time intervals excluding
+the background flares, the clean events and the image binned by 80 pixels
+are all computed from the same events. Same products as filtering.sh, but
+the flaring threshold is chosen automatically from the rate curve.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import re
+import glob
+import argparse
+from math import ceil
+
+# Third-party imports
+
+import numpy as np
+from astropy.io import fits
+
+# Internal imports
+
+import file_names as FileNames
+from fits_extractor import read_events, cleaning, in_gti
+
+# Rate curve of filtering.sh: #XMMEA_EP && (PI in [10000:12000]) && (PATTERN==0)
+RATE_BIN     = 100.0
+RATE_PI_MIN  = 10000
+RATE_PATTERN = 0
+
+# Flaring threshold: n_sigma above the sigma-clipped rate
+N_SIGMA = 3.0
+
+# Binning of the image, in sky pixels
+IMAGE_BIN = 80
+
+# Keywords of an events table describing its columns
+_COLUMN_KEYWORDS = re.compile(r'^(TTYPE|TFORM|TUNIT|TLMIN|TLMAX|TDMIN|TDMAX|TZERO|TSCAL|TNULL|TDISP|TDIM|TCTYP|TCRPX|TCDLT|TCUNI)\d+$')
+_STRUCTURE_KEYWORDS = ('XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'PCOUNT', 'GCOUNT', 'TFIELDS', 'EXTNAME')
+
+########################################################################
+#                                                                      #
+# Good time intervals                                                  #
+#                                                                      #
+########################################################################
+
+def rate_curve(times, t_start, t_stop, bin_size=RATE_BIN) :
+    """
+    Count rate of events in time bins.
+    @param times: Times of the events
+    @param t_start, t_stop: Time span of the observation
+    @param bin_size: Duration of a bin in seconds
+    @return: start time of the bins, rate in counts/s
+    """
+    n_bins = max(1, int(ceil((t_stop - t_start) / bin_size)))
+    edges  = t_start + bin_size * np.arange(n_bins + 1)
+    counts = np.histogram(times, bins=edges)[0]
+
+    return edges[:-1], counts / bin_size
+
+
+def flaring_threshold(rate, bin_size=RATE_BIN, n_sigma=N_SIGMA, iterations=10) :
+    """
+    Rate above which a time bin is considered flaring: n_sigma above the
+    median of the sigma-clipped rate. The deviation is at least the Poisson
+    deviation of the median, so that a quiet rate curve only loses its rare
+    Poisson fluctuations beyond n_sigma.
+    @param rate: Rate in counts/s
+    @param bin_size: Duration of a bin in seconds
+    @return: threshold in counts/s
+    """
+    kept = np.asarray(rate)
+    for i in range(iterations) :
+        median = np.median(kept)
+        sigma  = max(np.std(kept), np.sqrt(max(median * bin_size, 1.0)) / bin_size)
+        clipped = kept[np.abs(kept - median) <= n_sigma * sigma]
+        if len(clipped) == len(kept) or len(clipped) == 0 :
+            break
+        kept = clipped
+
+    return median + n_sigma * sigma
+
+
+def good_time_intervals(bin_starts, rate, threshold, bin_size=RATE_BIN) :
+    """
+    Good time intervals made of the consecutive bins with RATE<=threshold,
+    as tabgtigen does.
+    @return: start, stop arrays
+    """
+    good  = np.concatenate(([False], np.asarray(rate) <= threshold, [False]))
+    edges = np.flatnonzero(np.diff(good.astype(int)))
+
+    return bin_starts[edges[::2]], bin_starts[edges[1::2] - 1] + bin_size
+
+########################################################################
+#                                                                      #
+# Products                                                             #
+#                                                                      #
+########################################################################
+
+def _header_keywords(header) :
+    """
+    Keywords of an events header describing the observation, not the table.
+    """
+    return [card for card in header.cards if card.keyword not in _STRUCTURE_KEYWORDS and not _COLUMN_KEYWORDS.match(card.keyword)]
+
+
+def _column_index(header, name) :
+    for i in range(1, header['TFIELDS'] + 1) :
+        if header['TTYPE{0}'.format(i)].strip() == name :
+            return i
+    raise KeyError("No column {0}".format(name))
+
+
+def events_hdu(events, header) :
+    """
+    Events table with the observation keywords and the column limits of the raw file.
+    """
+    hdu = fits.BinTableHDU(data=events, name='EVENTS')
+    for card in _header_keywords(header) :
+        hdu.header.append(card)
+    for i, name in enumerate(events.dtype.names, 1) :
+        j = _column_index(header, name)
+        for key in ('TUNIT', 'TLMIN', 'TLMAX', 'TDMIN', 'TDMAX') :
+            if '{0}{1}'.format(key, j) in header :
+                hdu.header['{0}{1}'.format(key, i)] = header['{0}{1}'.format(key, j)]
+
+    return hdu
+
+
+def gti_hdu(start, stop) :
+    columns = [fits.Column(name='START', format='D', unit='s', array=start), fits.Column(name='STOP', format='D', unit='s', array=stop)]
+
+    return fits.BinTableHDU.from_columns(columns, name='STDGTI')
+
+
+def image(events, header, bin_size=IMAGE_BIN) :
+    """
+    Image of the events in sky coordinates binned by bin_size, with the WCS
+    of the events file, as evselect makes it.
+    @return: ImageHDU
+    """
+    ix, iy = _column_index(header, 'X'), _column_index(header, 'Y')
+    x_min, x_max = header.get('TLMIN{0}'.format(ix), events['X'].min()), header.get('TLMAX{0}'.format(ix), events['X'].max())
+    y_min, y_max = header.get('TLMIN{0}'.format(iy), events['Y'].min()), header.get('TLMAX{0}'.format(iy), events['Y'].max())
+    nx = int(ceil((x_max - x_min + 1) / bin_size))
+    ny = int(ceil((y_max - y_min + 1) / bin_size))
+
+    counts = np.histogram2d(events['Y'], events['X'], bins=[ny, nx],
+                            range=[[y_min - 0.5, y_min - 0.5 + ny * bin_size], [x_min - 0.5, x_min - 0.5 + nx * bin_size]])[0]
+
+    hdu = fits.PrimaryHDU(data=counts.astype(np.int32))
+    for card in _header_keywords(header) :
+        hdu.header.append(card)
+
+    # Sky coordinates of the image pixels
+    for axis, ref, low in ((1, 'X', x_min), (2, 'Y', y_min)) :
+        if 'REF{0}CRPX'.format(ref) in header :
+            hdu.header['CTYPE{0}'.format(axis)] = header['REF{0}CTYP'.format(ref)]
+            hdu.header['CRPIX{0}'.format(axis)] = (header['REF{0}CRPX'.format(ref)] - low + 0.5) / bin_size + 0.5
+            hdu.header['CRVAL{0}'.format(axis)] = header['REF{0}CRVL'.format(ref)]
+            hdu.header['CDELT{0}'.format(axis)] = header['REF{0}CDLT'.format(ref)] * bin_size
+        # Physical (sky pixel) coordinates
+        hdu.header['LTV{0}'.format(axis)]     = 0.5 - (low - 0.5) / bin_size
+        hdu.header['LTM{0}_{0}'.format(axis)] = 1.0 / bin_size
+
+    return hdu
+
+########################################################################
+#                                                                      #
+# Filtering                                                            #
+#                                                                      #
+########################################################################
+
+def filter_events(raw_file, path, rate=None) :
+    """
+    Writing the rate curve, GTI, clean events and image files of an
+    observation from its raw events file, read once.
+    @param raw_file: Raw events file, possibly compressed (.FTZ)
+    @param path: Folder of the observation, where the products are written
+    @param rate: Flaring threshold in counts/s, chosen from the rate curve if None
+    @return: threshold used, in counts/s
+    """
+    # Events passing #XMMEA_EP && (PATTERN<=4) && (PI in [500:12000]), in
+    # which the ones of the rate curve are included
+    header, events = read_events(raw_file, None, cleaning())
+
+    t_start = header.get('TSTART', events['TIME'].min() if len(events) else 0.0)
+    t_stop  = header.get('TSTOP',  events['TIME'].max() if len(events) else 0.0)
+
+    high = events['TIME'][(events['PI'] >= RATE_PI_MIN) & (events['PATTERN'] == RATE_PATTERN)]
+    bin_starts, rates = rate_curve(high, t_start, t_stop)
+    if rate == None :
+        rate = flaring_threshold(rates)
+    start, stop = good_time_intervals(bin_starts, rates, rate)
+
+    print(" Flaring threshold {0:.3f} counts/s, {1} GTI, {2:.0f} s of {3:.0f} s kept".format(rate, len(start), np.sum(stop - start), t_stop - t_start))
+
+    events = events[in_gti(events['TIME'], {'START' : start, 'STOP' : stop})]
+
+    rate_hdu = fits.BinTableHDU.from_columns([fits.Column(name='TIME', format='D', unit='s', array=bin_starts + RATE_BIN / 2),
+                                              fits.Column(name='RATE', format='E', unit='count/s', array=rates)], name='RATE')
+    fits.HDUList([fits.PrimaryHDU(), rate_hdu]).writeto(os.path.join(path, FileNames.RATE_FILE), overwrite=True)
+    fits.HDUList([fits.PrimaryHDU(), gti_hdu(start, stop)]).writeto(os.path.join(path, FileNames.GTI_FILE), overwrite=True)
+    fits.HDUList([fits.PrimaryHDU(), events_hdu(events, header), gti_hdu(start, stop)]).writeto(os.path.join(path, FileNames.CLEAN_FILE), overwrite=True)
+    fits.HDUList([image(events, header)]).writeto(os.path.join(path, FileNames.IMG_FILE), overwrite=True)
+
+    with open(os.path.join(path, 'PN_processing.log'), 'w') as f :
+        f.write("Rate: {0}\n".format(rate))
+
+    return rate
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--folder", dest="folder", help="Folder containing the observations", type=str)
+    parser.add_argument("-o", "-obs", "--observation", dest="obs", help="Observation identifier", type=str)
+    parser.add_argument("-r", "--rate", dest="rate", help="Flaring threshold in counts/s.\nDefault: chosen from the rate curve", default=None, type=float)
+    args = parser.parse_args()
+
+    path = os.path.join(args.folder, args.obs)
+    raw  = sorted(glob.glob(os.path.join(path, '*{0}PN*PIEVLI*'.format(args.obs))))
+    if not raw :
+        print(" !!!! No raw events file for {0}".format(args.obs), file=sys.stderr)
+        sys.exit(1)
+
+    filter_events(raw[0], path, args.rate)
@@ -14,54 +14,210 @@
 Variability-related procedures specified into the documentation
 """
 
-import time
-
 # Built-in imports
 
+import re
+import time
+import gzip
 from os.path import sys
 
 # Third-party imports
 
+import numpy as np
 from astropy.io import fits
-from astropy import wcs
-from astropy.table import Table
 
+# Columns of the events used by the detector
+EVENT_COLUMNS = ['TIME', 'RAWX', 'RAWY', 'CCDNR', 'PI']
+
+# Cleaning of filtering.sh:
+# #XMMEA_EP && gti(GTI_FILE,TIME) && (PATTERN<=4) && (PI in [500:12000])
+XMMEA_EP    = 0x2fb002c     # FLAG bits rejected by #XMMEA_EP
+MAX_PATTERN = 4
+PI_RANGE    = (500, 12000)
+
+# FITS block size in bytes
+BLOCK = 2880
+
+# Rows of an events table read at once
+CHUNK_ROWS = 1000000
+
+# FITS binary table formats
+_TFORMS = {'L' : 'S1', 'B' : 'u1', 'I' : '>i2', 'J' : '>i4', 'K' : '>i8', 'E' : '>f4', 'D' : '>f8',
+           'C' : '>c8', 'M' : '>c16', 'P' : ('>i4', 2), 'Q' : ('>i8', 2)}
 
 ########################################################################
+#                                                                      #
+# Streamed reading of the events                                       #
+#                                                                      #
+########################################################################
 
+def _open(file) :
+    """
+    Opening a FITS file, decompressed on the fly if it is gzip-compressed (.FTZ).
+    """
+    with open(file, 'rb') as f :
+        magic = f.read(2)
 
-def extraction_photons(events_file):
+    return gzip.open(file, 'rb') if magic == b'\x1f\x8b' else open(file, 'rb')
+
+
+def _skip(f, n_bytes) :
     """
-    Function extracting the E round list from its FITS events file.
-    It alse returns the header information
-    @param events_file: The events FITS file
-    @return: The E round list
-    @return: The events file header
-    @return maximum, minimum
-    @raise Exception: An exception from astropy if something went wrong
+    Skipping bytes of a file that can only be read forward.
     """
+    while n_bytes > 0 :
+        chunk = f.read(min(n_bytes, 1 << 24))
+        if not chunk :
+            raise IOError("Truncated FITS file")
+        n_bytes -= len(chunk)
 
-    # Ouverture du fichier
-    hdulist = fits.open(events_file)
 
-    # Récupération des EVENTS
-    events = hdulist[1].data
-    header = hdulist[1].header
-    events_filtered = []
-    for i in range(12) :
-        events_filtered.append([])
+def _data_size(header) :
+    """
+    Size in bytes of the data of an HDU, padded to the FITS blocks.
+    """
+    if header.get('NAXIS', 0) == 0 :
+        return 0
+    size = abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1)
+    for i in range(1, header['NAXIS'] + 1) :
+        size *= header['NAXIS{0}'.format(i)]
+    size += header.get('PCOUNT', 0)
 
+    return -(-size // BLOCK) * BLOCK
 
-    for evt in events :
-        events_filtered[int(evt['CCDNR'])-1].append(evt)
 
+def _table_dtype(header) :
+    """
+    Numpy record type of the rows of a binary table.
+    """
+    fields = []
+    for i in range(1, header['TFIELDS'] + 1) :
+        repeat, code = re.match(r'\s*(\d*)([A-Z])', header['TFORM{0}'.format(i)]).groups()
+        repeat = int(repeat) if repeat else 1
+        if code == 'A' :
+            fields.append((header['TTYPE{0}'.format(i)], 'S{0}'.format(repeat)))
+            continue
+        if code == 'X' :
+            fmt, repeat = 'u1', (repeat + 7) // 8
+        else :
+            fmt = _TFORMS[code]
+        if isinstance(fmt, tuple) :
+            fmt, repeat = fmt[0], fmt[1] * repeat
+        fields.append((header['TTYPE{0}'.format(i)], fmt) if repeat == 1 else (header['TTYPE{0}'.format(i)], fmt, (repeat,)))
 
-    hdulist.close()
-    events_filtered_sorted = []
-    for i in range(12) :
-        events_filtered_sorted.append(sorted(events_filtered[i], key=lambda k: int(k['TIME'])))
+    return np.dtype(fields)
+
+
+def read_events(events_file, columns=EVENT_COLUMNS, selection=None, extname='EVENTS', chunk_rows=CHUNK_ROWS) :
+    """
+    Reading some columns of an events table by chunks of rows, without
+    decompressing the file to disk nor loading the whole table in memory.
+    @param events_file: FITS file, possibly gzip-compressed
+    @param columns: Names of the columns to keep, all of them if None
+    @param selection: Function of a chunk of rows returning the mask of the rows to keep
+    @param extname: Name of the table extension
+    @param chunk_rows: Number of rows read at once
+    @return: header of the table, record array of the selected rows and columns
+    @raise IOError: if the table is not found
+    """
+    with _open(events_file) as f :
+        header = fits.Header.fromfile(f)
+        while header.get('EXTNAME') != extname :
+            _skip(f, _data_size(header))
+            try :
+                header = fits.Header.fromfile(f)
+            except EOFError :
+                raise IOError("No {0} extension in {1}".format(extname, events_file))
+            if len(header) == 0 :
+                raise IOError("No {0} extension in {1}".format(extname, events_file))
+
+        dtype  = _table_dtype(header)
+        n_rows = header['NAXIS2']
+        if dtype.itemsize != header['NAXIS1'] :
+            raise IOError("Unsupported table format in {0}".format(events_file))
+
+        # Columns kept, widened if they are scaled (e.g. unsigned integers)
+        names  = list(dtype.names)
+        if columns == None :
+            columns = names
+        scales = {}
+        out    = []
+        for c in columns :
+            i = names.index(c) + 1
+            scales[c] = (header.get('TSCAL{0}'.format(i), 1), header.get('TZERO{0}'.format(i), 0))
+            if scales[c] == (1, 0) :
+                out.append((c, dtype[c].newbyteorder('=')))
+            else :
+                out.append((c, 'i8' if all(float(v).is_integer() for v in scales[c]) and dtype[c].kind in 'iu' else 'f8'))
 
-    return events_filtered_sorted, header
+        chunks = []
+        for start in range(0, n_rows, chunk_rows) :
+            n = min(chunk_rows, n_rows - start)
+            rows = np.frombuffer(f.read(n * dtype.itemsize), dtype=dtype)
+            if len(rows) != n :
+                raise IOError("Truncated FITS file {0}".format(events_file))
+            if selection != None :
+                rows = rows[selection(rows)]
+            chunk = np.empty(len(rows), dtype=out)
+            for c in columns :
+                scale, zero = scales[c]
+                chunk[c] = rows[c] if (scale, zero) == (1, 0) else rows[c].astype(chunk.dtype[c]) * scale + zero
+            chunks.append(chunk)
+
+    events = np.concatenate(chunks) if chunks else np.empty(0, dtype=out)
+
+    return header, events.view(np.recarray)
+
+
+def in_gti(times, gti) :
+    """
+    Mask of the times within the good time intervals, START <= TIME < STOP.
+    @param times: array of times
+    @param gti: GTI table with START and STOP columns, sorted
+    """
+    start = np.asarray(gti['START'])
+    stop  = np.asarray(gti['STOP'])
+    i     = np.searchsorted(start, times, side='right') - 1
+
+    return (i >= 0) & (times < stop[np.maximum(i, 0)])
+
+
+def cleaning(gti=None) :
+    """
+    Selection of the events kept by filtering.sh, for read_events.
+    @param gti: GTI table, the time is not filtered if None
+    """
+    def selection(rows) :
+        keep  = (rows['FLAG'] & XMMEA_EP) == 0
+        keep &= rows['PATTERN'] <= MAX_PATTERN
+        keep &= (rows['PI'] >= PI_RANGE[0]) & (rows['PI'] <= PI_RANGE[1])
+        if gti is not None :
+            keep &= in_gti(rows['TIME'], gti)
+        return keep
+
+    return selection
+
+########################################################################
+
+
+def extraction_photons(events_file, gti=None):
+    """
+    Function extracting the E round list from its FITS events file.
+    It alse returns the header information
+    @param events_file: The events FITS file, clean or raw, possibly compressed
+    @param gti: GTI table. If given, the events are cleaned as by filtering.sh,
+    hence a raw events file can be read directly
+    @return: The E round list, the events of each CCD sorted by TIME
+    @return: The events file header
+    @raise Exception: An exception from astropy if something went wrong
+    """
+    header, events = read_events(events_file, EVENT_COLUMNS, cleaning(gti) if gti is not None else None)
+
+    # Sorting by CCD, then by time
+    events = events[np.lexsort((events['TIME'], events['CCDNR']))]
+    bounds = np.searchsorted(events['CCDNR'], np.arange(1, 14))
+
+    return [events[bounds[i]:bounds[i+1]] for i in range(12)], header
 
 ########################################################################
 
@@ -90,7 +246,24 @@ def extraction_deleted_periods(gti_file):
 
 ########################################################################
 
-def fits_writer(data, sources, image, pars, file) :
+def quick_look_hdu(ids, time_windows, counts, epochs, tw) :
+    """
+    Table of the quick-look lightcurves, a row per source.
+    """
+    n = len(time_windows)
+    columns = [fits.Column(name='ID', format='I', array=ids),
+               fits.Column(name='TIME', format='{0}D'.format(n), unit='s', array=np.tile(time_windows, (len(ids), 1))),
+               fits.Column(name='COUNTS', format='{0}E'.format(n), unit='count', array=counts),
+               fits.Column(name='PEAK', format='J', array=epochs),
+               fits.Column(name='T_PEAK', format='D', unit='s', array=np.asarray(time_windows)[epochs] if len(ids) else [])]
+    hdu = fits.BinTableHDU.from_columns(columns, name='LIGHTCURVES')
+    hdu.header['TIMEDEL'] = (tw, '[s] EXOD Time window')
+    hdu.header['TIMEPIXR'] = (0.0, 'TIME is the start of the window')
+
+    return hdu
+
+
+def fits_writer(data, sources, image, pars, file, lightcurves=None, bands=None, statistics=None) :
     """
     Function writing the variability and sources to a fits file
     @param data: image of the variability data
@@ -98,6 +271,13 @@ def fits_writer(data, sources, image, pars, file) :
     @param image: image obtained with evselect, needed for the header
     @param pars: variability parameters used in the variability computation
     @param file: output file name
+    @param lightcurves: quick-look lightcurves of the sources, (start of the
+    time windows, counts of shape (sources, time windows), index of the flare
+    window of each source), written in the LIGHTCURVES extension
+    @param bands: variability per energy band, (edges of the PI bands, images
+    of the variability of each band), written in the BAND1, BAND2... extensions
+    @param statistics: images of other statistics of variability by name,
+    written in the extensions of the same name
     """
 
     hdulist    = fits.open(image)
@@ -110,6 +290,10 @@ def fits_writer(data, sources, image, pars, file) :
     head_var_f.append(card=('GTR', pars['GTR'], 'EXOD Good time ratio'))
     head_var_f.append(card=('DL', pars['DL'], 'EXOD Detection level'))
     head_var_f.append(card=('BS', pars['BS'], '[pix] EXOD Box size'))
+    if pars.get('STEP') != None :
+        head_var_f.append(card=('STEP', pars['STEP'], '[s] EXOD Step of the overlapping time windows'))
+    if pars.get('TARGET') != None :
+        head_var_f.append(card=('TARGET', pars['TARGET'], 'EXOD Target counts of the adaptive time windows'))
 
     # data_var_f = Table(names=('VARIABILITY', 'RAWX', 'RAWY', 'CCDNR'), dtype=('f8', 'i2', 'i2', 'i2'))
 
@@ -119,6 +303,18 @@ def fits_writer(data, sources, image, pars, file) :
     hdul_src = fits.BinTableHDU(data=sources)
     hdul_f.append(hdul_var)
     hdul_f.append(hdul_src)
+    if lightcurves != None and len(lightcurves[0]) > 0 :
+        hdul_f.append(quick_look_hdu(sources['ID'], *lightcurves, tw=pars['TW']))
+    if bands != None :
+        edges, images = bands
+        for i, band in enumerate(images) :
+            hdul_band = fits.ImageHDU(data=band, header=head_var_f.copy(), name='BAND{0}'.format(i + 1))
+            hdul_band.header['PI_MIN'] = (edges[i], '[eV] EXOD Lower edge of the energy band')
+            hdul_band.header['PI_MAX'] = (edges[i + 1], '[eV] EXOD Upper edge of the energy band')
+            hdul_f.append(hdul_band)
+    if statistics != None :
+        for name, stat in statistics.items() :
+            hdul_f.append(fits.ImageHDU(data=stat, header=head_var_f.copy(), name=name))
 
     # Writing to file
     hdul_f.writeto(file, overwrite=True)
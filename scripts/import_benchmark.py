@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Start-up time benchmark of the detector                              #
+#                                                                      #
+########################################################################
+"""
+Measuring the time needed to import the detector in a fresh interpreter.
+The batch drivers start one process per observation and parameter set,
+so the import time of the detector is paid tens of thousands of times.
+The benchmark fails (exit code 1) if the median start-up time exceeds the
+budget or if a heavy module is loaded by the import alone.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import time
+import subprocess
+import argparse
+
+# Modules only needed by optional stages (rendering, geometrical
+# transformations). They shall not be loaded by a plain import.
+HEAVY_MODULES = ['matplotlib', 'pylab', 'scipy', 'skimage', 'astropy.table', 'astropy.coordinates']
+
+########################################################################
+#                                                                      #
+# Functions                                                            #
+#                                                                      #
+########################################################################
+
+def import_time(module, repeat=5) :
+    """
+    Measuring the wall time of an import in fresh interpreters.
+    @param module: name of the module to import
+    @param repeat: number of interpreters started
+    @return: list of the measured times in seconds, baseline interpreter time removed
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code) :
+        t0 = time.time()
+        subprocess.run([sys.executable, '-c', code], cwd=folder, check=True)
+        return time.time() - t0
+
+    times = []
+    for i in range(repeat) :
+        empty = run('pass')
+        times.append(run('import {0}'.format(module)) - empty)
+
+    return times
+
+
+def loaded_heavy_modules(module) :
+    """
+    Listing the heavy modules loaded as a side effect of an import.
+    @param module: name of the module to import
+    @return: list of module names from HEAVY_MODULES present in sys.modules
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    code = 'import sys, {0}; print(" ".join(m for m in {1} if m in sys.modules))'.format(module, HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], cwd=folder, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+
+    return out.stdout.split()
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-module", help="Module whose import is measured", default="detector", type=str)
+    parser.add_argument("-budget", help="Maximal median import time in seconds.\nDefault: 1.0", default=1.0, type=float)
+    parser.add_argument("-n", help="Number of measurements", default=5, type=int)
+    args = parser.parse_args()
+
+    times  = sorted(import_time(args.module, args.n))
+    median = times[len(times) // 2]
+    heavy  = loaded_heavy_modules(args.module)
+
+    print(" Import of {0} : median {1:.3f} s, min {2:.3f} s, max {3:.3f} s (budget {4:.3f} s)".format(args.module, median, times[0], times[-1], args.budget))
+
+    status = 0
+    if heavy :
+        print(" !!!! Heavy modules loaded at import : {0}".format(', '.join(heavy)))
+        status = 1
+    if median > args.budget :
+        print(" !!!! Start-up budget exceeded")
+        status = 1
+
+    sys.exit(status)
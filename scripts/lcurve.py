@@ -10,257 +10,363 @@
 # Inés Pastor Marazuela (2019) - ines.pastor.marazuela@gmail.com       #
 #                                                                      #
 ########################################################################
-
+"""
+Plots of the lightcurves of the sources. Any number of lightcurves are
+drawn in the same process on the same figure, and written as the pages of
+a single PDF file or as one image per lightcurve.
+"""
 
 # Built-in imports
 
-from math import *
+import sys
 from os import path
-from os.path import sys
 
 # Third-party imports
 
 import argparse
 import numpy as np
 import matplotlib as mpl
+mpl.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from matplotlib.ticker import FormatStrFormatter
-from scipy.stats import binned_statistic
+from matplotlib.backends.backend_pdf import PdfPages
 from astropy.io import fits
 
 ###
-# Parsing arguments
+# Plot styles
 ###
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-path", dest="path", help="Path to the observation files", nargs='?', type=str)
-parser.add_argument("-name", dest="name", help="Source name", nargs='?', type=str)
-parser.add_argument("-obs", help="Observation identifier", nargs='?', type=str, default="")
-parser.add_argument("-src", help="Path to the source's lightcurve fits file", nargs='?', type=str, default=None)
-parser.add_argument("-bgd", help="Path to the background's lightcurve fits file", nargs='?', type=str, default=None)
-parser.add_argument("-gti", help="Path to the GTI of the observation", nargs='?', type=str, default=None)
-parser.add_argument("-tw", help="Time window", nargs='?', type=int, default=100)
-parser.add_argument("-n", help="Lightcurve number", nargs='?', type=str, default="")
-parser.add_argument("-pcs", dest="pcs", help="Chi-square probability of constancy", nargs='?', type=float, default=None)
-parser.add_argument("-pks", dest="pks", help="Kolmogorov-Smirnov probability of constancy", nargs='?', type=float, default=None)
-parser.add_argument("-mode", dest="mode", help="Plot style: monochrome / medium / color", nargs='?', type=str, default="medium")
-args = parser.parse_args()
+#seaborn-colorblind
+color = ['#01b4bc', '#009E73', '#D55E00', '#fa5457', '#f6d51f', '#56B4E9']
+
+STYLES = {
+    'mono'   : {'errorbar' : {'fmt' : 'o', 'color' : 'k', 'markersize' : 4, 'elinewidth' : 1.0, 'zorder' : 6},
+                'source'   : {'fmt' : '-', 'linewidth' : 0.5, 'color' : 'k', 'zorder' : 6},
+                'band'     : None,
+                'lines'    : {'color' : 'k', 'linewidth' : 1, 'zorder' : 4},
+                'gap'      : {'hatch' : '\\\\\\', 'facecolor' : 'none', 'edgecolor' : 'k', 'zorder' : 1},
+                'edges'    : {'color' : 'w', 'lw' : 3, 'zorder' : 2}},
+    'medium' : {'errorbar' : None,
+                'source'   : {'fmt' : 'o-', 'linewidth' : 0.7, 'markersize' : 2, 'color' : 'k', 'zorder' : 2},
+                'band'     : {'alpha' : 0.3, 'color' : 'c', 'zorder' : 2},
+                'lines'    : {'color' : '#54008c', 'linewidth' : 1, 'zorder' : 4},
+                'gap'      : {'facecolor' : 'k', 'alpha' : 0.2, 'edgecolor' : 'None', 'zorder' : 1},
+                'edges'    : None},
+    'color'  : {'errorbar' : None,
+                'source'   : {'fmt' : 'o-', 'linewidth' : 0.7, 'markersize' : 2, 'color' : color[0], 'zorder' : 2},
+                'band'     : {'alpha' : 0.2, 'color' : color[0]},
+                'lines'    : {'color' : color[3], 'linewidth' : 1, 'zorder' : 4},
+                'gap'      : {'alpha' : 0.2, 'color' : color[4]},
+                'edges'    : None},
+}
+
+
+def plot_style(mode) :
+    """
+    Style of a plot mode: monochrome / medium / color.
+    """
+    if "mono" in mode :
+        return STYLES['mono']
+    if "colo" in mode :
+        return STYLES['color']
+
+    return STYLES['medium']
 
 ###
-# Defining variables
+# Lightcurves
 ###
 
-# Path
-if args.path[-1] == '/' :
-    args.path = args.path[:-1]
-
-# Source and background files
-if args.src == None :
-    lccorr = '{0}/{1}/lcurve_{2}/{3}_lccorr_{2}.lc'.format(args.path, args.obs, args.tw, args.name)
-    print(args.name)
-    if path.exists(lccorr) :
-        args.src = lccorr
-    else : 
-        args.src = '{0}/{1}/lcurve_{2}/{3}_lc_{2}_src.lc'.format(args.path, args.obs, args.tw, args.name)
-        args.bgd = '{0}/{1}/lcurve_{2}/{3}_lc_{2}_bgd.lc'.format(args.path, args.obs, args.tw, args.src)
-        if not path.exists(args.name) :
-            print('ERROR: Source File {0} does not exist'.format(args.src))
-            sys.exit()
-        if not path.exists(args.name) :
-            print('ERROR: Background File {0} does not exist'.format(args.bgd))
-            sys.exit()
-        
-# GTI file
-if args.gti == None :
-    args.gti = '{0}/{1}/PN_gti.fits'.format(args.path, args.obs)
-    if not path.exists(args.gti) :
-        print('ERROR: File {0} does not exist'.format(args.gti))
-        sys.exit()
-        
-# Output file
-src = (args.name).replace("_", "+")
-out='{0}/{1}/lcurve_{2}/{3}_lc_{2}.pdf'.format(args.path, args.obs, args.tw, args.name)
-print(out)
+def subtract_background(time, cts, std, time_bgd, cts_bgd, std_bgd) :
+    """
+    Subtracting the background rate from the source bins starting at the
+    same time, the errors added in quadrature.
+    @return: cts, std
+    """
+    cts = np.array(cts, dtype=float)
+    std = np.array(std, dtype=float)
+    if len(time_bgd) == 0 :
+        return cts, std
+
+    i    = np.clip(np.searchsorted(time_bgd, time), 0, len(time_bgd) - 1)
+    same = np.isclose(time_bgd[i], time, rtol=0, atol=1e-6)
+    cts[same] -= cts_bgd[i[same]]
+    std[same]  = np.hypot(std[same], std_bgd[i[same]])
+
+    return cts, std
+
+
+def gap_mask(time, start_gap, stop_gap) :
+    """
+    Mask of the times strictly within the intervals between the GTI.
+    @param start_gap, stop_gap: sorted bounds of the intervals
+    """
+    if len(start_gap) == 0 :
+        return np.zeros(len(time), dtype=bool)
+    j = np.searchsorted(start_gap, time, side='left') - 1
+
+    return (j >= 0) & (time < stop_gap[np.maximum(j, 0)])
+
+
+def read_lightcurve(src_file, bgd_file=None, gti_file=None) :
+    """
+    Reading a lightcurve, its background subtracted, and keeping the
+    positive rates within the GTI.
+    @param src_file: Source lightcurve, background subtracted if bgd_file is None
+    @param bgd_file: Background lightcurve
+    @param gti_file: Good time intervals of the observation
+    @return: dictionary with time (from TSTART), cts, std and the start_gap,
+    stop_gap intervals between the GTI, None if no rate is positive
+    """
+    hdu_src  = fits.open(src_file)
+    data_src = hdu_src[1].data
+    head_src = hdu_src[1].header
+    hdu_src.close()
+
+    cts  = data_src['RATE']
+    time = data_src['TIME']
+    std  = data_src['ERROR']
+
+    tstart = head_src['TSTART']
+    tstop  = head_src['TSTOP']
+
+    # Background
+    if bgd_file != None :
+        data_bgd = fits.getdata(bgd_file, 1)
+        cts, std = subtract_background(time, cts, std, data_bgd['TIME'], data_bgd['RATE'], data_bgd['ERROR'])
+    else :
+        cts, std = np.array(cts, dtype=float), np.array(std, dtype=float)
+
+    time = time - tstart
+
+    # Intervals between the GTI, drawn only if there are several GTI
+    start_gap = stop_gap = np.array([])
+    if gti_file != None :
+        data_gti = fits.getdata(gti_file, 1)
+        start    = data_gti['START']
+        stop     = data_gti['STOP']
+
+        if len(data_gti) > 0 :
+            start_gap = np.insert(stop, 0, tstart) - tstart
+            stop_gap  = np.insert(start, len(data_gti), tstop) - tstart
+        else :
+            start_gap = np.array([tstart]) - tstart
+            stop_gap  = np.array([tstop]) - tstart
+
+        # GTI inclusion
+        good = ~gap_mask(time, start_gap, stop_gap)
+        cts, time, std = cts[good], time[good], std[good]
+        if len(data_gti) <= 1 :
+            start_gap = stop_gap = np.array([])
+
+    # Positive rates
+    cdt  = np.isfinite(cts)
+    time = time[cdt]
+    cts  = np.clip(cts[cdt], 0, None)
+    std  = std[cdt]
+
+    nonzero = cts != 0
+    if not np.any(nonzero) :
+        return None
+
+    return {'time' : time[nonzero], 'cts' : cts[nonzero], 'std' : std[nonzero], 'start_gap' : start_gap, 'stop_gap' : stop_gap}
 
 ###
-# Extracting information from fits files
+# Plotting
 ###
 
-# Source
-hdu_src = fits.open(args.src)
-data_src    = hdu_src[1].data
-head_src    = hdu_src[1].header
-hdu_src.close()
-
-cts  = data_src[:]['RATE']
-time = data_src[:]['TIME']
-std  = data_src[:]['ERROR']
-
-tstart = head_src['TSTART']
-tstop  = head_src['TSTOP']
-t0     = time[0]
-tf     = time[-1]
-time   = time - tstart
-
-# Background
-if args.bgd != None :
-    hdu_bgd = fits.open(args.bgd)
-    data_bgd    = hdu_bgd[1].data
-    head_bgd    = hdu_bgd[1].header
-    hdu_bgd.close()
-
-    cts_bgd  = data_bgd[:]['RATE']
-    time_bgd = data_bgd[:]['TIME']
-    std_bgd  = data_bgd[:]['ERROR']
-
-    for t_s in range(len(time)) :
-        for t_b in range(len(time_bgd)) :
-            if time[t_s] == time_bgd[t_s] :
-                cts[t_s] == cts[t_s] - cts_bgd[t_b]
-
-# GTI
-if args.gti != None :
-    hdulist_gti = fits.open(args.gti)
-    data_gti    = hdulist_gti[1].data
-    hdulist_gti.close()
-
-    start = data_gti[:]['START']
-    stop  = data_gti[:]['STOP']
-
-    #time_bgd  = time_bgd - tstart
-    if len(data_gti) > 1 :
-        start_gti = np.insert(stop, 0, tstart) - tstart
-        stop_gti  = np.insert(start, len(data_gti), tstop) - tstart
-    elif len(data_gti) == 0 :
-        start_gti = np.array([tstart])
-        stop_gti  = np.array([tstop])
+def draw_lightcurve(ax, lc, style, name, obs="", n="", pcs=None, pks=None) :
+    """
+    Drawing a lightcurve on an empty axis.
+    @param lc: dictionary returned by read_lightcurve
+    @param style: one of STYLES
+    """
+    time, cts, std = lc['time'], lc['cts'], lc['std']
+
+    # Max, min, etc
+    xmin = time[0]
+    xmax = time[-1]
+    ymin = 0
+    ymax = np.max(cts + std)
+
+    med = np.median(cts)
+    i_max = np.argmax(cts)
+    i_min = np.argmin(cts)
+    if cts[i_max] - med > med - cts[i_min] :
+        index, label = i_max, "Maximum"
     else :
-        start_gti = np.array([])
-        stop_gti  = np.array([])
-
-    # GTI inclusion
-    if len(start_gti) > 0 :
-        for i in range(len(start_gti)) :
-            cdt  = np.where((time > start_gti[i]) & (time < stop_gti[i]))
-            cts  = np.delete(cts, cdt)
-            time = np.delete(time, cdt)
-            std  = np.delete(std, cdt)
-else : data_gti=[]
-
-# Binning data
-
-# if dt > tw :
-#     time_bin = np.linspace()
-#     cts_bin, cts_edges, binnumber = binned_statistic(cts)
-
-cdt  = np.where(np.isfinite(cts) == True)
-time = time[cdt]
-cts  = cts[cdt]
-std  = std[cdt]
-
-for i in range(len(cts)) :
-    if cts[i] < 0 :
-        cts[i] = 0
-
-time = time[cts != 0]
-std  = std[cts != 0]
-cts  = cts[cts != 0]
-
-# Max, min, etc
-
-xmin = time[0]
-xmax = time[-1]
-ymin = 0
-ymax = np.max(cts + std)
-
-med = np.median(cts)
-max = np.argmax(cts)    # Argument of the max
-min = np.argmin(cts)    # Argument of the min
-med = np.median(cts)
-
-if cts[max] - med > med - cts[min] :
-    var = max - med
-    index   = max
-    var_min = med/(ymax-ymin) - ymin/(ymax-ymin)
-    var_max = cts[index]/(ymax-ymin) - ymin/(ymax-ymin)
-    label = "Maximum"
-else :
-    var = med - min
-    index   = min
-    var_min = cts[index]/(ymax-ymin) - ymin/(ymax-ymin)
-    var_max = med/(ymax-ymin) - ymin/(ymax-ymin)
-    label   = "Minimum"
+        index, label = i_min, "Minimum"
+
+    # Source
+    if style['errorbar'] != None :
+        ax.errorbar(time, cts, yerr=std, **style['errorbar'])
+    fmt = style['source']['fmt']
+    ax.plot(time, cts, fmt, label="Source", **{k : v for k, v in style['source'].items() if k != 'fmt'})
+    if style['band'] != None :
+        ax.fill_between(time, cts - std, cts + std, **style['band'])
+    # Max/min, median
+    ax.axhline(med, linestyle='--', label="Median", **style['lines'])
+    ax.axhline(cts[index], linestyle=':', label=label, **style['lines'])
+    # GTI
+    for start, stop in zip(lc['start_gap'], lc['stop_gap']) :
+        ax.axvspan(start, stop, **style['gap'])
+        if style['edges'] != None :
+            ax.axvline(start, **style['edges'])
+            ax.axvline(stop, **style['edges'])
+
+    # Labels
+    ax.set_xlabel("Time (s)", fontsize=16)
+    ax.set_ylabel("counts s$^{-1}$", fontsize=16)
+    # Text
+    ax.text(0.03, 0.90, n, transform=ax.transAxes, fontsize=16)
+    ax.text(0.1, 0.90, "OBS {0}".format(obs), transform=ax.transAxes, fontsize=16)
+    ax.text(0.1, 0.80, name.replace("_", "+"), transform=ax.transAxes, fontsize=16)
+    # Probabilities of constancy
+    if pcs != None :
+        ax.text(0.95, 0.90, r"P($\chi^2$) = {0:.2e} ".format(pcs), horizontalalignment='right', transform=ax.transAxes, fontsize=16)
+    if pks != None :
+        ax.text(0.95, 0.80, r"P(KS) = {0:.2e} ".format(pks), horizontalalignment='right', transform=ax.transAxes, fontsize=16)
+    # Setup
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+    ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    ax.xaxis.set_major_locator(plt.MaxNLocator(5))
+    ax.minorticks_on()
+    ax.yaxis.set_ticks_position('both')
+    ax.xaxis.set_ticks_position('both')
+    ax.tick_params(axis='both', which='both', direction='in', labelsize=14)
+
+
+def plot_lightcurves(lightcurves, out, mode="medium") :
+    """
+    Plotting lightcurves on a single figure, cleared between them.
+    @param lightcurves: list of dictionaries with the arguments of
+    read_lightcurve (src_file, bgd_file, gti_file) and of draw_lightcurve
+    (name, obs, n, pcs, pks)
+    @param out: PDF file whose pages are the lightcurves, or name of the image
+    of each lightcurve formatted with its keys, as '{obs}_{name}.png'
+    @param mode: Plot style: monochrome / medium / color
+    @return: number of lightcurves plotted
+    """
+    style = plot_style(mode)
+    rcParams['font.family'] = 'serif'
+    rcParams['hatch.linewidth'] = 0.1
+
+    fig, ax = plt.subplots(figsize=(7,5))
+    pdf = PdfPages(out) if out.lower().endswith('.pdf') else None
+    n_plots = 0
+    try :
+        for entry in lightcurves :
+            lc = read_lightcurve(entry['src_file'], entry.get('bgd_file'), entry.get('gti_file'))
+            if lc == None :
+                print(" !!!! No positive rate in {0}, not plotted".format(entry['src_file']))
+                continue
+            ax.cla()
+            draw_lightcurve(ax, lc, style, entry['name'], entry.get('obs', ""), entry.get('n', ""), entry.get('pcs'), entry.get('pks'))
+            if pdf != None :
+                pdf.savefig(fig, pad_inches=0, bbox_inches='tight')
+            else :
+                fig.savefig(out.format(**entry), pad_inches=0, bbox_inches='tight')
+            n_plots += 1
+    finally :
+        if pdf != None :
+            pdf.close()
+        plt.close(fig)
+
+    return n_plots
+
+
+def lightcurve_files(folder, obs, name, tw) :
+    """
+    Lightcurve files written for a source, the corrected one if it exists.
+    @return: src_file, bgd_file, gti_file
+    """
+    lccorr = '{0}/{1}/lcurve_{2:g}/{3}_lccorr_{2:g}.lc'.format(folder, obs, tw, name)
+    gti    = '{0}/{1}/PN_gti.fits'.format(folder, obs)
+    if path.exists(lccorr) :
+        return lccorr, None, gti
+
+    return ('{0}/{1}/lcurve_{2:g}/{3}_lc_{2:g}_src.lc'.format(folder, obs, tw, name),
+            '{0}/{1}/lcurve_{2:g}/{3}_lc_{2:g}_bgd.lc'.format(folder, obs, tw, name), gti)
+
+
+def read_log(log_file, folder, tw) :
+    """
+    Lightcurves of the sources of an output log, with lines
+    'obs id name dl tw P_chisq P_KS'.
+    @return: list of dictionaries for plot_lightcurves
+    """
+    lightcurves = []
+    with open(log_file) as f :
+        for line in f :
+            fields = line.split()
+            if len(fields) < 7 or not fields[0][0].isdigit() :
+                continue
+            obs, n, name = fields[:3]
+            src_file, bgd_file, gti_file = lightcurve_files(folder, obs, name, tw)
+            if not path.exists(src_file) :
+                continue
+            lightcurves.append({'src_file' : src_file, 'bgd_file' : bgd_file, 'gti_file' : gti_file, 'name' : name,
+                                'obs' : obs, 'n' : n, 'pcs' : float(fields[5]), 'pks' : float(fields[6])})
+
+    return lightcurves
+
 ###
-# Plotting
+# Main programme
 ###
 
-#seaborn-colorblind
-color = ['#01b4bc', '#009E73', '#D55E00', '#fa5457', '#f6d51f', '#56B4E9']
-rcParams['font.family'] = 'serif'
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-path", dest="path", help="Path to the observation files", nargs='?', type=str)
+    parser.add_argument("-name", dest="name", help="Source name", nargs='?', type=str)
+    parser.add_argument("-obs", help="Observation identifier", nargs='?', type=str, default="")
+    parser.add_argument("-src", help="Path to the source's lightcurve fits file", nargs='?', type=str, default=None)
+    parser.add_argument("-bgd", help="Path to the background's lightcurve fits file", nargs='?', type=str, default=None)
+    parser.add_argument("-gti", help="Path to the GTI of the observation", nargs='?', type=str, default=None)
+    parser.add_argument("-tw", help="Time window", nargs='?', type=int, default=100)
+    parser.add_argument("-n", help="Lightcurve number", nargs='?', type=str, default="")
+    parser.add_argument("-pcs", dest="pcs", help="Chi-square probability of constancy", nargs='?', type=float, default=None)
+    parser.add_argument("-pks", dest="pks", help="Kolmogorov-Smirnov probability of constancy", nargs='?', type=float, default=None)
+    parser.add_argument("-mode", dest="mode", help="Plot style: monochrome / medium / color", nargs='?', type=str, default="medium")
+    parser.add_argument("-log", dest="log", help="Output log of the sources, all plotted at once", nargs='?', type=str, default=None)
+    parser.add_argument("-out", dest="out", help="Output PDF file, or image name formatted with {obs}, {name}, {n}", nargs='?', type=str, default=None)
+    args = parser.parse_args()
+
+    # Path
+    if args.path != None and args.path[-1] == '/' :
+        args.path = args.path[:-1]
+
+    # All the sources of a log
+    if args.log != None :
+        out = args.out if args.out != None else '{0}/lightcurves_{1:g}.pdf'.format(args.path, args.tw)
+        n_plots = plot_lightcurves(read_log(args.log, args.path, args.tw), out, args.mode)
+        print("{0} lightcurves plotted in {1}".format(n_plots, out))
+        sys.exit(0)
+
+    # Source and background files
+    if args.src == None :
+        print(args.name)
+        args.src, args.bgd, gti = lightcurve_files(args.path, args.obs, args.name, args.tw)
+        if args.gti == None :
+            args.gti = gti
+        if not path.exists(args.src) :
+            print('ERROR: Source File {0} does not exist'.format(args.src))
+            sys.exit()
+        if args.bgd != None and not path.exists(args.bgd) :
+            print('ERROR: Background File {0} does not exist'.format(args.bgd))
+            sys.exit()
 
-fig, ax = plt.subplots(figsize=(7,5))
+    # GTI file
+    if args.gti == None :
+        args.gti = '{0}/{1}/PN_gti.fits'.format(args.path, args.obs)
+        if not path.exists(args.gti) :
+            print('ERROR: File {0} does not exist'.format(args.gti))
+            sys.exit()
 
-# Source
+    # Output file
+    out = args.out if args.out != None else '{0}/{1}/lcurve_{2:g}/{3}_lc_{2:g}.pdf'.format(args.path, args.obs, args.tw, args.name)
+    print(out)
 
-if "mono" in args.mode :
-    # Data
-    plt.errorbar(time, cts, yerr=std, fmt='o', color='k', markersize=4, elinewidth=1.0, zorder=6)
-    plt.plot(time, cts, "-", linewidth=0.5, color='k', label="Source",zorder=6)
-    # Max/min, median
-    plt.axhline(med, xmin=0, xmax=1, linestyle='--', color='k', linewidth=1, zorder=4, label="Median")
-    plt.axhline(cts[index], xmin=0, xmax=1, linestyle=':', color='k', linewidth=1, zorder=4, label=label)
-    # GTI
-    if len(data_gti) > 1 :
-        for i in range(len(data_gti)) :
-            mpl.rcParams['hatch.linewidth'] = 0.1
-            ax.axvspan(start_gti[i], stop_gti[i], hatch='\\\\\\', facecolor='none', edgecolor='k', zorder=1)
-            ax.axvline(start_gti[i], color='w', lw=3, zorder=2)
-            ax.axvline(stop_gti[i], color='w', lw=3, zorder=3)
-            #ax.Axes_fill_betweenx([-1,100], start_gti[i], stop_gti[i], )
-if "med" in args.mode :
-    # Data
-    plt.plot(time, cts, "o-", linewidth=0.7, markersize=2, color='k', label="Source",zorder=2)
-    plt.fill_between(time, cts - std, cts + std, alpha=0.3, color='c', zorder=2)
-    # Max/min, median
-    plt.axhline(med, xmin=0, xmax=1, linestyle='--', color='#54008c', linewidth=1, zorder=4, label="Median")
-    plt.axhline(cts[index], xmin=0, xmax=1, linestyle=':', color='#54008c', linewidth=1, zorder=4, label=label)
-    # GTI
-    if len(data_gti) > 1 :
-        for i in range(len(data_gti)) :
-            mpl.rcParams['hatch.linewidth'] = 0.1
-            ax.axvspan(start_gti[i], stop_gti[i], facecolor= 'k', alpha=0.2, edgecolor='None', zorder=1)
-elif "colo" in args.mode :
-    # Data
-    plt.plot(time, cts, 'o', markersize=2, color=color[0], zorder=6)
-    plt.plot(time, cts, "o-", linewidth=0.7, markersize=2, color=color[0], label="Source",zorder=2)
-    plt.fill_between(time, cts - std, cts + std, alpha=0.2, color=color[0])
-    # Lines
-    plt.axhline(med, xmin=0, xmax=1, linestyle='--', color=color[3], linewidth=1, zorder=3, label="Median")
-    plt.axhline(cts[index], xmin=0, xmax=1, linestyle=':', color=color[3], linewidth=1, zorder=4, label=label)
-    # GTI
-    if len(data_gti) > 1 :
-        for i in range(len(data_gti)) :
-            ax.axvspan(start_gti[i], stop_gti[i], alpha=0.2, color=color[4])
-# Labels
-#plt.legend(loc='upper right', fontsize=10)
-plt.xlabel("Time (s)", fontsize=16)
-plt.ylabel("counts s$^{-1}$", fontsize=16)
-# Text
-plt.text(0.03, 0.90, args.n, transform = ax.transAxes, fontsize=16)
-plt.text(0.1, 0.90, "OBS {0}".format(args.obs), transform = ax.transAxes, fontsize=16)
-plt.text(0.1, 0.80, src, transform = ax.transAxes, fontsize=16)
-# Probabilities of constancy
-plt.text(0.95, 0.90, r"P($\chi^2$) = {0:.2e} ".format(args.pcs), horizontalalignment='right', transform = ax.transAxes, fontsize=16)
-plt.text(0.95, 0.80, r"P(KS) = {0:.2e} ".format(args.pks), horizontalalignment='right', transform = ax.transAxes, fontsize=16)
-# Setup
-plt.xlim(xmin, xmax)
-plt.ylim(ymin, ymax)
-ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
-ax.xaxis.set_major_locator(plt.MaxNLocator(5))
-plt.minorticks_on()
-ax.yaxis.set_ticks_position('both')
-ax.xaxis.set_ticks_position('both')
-plt.tick_params(axis='both', which='both', direction='in', labelsize=14)
-plt.savefig(out, pad_inches=0, bbox_inches='tight')
-#plt.show()
+    plot_lightcurves([{'src_file' : args.src, 'bgd_file' : args.bgd, 'gti_file' : args.gti, 'name' : args.name if args.name != None else "",
+                       'obs' : args.obs, 'n' : args.n, 'pcs' : args.pcs, 'pks' : args.pks}], out, args.mode)
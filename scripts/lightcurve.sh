@@ -219,12 +219,10 @@ epiclccorr srctslist=$path_out/${src}_lc_0.0734_src.lc eventlist=$clean_file out
 
 sleep 1
 
-title3 "lcstats"
-lcstats cfile1="$path_out/${src}_lccorr_0.0734.lc" window=$path/PN_gti.wi dtnb=0.0734 nbint=1000000 tchat=2 logname="$path_out/${src}_xronos.log"
-P=$(lcstats cfile1="$path_out/${src}_lccorr_0.0734.lc" window=$path/PN_gti.wi dtnb=0.0734 nbint=1000000 tchat=2 logname="$path_out/${src}_xronos.log" | grep "Prob of constancy")
-sleep 5
-P_chisq=$(echo $P | sed "s/Chi-Square Prob of constancy. //" | sed "s/ (0 means.*//")
-P_KS=$(echo $P | sed "s/.*Kolm.-Smir. Prob of constancy //" |  sed "s/ (0 means.*//")
+title3 "Probabilities of constancy"
+P=$(python3 $SCRIPTS/constancy.py -lc "$path_out/${src}_lccorr_0.0734.lc" -gti $path/PN_gti.fits)
+P_chisq=$(echo $P | cut -d' ' -f1)
+P_KS=$(echo $P | cut -d' ' -f2)
 
 echo -e "Probabilities of constancy : \n\tP_chisq = $P_chisq\n\tP_KS    = $P_KS"
 
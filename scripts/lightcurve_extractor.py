@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Lightcurves of all the sources of an observation                     #
+#                                                                      #
+########################################################################
+"""
+Extraction of the lightcurves of all the variable sources of an observation
+from a single read of the clean events file, in place of one run of
+lightcurve.sh per source. The events are assigned to the source and
+background circles of every source, and every lightcurve is binned at
+every bin size from the same events. The region queries go through a
+spatial index of the events. The lightcurves are written as the
+.lc files read by lcurve.py. The probabilities of constancy of all the
+sources are computed at once, and written with the sources in a catalogue.
+"""
+
+# Built-in imports
+
+import os
+import glob
+import fcntl
+import argparse
+
+# Third-party imports
+
+import numpy as np
+from astropy.io import fits
+
+# Internal imports
+
+import file_names as FileNames
+from fits_extractor import read_events
+from spatial_index import events_index
+from constancy import constancy
+
+# Frame time of the pn full frame mode, bin size of lightcurve.sh
+FRAME_TIME = 0.0734
+
+# Size of a sky pixel in arcseconds
+SKY_PIXEL = 0.05
+
+# Background circles tried around each source: distances in units of the
+# source radius and position angles
+BKG_DISTANCES = (3.0, 4.5, 6.0)
+BKG_ANGLES    = np.radians(np.arange(0, 360, 30))
+
+# Deviation of the quick-look lightcurve at the flare, in Poisson sigmas,
+# for the lightcurves of a source to be extracted
+QUICK_LOOK_SIGMA = 3.0
+
+# Columns of the clean events needed
+LC_COLUMNS = ['TIME', 'X', 'Y', 'PI', 'CCDNR', 'RAWX', 'RAWY']
+
+########################################################################
+#                                                                      #
+# Regions                                                              #
+#                                                                      #
+########################################################################
+
+def source_name(ra, dec) :
+    """
+    IAU-like name of a source, JHHMMSS+DDMMSS with '_' standing for '+', as lightcurve.sh.
+    """
+    ra  = (ra % 360) / 15
+    h, m, s = int(ra), int((ra * 60) % 60), int((ra * 3600) % 60)
+    link = '-' if dec < 0 else '_'
+    dec = abs(dec)
+    d, am, a_s = int(dec), int((dec * 60) % 60), int((dec * 3600) % 60)
+
+    return 'J{0:02d}{1:02d}{2:02d}{3}{4:02d}{5:02d}{6:02d}'.format(h, m, s, link, d, am, a_s)
+
+
+def sky_position(events, ccd, rawx, rawy) :
+    """
+    Sky position of a CCD position, from the events detected around it.
+    Used when the source table has no sky coordinates.
+    @return: x, y, nan if no event is found
+    """
+    near = (events['CCDNR'] == ccd) & (np.abs(events['RAWX'] - rawx) <= 1) & (np.abs(events['RAWY'] - rawy) <= 1)
+    if not np.any(near) :
+        return np.nan, np.nan
+
+    return float(np.mean(events['X'][near])), float(np.mean(events['Y'][near]))
+
+
+def exclusion_mask(index, fbk_file) :
+    """
+    Events kept by region(fbk_file:REGION,X,Y): within the positive circles
+    of the REGION extension, if any, and outside the excluded ('!') ones.
+    @param index: SpatialIndex of the events
+    @return: mask, all True if the file has no usable REGION extension
+    """
+    keep = np.ones(len(index), dtype=bool)
+    if fbk_file == None :
+        return keep
+    try :
+        region = fits.getdata(fbk_file, 'REGION')
+    except (KeyError, IOError, IndexError) :
+        return keep
+
+    inside = np.zeros(len(index), dtype=bool)
+    positive = False
+    for row in region :
+        shape = row['SHAPE'].strip().upper()
+        if not shape.lstrip('!').startswith('CIRCLE') :
+            continue
+        selected = index.circle(np.atleast_1d(row['X'])[0], np.atleast_1d(row['Y'])[0], np.atleast_1d(row['R'])[0])
+        if shape.startswith('!') :
+            keep[selected] = False
+        else :
+            inside[selected] = True
+            positive = True
+
+    return keep & inside if positive else keep
+
+
+def background_region(index, ccds, usable, sources, i) :
+    """
+    Background circle of a source: among circles of the same radius around
+    the source, on the same CCD and clear of all the sources, the one with
+    the fewest events. An annulus around the source is used if none fits.
+    @param index: SpatialIndex of the events
+    @param ccds: CCD of each event
+    @param usable: Mask of the events usable for the background
+    @param sources: list of (x, y, r, ccd) of all the sources
+    @param i: index of the source
+    @return: (x, y, r_in, r_out), ratio of the source area to the background area
+    """
+    x0, y0, r, ccd = sources[i]
+    best = None
+    for d in BKG_DISTANCES :
+        for a in BKG_ANGLES :
+            cx, cy = x0 + d * r * np.cos(a), y0 + d * r * np.sin(a)
+            if any((cx - sx)**2 + (cy - sy)**2 < (r + sr)**2 for sx, sy, sr, sc in sources) :
+                continue
+            selected = index.circle(cx, cy, r)
+            selected = selected[usable[selected]]
+            n = len(selected)
+            # Circles partially out of the CCD have events from other CCDs or none at all
+            if n == 0 or np.count_nonzero(ccds[selected] == ccd) < 0.99 * n :
+                continue
+            if best == None or n < best[0] :
+                best = (n, (cx, cy, 0.0, r))
+    if best != None :
+        return best[1], 1.0
+
+    return (x0, y0, 2 * r, 3 * r), 1.0 / 5.0
+
+########################################################################
+#                                                                      #
+# Lightcurves                                                          #
+#                                                                      #
+########################################################################
+
+def binned_counts(times, t_start, t_stop, bin_size) :
+    """
+    Number of events in consecutive bins from t_start.
+    """
+    n_bins = max(1, int(np.ceil((t_stop - t_start) / bin_size)))
+    index  = np.floor((times - t_start) / bin_size).astype(np.int64)
+
+    return np.bincount(index[(index >= 0) & (index < n_bins)], minlength=n_bins)
+
+
+def corrected_rate(counts, bin_size, background=None, ratio=1.0) :
+    """
+    Rate and error of binned counts, the background subtracted if given.
+    @param background: Background counts per bin, subtracted with the area ratio
+    @return: rate, error
+    """
+    rate  = counts / bin_size
+    error = np.sqrt(counts) / bin_size
+    if background is not None :
+        rate  = rate - ratio * background / bin_size
+        error = np.sqrt(error**2 + (ratio * np.sqrt(background) / bin_size)**2)
+
+    return rate, error
+
+
+def epoch_span(t_peak, tw, padding, t_start, t_stop, bin_size) :
+    """
+    Time span around the flare window of a source, starting on a bin of the
+    full exposure lightcurves.
+    @param t_peak: Start of the flare window
+    @param padding: Time added before and after the window
+    @return: start, stop
+    """
+    start = max(t_start, t_peak - padding)
+    start = t_start + np.floor((start - t_start) / bin_size) * bin_size
+
+    return start, min(t_stop, t_peak + tw + padding)
+
+
+def clipped_gti(gti, start, stop) :
+    """
+    Good time intervals within [start, stop].
+    """
+    begin = np.maximum(np.asarray(gti['START']), start)
+    end   = np.minimum(np.asarray(gti['STOP']), stop)
+
+    return {'START' : begin[begin < end], 'STOP' : end[begin < end]}
+
+
+def lightcurve_file(path, tw, name, bin_size, kind) :
+    """
+    File of a lightcurve of a source, as read by lcurve.lightcurve_files.
+    @param path: Observation folder
+    @param tw: Time window, naming the folder of the lightcurves
+    @param kind: 'src', 'bgd' or 'lccorr' for the background subtracted one
+    """
+    file = '{0}_lccorr_{1:g}.lc' if kind == 'lccorr' else '{0}_lc_{1:g}_' + kind + '.lc'
+
+    return os.path.join(path, 'lcurve_{0:g}'.format(tw), file.format(name, bin_size))
+
+
+def write_lightcurve(file, counts, t_start, t_stop, bin_size, header, gti, background=None, ratio=1.0) :
+    """
+    Writing a rate set as evselect does, the background subtracted if given.
+    @param counts: Counts per bin
+    @param background: Background counts per bin, subtracted with the area ratio
+    @return: rate, error
+    """
+    rate, error = corrected_rate(counts, bin_size, background, ratio)
+
+    columns = [fits.Column(name='TIME', format='D', unit='s', array=t_start + bin_size * np.arange(len(counts))),
+               fits.Column(name='RATE', format='E', unit='count/s', array=rate),
+               fits.Column(name='ERROR', format='E', unit='count/s', array=error)]
+    hdu = fits.BinTableHDU.from_columns(columns, name='RATE')
+    for key in ('OBS_ID', 'TELESCOP', 'INSTRUME', 'DATE-OBS', 'DATE-END', 'MJDREF', 'TIMESYS', 'TIMEREF') :
+        if key in header :
+            hdu.header[key] = header[key]
+    hdu.header['TSTART']   = t_start
+    hdu.header['TSTOP']    = t_stop
+    hdu.header['TIMEDEL']  = bin_size
+    hdu.header['TIMEPIXR'] = (0.0, 'TIME is the start of the bin')
+
+    gti_columns = [fits.Column(name='START', format='D', unit='s', array=gti['START']),
+                   fits.Column(name='STOP', format='D', unit='s', array=gti['STOP'])]
+    fits.HDUList([fits.PrimaryHDU(), hdu, fits.BinTableHDU.from_columns(gti_columns, name='STDGTI')]).writeto(file, overwrite=True)
+
+    return rate, error
+
+
+def log_line(obs, src_id, name, dl, tw, p_chisq, p_ks) :
+    """
+    Line of a source in the output log, as written by lightcurve.sh: its
+    columns are the ones of the header of pipeline.init_lightcurve_logs.
+    """
+    return "{0} {1} {2} {3:g} {4:g} {5} {6}\n".format(obs, src_id, name, dl if dl != None else np.nan, tw, p_chisq, p_ks)
+
+
+def write_log(output_log, obs, lines) :
+    """
+    Replacing the lines of an observation in the output log, so that the
+    lightcurves extracted again do not add their sources twice. The log is
+    locked while it is rewritten, the observations being extracted in parallel.
+    @param lines: lines of the sources of the observation, see log_line
+    """
+    with open(output_log, 'a+') as f :
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        kept = [line for line in f if line.split(' ', 1)[0] != obs]
+        f.truncate(0)
+        f.writelines(kept + list(lines))
+
+
+def flare_windows(var_file) :
+    """
+    Start of the flare window of each source, from the quick-look lightcurves.
+    @return: dictionary ID -> T_PEAK, empty if the file has no quick-look lightcurves
+    """
+    try :
+        lightcurves = fits.getdata(var_file, 'LIGHTCURVES')
+    except KeyError :
+        return {}
+
+    return dict(zip(lightcurves['ID'].tolist(), lightcurves['T_PEAK'].tolist()))
+
+
+def read_sources(var_file) :
+    """
+    Sources detected by the detector, from the variability file.
+    """
+    hdulist = fits.open(var_file)
+    sources = hdulist[1].data
+    hdulist.close()
+
+    return sources
+
+
+def quick_look_selection(var_file, n_sigma=QUICK_LOOK_SIGMA) :
+    """
+    Sources whose quick-look lightcurve, written by the detector, deviates
+    from its median by n_sigma at the flare window.
+    @return: IDs of the selected sources, None if the file has no quick-look lightcurves
+    """
+    try :
+        lightcurves = fits.getdata(var_file, 'LIGHTCURVES')
+    except KeyError :
+        return None
+
+    counts = np.atleast_2d(lightcurves['COUNTS'])
+    med    = np.median(counts, axis=1)
+    peak   = counts[np.arange(len(counts)), lightcurves['PEAK']]
+    keep   = np.abs(peak - med) >= n_sigma * np.sqrt(np.maximum(med, 1.0))
+
+    return set(lightcurves['ID'][keep])
+
+
+def write_catalogue(file, sources, names, p_chisq, p_ks) :
+    """
+    Writing the sources with their name and probabilities of constancy.
+    @param names, p_chisq, p_ks: one value per source, '' and nan for the skipped ones
+    """
+    columns = sources.columns + fits.ColDefs([fits.Column(name='NAME', format='20A', array=names),
+                                              fits.Column(name='P_CHISQ', format='D', array=p_chisq),
+                                              fits.Column(name='P_KS', format='D', array=p_ks)])
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(columns, name='SOURCES')]).writeto(file, overwrite=True)
+
+
+def extract_lightcurves(path, out, tw, dl=None, bin_sizes=None, output_log=None, fbk_file=None, plot=False, n_sigma=QUICK_LOOK_SIGMA, padding=None) :
+    """
+    Extracting the lightcurves of all the sources detected in an observation.
+    @param path: Folder of the observation
+    @param out: Output folder of the detection, containing the variability file
+    @param tw: Time window of the detection
+    @param dl: Detection level, written in output_log
+    @param bin_sizes: Bin sizes of the lightcurves, FRAME_TIME and tw if None, the
+    probabilities of constancy being computed at the first one
+    @param output_log: File where a line per source is written, replacing the ones of the observation
+    @param fbk_file: FBKTSR file whose REGION extension selects the background events
+    @param plot: Plotting the lightcurves as the pages of path_out/lightcurves_{tw}.pdf
+    @param n_sigma: Only the sources passing the quick-look cut, see
+    quick_look_selection, are extracted. All of them if None
+    @param padding: If given, the lightcurves binned finer than tw only cover
+    the flare window of the source with padding seconds before and after it,
+    and the probabilities of constancy are computed at tw on the full exposure
+    @return: list of (id, name, P_chisq, P_KS)
+    """
+    bin_sizes = bin_sizes if bin_sizes != None else [FRAME_TIME, tw]
+    stats_bin = bin_sizes[0] if padding == None else tw
+    sources   = read_sources(os.path.join(out, FileNames.VARIABILITY))
+    selected  = quick_look_selection(os.path.join(out, FileNames.VARIABILITY), n_sigma) if n_sigma != None else None
+    if selected != None :
+        print(" {0} of {1} sources pass the quick-look cut".format(len(selected), len(sources)))
+        sources = sources[np.isin(sources['ID'], list(selected))]
+    path_out  = os.path.join(path, 'lcurve_{0:g}'.format(tw))
+    os.makedirs(path_out, exist_ok=True)
+    if len(sources) == 0 :
+        write_catalogue(os.path.join(out, FileNames.CATALOGUE), sources, [], [], [])
+        return []
+
+    clean_file = os.path.join(path, FileNames.CLEAN_FILE)
+    header, events = read_events(clean_file, LC_COLUMNS)
+    index = events_index(clean_file, events['X'], events['Y'])
+    gti = fits.getdata(os.path.join(path, FileNames.GTI_FILE), 1)
+    t_start = header.get('TSTART', events['TIME'].min())
+    t_stop  = header.get('TSTOP', events['TIME'].max())
+    obs     = header.get('OBS_ID', os.path.basename(os.path.normpath(path)))
+    epochs  = flare_windows(os.path.join(out, FileNames.VARIABILITY)) if padding != None else {}
+
+    # Events used for the background: the sources of the catalogue excluded
+    if fbk_file == None :
+        fbk = sorted(glob.glob(os.path.join(path, '*{0}*PNS*FBKTSR*'.format(obs))))
+        fbk_file = fbk[0] if fbk else None
+    usable = exclusion_mask(index, fbk_file)
+
+    # Source positions and radii in sky pixels
+    positions = []
+    for src in sources :
+        x, y = float(src['X']), float(src['Y'])
+        if not (np.isfinite(x) and np.isfinite(y)) or (x == 0 and y == 0) :
+            x, y = sky_position(events, src['CCDNR'], src['RAWX'], src['RAWY'])
+        positions.append((x, y, float(src['SKYR']), int(src['CCDNR'])))
+
+    # Background subtracted lightcurves of the sources at the bin size of the statistics
+    extracted, lc_rates, lc_errors = [], [], []
+    names = [''] * len(sources)
+    for i, src in enumerate(sources) :
+        x, y, r, ccd = positions[i]
+        if not np.isfinite(x) :
+            print(" !!!! No events around source {0}, skipped".format(src['ID']))
+            continue
+        ra, dec = float(src['RA']), float(src['DEC'])
+        name = source_name(ra, dec) if np.isfinite(ra) and np.isfinite(dec) and (ra, dec) != (0, 0) else 'SRC{0}'.format(src['ID'])
+        names[i] = name
+
+        (bx, by, r_in, r_out), ratio = background_region(index, events['CCDNR'], usable, positions, i)
+        src_times = events['TIME'][index.circle(x, y, r)]
+        bkg       = index.annulus(bx, by, r_in, r_out)
+        bkg_times = events['TIME'][bkg[usable[bkg]]]
+
+        for bin_size in bin_sizes :
+            # Fine lightcurves around the flare only
+            start, stop, lc_gti = t_start, t_stop, gti
+            if bin_size < tw and int(src['ID']) in epochs :
+                start, stop = epoch_span(epochs[int(src['ID'])], tw, padding, t_start, t_stop, bin_size)
+                lc_gti = clipped_gti(gti, start, stop)
+            src_counts = binned_counts(src_times, start, stop, bin_size)
+            bkg_counts = binned_counts(bkg_times, start, stop, bin_size)
+            write_lightcurve(lightcurve_file(path, tw, name, bin_size, 'src'), src_counts, start, stop, bin_size, header, lc_gti)
+            write_lightcurve(lightcurve_file(path, tw, name, bin_size, 'bgd'), bkg_counts, start, stop, bin_size, header, lc_gti)
+            write_lightcurve(lightcurve_file(path, tw, name, bin_size, 'lccorr'), src_counts, start, stop, bin_size, header, lc_gti, bkg_counts, ratio)
+
+        rate, error = corrected_rate(binned_counts(src_times, t_start, t_stop, stats_bin), stats_bin, binned_counts(bkg_times, t_start, t_stop, stats_bin), ratio)
+        lc_rates.append(rate.astype(np.float32))
+        lc_errors.append(error.astype(np.float32))
+
+        src_exp = "(X,Y) in CIRCLE({0:.2f},{1:.2f},{2:.2f})".format(x, y, r)
+        bkg_exp = "(X,Y) in CIRCLE({0:.2f},{1:.2f},{2:.2f})".format(bx, by, r_out) if r_in == 0 else \
+                  "(X,Y) in ANNULUS({0:.2f},{1:.2f},{2:.2f},{3:.2f})".format(bx, by, r_in, r_out)
+        with open(os.path.join(path_out, '{0}_region.txt'.format(name)), 'w') as f :
+            f.write("Source     = {0}\nBackground = {1}\n".format(src_exp, bkg_exp))
+        extracted.append(i)
+
+    p_chisq = np.full(len(sources), np.nan)
+    p_ks    = np.full(len(sources), np.nan)
+    p_chisq[extracted], p_ks[extracted] = constancy(lc_rates, lc_errors, t_start, stats_bin, gti)
+    del lc_rates, lc_errors
+    write_catalogue(os.path.join(out, FileNames.CATALOGUE), sources, names, p_chisq, p_ks)
+
+    results = [(int(sources[i]['ID']), names[i], p_chisq[i], p_ks[i]) for i in extracted]
+    if output_log != None :
+        write_log(output_log, obs, [log_line(obs, src_id, name, dl, tw, pcs, pks) for src_id, name, pcs, pks in results])
+
+    if plot :
+        from lcurve import plot_lightcurves
+        lightcurves = [{'src_file' : lightcurve_file(path, tw, names[i], tw, 'lccorr'), 'gti_file' : os.path.join(path, FileNames.GTI_FILE),
+                        'name' : names[i], 'obs' : obs, 'n' : str(sources[i]['ID']), 'pcs' : p_chisq[i], 'pks' : p_ks[i]} for i in extracted]
+        lightcurves = [lc for lc in lightcurves if os.path.exists(lc['src_file'])]
+        plot_lightcurves(lightcurves, os.path.join(path_out, 'lightcurves_{0:g}.pdf'.format(tw)), 'medium')
+
+    return results
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-path", dest="path", help="Path to the observation files", type=str)
+    parser.add_argument("-out", dest="out", help="Output folder of the detection", type=str)
+    parser.add_argument("-tw", dest="tw", help="Time window of the detection", type=float)
+    parser.add_argument("-dl", dest="dl", help="Detection level of the detection", default=None, type=float)
+    parser.add_argument("-bins", dest="bins", help="Bin sizes of the lightcurves.\nDefault: {0} and TW".format(FRAME_TIME), nargs='*', default=None, type=float)
+    parser.add_argument("-log", dest="log", help="File where a line per source is appended", default=None, type=str)
+    parser.add_argument("-sigma", dest="sigma", help="Quick-look cut in Poisson sigmas, negative for none.\nDefault: {0}".format(QUICK_LOOK_SIGMA), default=QUICK_LOOK_SIGMA, type=float)
+    parser.add_argument("-padding", dest="padding", help="Time in seconds around the flare window covered by the lightcurves binned finer than TW.\nDefault: full exposure", default=None, type=float)
+    parser.add_argument("--plot", help="Plotting the lightcurves in a single PDF file", action='store_true')
+    args = parser.parse_args()
+
+    for src_id, name, p_chisq, p_ks in extract_lightcurves(args.path, args.out, args.tw, args.dl, args.bins, args.log, plot=args.plot,
+                                                        n_sigma=args.sigma if args.sigma >= 0 else None, padding=args.padding) :
+        print(" Source {0} {1} : P_chisq = {2:.3g}, P_KS = {3:.3g}".format(src_id, name, p_chisq, p_ks))
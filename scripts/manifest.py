@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Stage manifests                                                      #
+#                                                                      #
+########################################################################
+"""
+Manifests recording how the products of a pipeline stage were made: the
+hash of its input files, its parameters, the hash of its code and the hash
+of its outputs. A stage is skipped only if its manifest matches exactly,
+so that an interrupted run resumes where it stopped without reusing
+products made from other inputs, parameters or code.
+"""
+
+# Built-in imports
+
+import os
+import json
+import hashlib
+
+# Internal imports
+
+import file_names as FileNames
+
+# Hashes of the files already read, by (path, size, mtime)
+_hashes = {}
+
+########################################################################
+#                                                                      #
+# Hashes                                                               #
+#                                                                      #
+########################################################################
+
+def file_hash(path, block=1 << 20) :
+    """
+    SHA-256 hash of the content of a file.
+    @param path: path to the file
+    @param block: size of the blocks read
+    @return: hexadecimal digest
+    """
+    stat = os.stat(path)
+    key  = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _hashes :
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f :
+            for chunk in iter(lambda: f.read(block), b'') :
+                sha.update(chunk)
+        _hashes[key] = sha.hexdigest()
+
+    return _hashes[key]
+
+
+def file_record(path, previous=None) :
+    """
+    Description of a file stored in a manifest.
+    The content is only hashed again if its size or date changed since the
+    previous record.
+    @param path: path to the file
+    @param previous: record of the same file in an existing manifest
+    @return: dictionary with size, mtime and sha256, None if the file does not exist
+    """
+    if not os.path.isfile(path) :
+        return None
+
+    stat = os.stat(path)
+    if previous != None and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime :
+        sha = previous['sha256']
+    else :
+        sha = file_hash(path)
+
+    return {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'sha256' : sha}
+
+
+def code_version(files) :
+    """
+    Hash identifying the version of the code of a stage.
+    @param files: source files of the stage, relative to the scripts folder
+    @return: hexadecimal digest
+    """
+    scripts = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256()
+    for f in sorted(files) :
+        sha.update(f.encode())
+        sha.update(file_hash(os.path.join(scripts, f)).encode())
+
+    return sha.hexdigest()
+
+########################################################################
+#                                                                      #
+# Manifests                                                            #
+#                                                                      #
+########################################################################
+
+def manifest_file(folder, stage) :
+    """
+    Path to the manifest of a stage.
+    @param folder: folder of the outputs of the stage
+    @param stage: name of the stage
+    """
+    return os.path.join(folder, FileNames.MANIFEST.format(stage))
+
+
+def read_manifest(file) :
+    """
+    @return: the content of a manifest, None if it does not exist or is unreadable
+    """
+    try :
+        with open(file) as f :
+            return json.load(f)
+    except (IOError, ValueError) :
+        return None
+
+
+def is_up_to_date(file, inputs, params, code, outputs) :
+    """
+    Checking whether the products of a stage can be reused.
+    @param file: path to the manifest
+    @param inputs: list of the input files
+    @param params: dictionary of the parameters, JSON serialisable
+    @param code: list of the source files of the stage
+    @param outputs: list of the output files
+    @return: True if the manifest matches the inputs, parameters, code and outputs
+    """
+    manifest = read_manifest(file)
+    if manifest == None :
+        return False
+
+    if manifest.get('params') != json.loads(json.dumps(params)) or manifest.get('code') != code_version(code) :
+        return False
+
+    for key, files in (('inputs', inputs), ('outputs', outputs)) :
+        recorded = manifest.get(key, {})
+        if sorted(recorded) != sorted(os.path.abspath(f) for f in files) :
+            return False
+        for f in files :
+            f = os.path.abspath(f)
+            record = file_record(f, recorded[f])
+            if record == None or record['sha256'] != recorded[f]['sha256'] :
+                return False
+
+    return True
+
+
+def write_manifest(file, inputs, params, code, outputs) :
+    """
+    Recording the manifest of a stage once its outputs have been written.
+    The manifest is written atomically, an interrupted stage has none.
+    @param file: path to the manifest
+    @param inputs: list of the input files
+    @param params: dictionary of the parameters, JSON serialisable
+    @param code: list of the source files of the stage
+    @param outputs: list of the output files
+    """
+    manifest = {
+        'params'  : params,
+        'code'    : code_version(code),
+        'inputs'  : {os.path.abspath(f) : file_record(f) for f in inputs},
+        'outputs' : {os.path.abspath(f) : file_record(f) for f in outputs},
+    }
+
+    tmp = file + '.tmp'
+    with open(tmp, 'w') as f :
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, file)
+
+
+def remove_manifest(file) :
+    """
+    Invalidating the products of a stage before they are overwritten.
+    """
+    if os.path.isfile(file) :
+        os.remove(file)
@@ -208,13 +208,10 @@ title3 "epiclccorr"
 epiclccorr srctslist=$path_out/${src}_lc_${TW}_src.lc eventlist=$clean_file outset=$path_out/${src}_lccorr_${TW}.lc bkgtslist=$path_out/${src}_lc_${TW}_bgd.lc withbkgset=yes applyabsolutecorrections=yes -V 0
 sleep 1
 
-title3 "lcstats"
-lcstats cfile1="$path_out/${src}_lccorr_${TW}.lc" window=$path/PN_gti.wi dtnb=${TW} nbint=1000000 tchat=2
-P=$(lcstats cfile1="$path_out/${src}_lccorr_${TW}.lc" window=$path/PN_gti.wi dtnb=${TW} nbint=1000000 tchat=2 | grep "Prob of constancy")
-sleep 1
-
-P_chisq=$(echo $P | sed "s/Chi-Square Prob of constancy. //" | sed "s/ (0 means.*//")
-P_KS=$(echo $P | sed "s/.*Kolm.-Smir. Prob of constancy //" |  sed "s/ (0 means.*//")
+title3 "Probabilities of constancy"
+P=$(python3 $SCRIPTS/constancy.py -lc "$path_out/${src}_lccorr_${TW}.lc" -gti $path/PN_gti.fits)
+P_chisq=$(echo $P | cut -d' ' -f1)
+P_KS=$(echo $P | cut -d' ' -f2)
 
 echo -e "Probabilities of constancy : \n\tP_chisq = $P_chisq\n\tP_KS    = $P_KS"
 
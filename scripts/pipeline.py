@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Batch processing of observations                                     #
+#                                                                      #
+########################################################################
+"""
+Stages of the EXOD pipeline and the dependency graph linking them for each
+observation: (download ->) filtering -> detection -> rendering, and the
+lightcurves of the detected sources. The graph is run by the scheduler, or
+submitted to a work queue shared by several hosts.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import glob
+import json
+import subprocess
+import argparse
+from functools import partial
+
+# Internal imports
+
+import file_names as FileNames
+import manifest as Manifest
+import resources as Resources
+from scheduler import Task, Scheduler, FAILED
+
+# Stages of the pipeline, in order. The download is only run on request.
+STAGES = ['filtering', 'detection', 'rendering', 'lightcurve']
+DOWNLOAD = 'download'
+
+# Source files of the stages, recorded in the manifests of their products
+FILTERING_CODE  = ['filtering.py', 'fits_extractor.py']
+TRIAGE_CODE     = ['triage.py', 'fits_extractor.py', 'variability_utils.py', 'variability_statistics.py']
+RENDERING_CODE  = ['renderer.py']
+LIGHTCURVE_CODE = ['lightcurve_extractor.py', 'fits_extractor.py', 'constancy.py', 'lcurve.py']
+
+########################################################################
+#                                                                      #
+# Stages                                                               #
+#                                                                      #
+########################################################################
+
+# Detectors of the worker process, kept warm between the tasks
+_detectors = {}
+
+def get_detector(mta=1) :
+    """
+    Returning the detector of the current process.
+    @param mta: Maximal number of CPUs used by the detector
+    """
+    from detector import Detector
+
+    if mta not in _detectors :
+        _detectors[mta] = Detector(mta=mta)
+
+    return _detectors[mta]
+
+
+def params_name(dl, tw, gtr, bs) :
+    """
+    Name of a set of detection parameters, as used by the output files.
+    """
+    return '{0}_{1}_{2}_{3}'.format(dl, tw, gtr, bs)
+
+
+def parse_params(dl, tw, gtr, bs, params=None) :
+    """
+    Sets of detection parameters of the command line.
+    @param params: list of DL_TW_GTR_BS strings, replacing dl, tw, gtr and bs
+    @return: list of (dl, tw, gtr, bs)
+    """
+    # Integer values are written as such in the names of the output files
+    def number(v) :
+        return int(float(v)) if float(v) == int(float(v)) else float(v)
+    if params == None :
+        return [(number(dl), number(tw), gtr, bs)]
+
+    return [(number(dl), number(tw), float(gtr), int(bs)) for dl, tw, gtr, bs in (p.split('_') for p in params)]
+
+
+def init_lightcurve_logs(folder, params) :
+    """
+    Creating the files gathering the lightcurve results of each set of parameters,
+    with a line per source, see lightcurve_extractor.log_line. The existing
+    files are kept: the lines of an observation are replaced when its
+    lightcurves are extracted again, see lightcurve_extractor.write_log.
+    """
+    for p in params :
+        log_file = os.path.join(folder, 'sources_variability_{0}'.format(params_name(*p)))
+        if not os.path.isfile(log_file) :
+            with open(log_file, 'w') as f :
+                f.write("Observation Source Name DL TW P_chisq P_KS\n")
+
+
+def download(folder, obs, params, mta=None, cpus=12, retries=1, stages=STAGES, force=False, padding=None, triage=False) :
+    """
+    Downloading an observation unless it is already there, then returning
+    the tasks processing it: their cost is only known once the events file
+    is available. The other observations keep downloading meanwhile.
+    See observation_tasks for the parameters.
+    @param mta: Number of CPUs of each detection, balanced as by the watcher if None
+    @param cpus: Number of CPUs of the batch, see balance_tasks
+    @return: list of Task
+    """
+    from downloader import download_observation
+
+    download_observation(folder, obs)
+    tasks = observation_tasks(folder, obs, params, mta or 1, retries, [s for s in stages if s != DOWNLOAD], force, padding, triage)
+    if mta == None :
+        balance_tasks(tasks, cpus)
+
+    return tasks
+
+
+def filtering(folder, obs, rate=None, force=False) :
+    """
+    Filtering the events of an observation with filtering.py, unless the
+    manifest of the filtered files matches the raw events file.
+    @param folder: Folder containing the observations
+    @param obs: Observation identifier
+    @param rate: Flaring threshold in counts/s, chosen from the rate curve if None
+    @param force: Filtering even if the filtered files are up to date
+    """
+    from filtering import filter_events
+
+    path     = os.path.join(folder, obs)
+    inputs   = sorted(glob.glob(os.path.join(path, '*{0}PN*PIEVLI*'.format(obs))))
+    outputs  = [os.path.join(path, f) for f in (FileNames.CLEAN_FILE, FileNames.GTI_FILE, FileNames.IMG_FILE)]
+    params   = {'INSTRUMENT' : 'PN', 'RATE' : rate}
+    manifest = Manifest.manifest_file(path, 'filtering')
+
+    if not inputs :
+        if all(os.path.isfile(f) for f in outputs) :
+            print(" No raw events file for {0}, the existing filtered files are used".format(obs))
+            return None
+        raise IOError("No raw events file for {0}".format(obs))
+
+    if not force and Manifest.is_up_to_date(manifest, inputs, params, FILTERING_CODE, outputs) :
+        return None
+
+    Manifest.remove_manifest(manifest)
+    filter_events(inputs[0], path, rate)
+    Manifest.write_manifest(manifest, inputs, params, FILTERING_CODE, outputs)
+
+
+def ccd_triage(folder, obs, params, mta=1, cpus=None, retries=1, stages=STAGES, force=False, padding=None) :
+    """
+    Scoring the CCDs of an observation once for all the sets of parameters,
+    unless the manifest of the triage file matches, then returning the tasks
+    of the detections of the CCDs kept: none if no CCD passes the triage.
+    See observation_tasks for the parameters.
+    @param cpus: Number of CPUs of the batch, the detections being balanced
+    as by balance_tasks if given
+    @return: list of Task
+    """
+    from triage import triage_observation, TRIAGE_LEVEL
+
+    path     = os.path.join(folder, obs)
+    inputs   = [os.path.join(path, f) for f in (FileNames.CLEAN_FILE, FileNames.GTI_FILE)]
+    outputs  = [os.path.join(path, FileNames.TRIAGE)]
+    params_t = {'LEVEL' : TRIAGE_LEVEL}
+    manifest = Manifest.manifest_file(path, 'triage')
+
+    if force or not Manifest.is_up_to_date(manifest, inputs, params_t, TRIAGE_CODE, outputs) :
+        Manifest.remove_manifest(manifest)
+        kept, scores = triage_observation(path)
+        with open(outputs[0], 'w') as f :
+            json.dump({'CCDS' : kept, 'SCORES' : [float(score) for score in scores]}, f)
+        Manifest.write_manifest(manifest, inputs, params_t, TRIAGE_CODE, outputs)
+
+    with open(outputs[0]) as f :
+        kept = json.load(f)['CCDS']
+    print(" Triage of {0}: {1} CCDs kept".format(obs, len(kept)))
+    if not kept :
+        return []
+
+    tasks = observation_tasks(folder, obs, params, mta, retries, [s for s in stages if s != 'filtering'], force, padding, ccds=kept)
+    if cpus != None :
+        balance_tasks(tasks, cpus)
+
+    return tasks
+
+
+def detection(folder, obs, dl, tw, gtr, bs, mta=1, lightcurves=False, output_log=None, force=False, padding=None, retries=1, ccds=None) :
+    """
+    Computing the variability and detecting the variable sources, unless
+    the manifest of the variability file matches.
+    @param folder: Folder containing the observations
+    @param obs: Observation identifier
+    @param dl, tw, gtr, bs: Detection level, time window, good time ratio and box size
+    @param mta: Maximal number of CPUs used by the detector
+    @param lightcurves: Returning the task extracting the lightcurves of the sources
+    @param output_log: File gathering the lightcurve results
+    @param force: Computing the variability even if it is up to date
+    @param padding: Time around the flare covered by the fine lightcurves, see extract_lightcurves
+    @param retries: Number of times the lightcurve task is run again if it fails
+    @param ccds: Indices of the CCDs kept by the triage, all of them if None
+    @return: list of the lightcurve tasks
+    """
+    path   = os.path.join(folder, obs)
+    out    = os.path.join(path, params_name(dl, tw, gtr, bs))
+    result = get_detector(mta).detect(path, out=out, bs=bs, dl=dl, tw=tw, gtr=gtr, obs=obs, reuse=not force, ccds=ccds)
+
+    if not lightcurves :
+        return []
+    if len(result.sources) == 0 :
+        # No source any more, the lines of a previous run are removed
+        if output_log != None :
+            from lightcurve_extractor import write_log
+            write_log(output_log, obs, [])
+        return []
+
+    clean, n_events, exposure = Resources.observation_info(path, obs)
+    n_sources = len(result.sources)
+
+    return [Task('{0} lightcurves {1}'.format(obs, params_name(dl, tw, gtr, bs)), lightcurve,
+                 args=(folder, obs, dl, tw, gtr, bs, output_log, force, padding), retries=retries,
+                 cost=Resources.lightcurve_cost(n_events, exposure, tw, n_sources, padding),
+                 memory=Resources.lightcurve_memory(n_events, exposure, tw, n_sources, padding))]
+
+
+def rendering(folder, obs, dl, tw, gtr, bs, force=False) :
+    """
+    Rendering the variability of an observation, with and without the sources.
+    """
+    out      = os.path.join(folder, obs, params_name(dl, tw, gtr, bs), '')
+    var_f    = out + FileNames.VARIABILITY
+    outputs  = [out + FileNames.OUTPUT_IMAGE, out + FileNames.OUTPUT_IMAGE_SRCS]
+    manifest = Manifest.manifest_file(out, 'rendering')
+
+    if not force and Manifest.is_up_to_date(manifest, [var_f], {}, RENDERING_CODE, outputs) :
+        return None
+
+    from renderer import render_variability
+
+    Manifest.remove_manifest(manifest)
+    render_variability(var_f, outputs[0], sources=False, maximum_value=10)
+    render_variability(var_f, outputs[1], sources=True, maximum_value=10)
+    Manifest.write_manifest(manifest, [var_f], {}, RENDERING_CODE, outputs)
+
+
+def lightcurve(folder, obs, dl, tw, gtr, bs, output_log, force=False, padding=None) :
+    """
+    Extracting the lightcurves of all the detected sources in one read of
+    the clean events. The names of their products depend on the source
+    coordinates, only the inputs and the catalogue are recorded in the manifest.
+    """
+    from lightcurve_extractor import extract_lightcurves
+
+    path     = os.path.join(folder, obs)
+    out      = os.path.join(path, params_name(dl, tw, gtr, bs))
+    inputs   = [os.path.join(path, f) for f in (FileNames.CLEAN_FILE, FileNames.GTI_FILE)] + [os.path.join(out, FileNames.VARIABILITY)]
+    params   = {'DL' : dl, 'TW' : tw, 'GTR' : gtr, 'BS' : bs, 'PADDING' : padding}
+    outputs  = [os.path.join(out, FileNames.CATALOGUE)]
+    manifest = Manifest.manifest_file(out, 'lightcurves')
+
+    if not force and Manifest.is_up_to_date(manifest, inputs, params, LIGHTCURVE_CODE, outputs) :
+        return None
+
+    Manifest.remove_manifest(manifest)
+    extract_lightcurves(path, out, tw, dl, output_log=output_log, plot=True, padding=padding)
+    Manifest.write_manifest(manifest, inputs, params, LIGHTCURVE_CODE, outputs)
+
+########################################################################
+#                                                                      #
+# Dependency graph                                                     #
+#                                                                      #
+########################################################################
+
+def observation_tasks(folder, obs, params, mta=1, retries=1, stages=STAGES, force=False, padding=None, triage=False, ccds=None) :
+    """
+    Building the tasks processing one observation, with their estimated cost.
+    @param folder: Folder containing the observations
+    @param obs: Observation identifier
+    @param params: list of (dl, tw, gtr, bs) detection parameters
+    @param mta: Maximal number of CPUs used by each detection, see balance_tasks
+    @param retries: Number of times a failed task is run again
+    @param stages: Stages to run, among STAGES
+    @param force: Running the stages even if their products are up to date
+    @param padding: Time around the flare covered by the fine lightcurves, the full exposure if None
+    @param triage: Scoring the CCDs once after the filtering, see ccd_triage:
+    the detections are built by the triage, for the CCDs it keeps only
+    @param ccds: Indices of the CCDs kept by the triage, all of them if None
+    @return: list of Task
+    """
+    path   = os.path.join(folder, obs)
+    inputs = [os.path.join(path, f) for f in (FileNames.CLEAN_FILE, FileNames.GTI_FILE, FileNames.IMG_FILE)]
+    tasks  = []
+    deps   = []
+
+    # Size of the observation, from the header of the events file
+    clean, n_events, exposure = Resources.observation_info(path, obs)
+
+    if 'filtering' in stages :
+        cost = Resources.filtering_cost(n_events) if clean == False else 0.0
+        flt = Task('{0} filtering'.format(obs), filtering, args=(folder, obs, None, force), retries=retries, cost=cost,
+                   memory=Resources.MEMORY_FILTERING)
+        tasks.append(flt)
+        deps = [flt.name]
+
+    if triage and 'detection' in stages :
+        tasks.append(Task('{0} triage'.format(obs), ccd_triage, args=(folder, obs, params),
+                          kwargs={'mta' : mta, 'retries' : retries, 'stages' : stages, 'force' : force, 'padding' : padding},
+                          deps=deps, inputs=inputs[:2], retries=retries,
+                          cost=Resources.triage_cost(n_events), memory=Resources.triage_memory(n_events)))
+        return tasks
+
+    for dl, tw, gtr, bs in params :
+        name = params_name(dl, tw, gtr, bs)
+        out  = os.path.join(path, name)
+        ren_deps = []
+        if 'detection' in stages :
+            lc = 'lightcurve' in stages
+            output_log = os.path.join(folder, 'sources_variability_{0}'.format(name)) if lc else None
+            det = Task('{0} detection {1}'.format(obs, name), detection, args=(folder, obs, dl, tw, gtr, bs),
+                       kwargs={'mta' : mta, 'lightcurves' : lc, 'output_log' : output_log, 'force' : force, 'padding' : padding, 'retries' : retries, 'ccds' : ccds},
+                       deps=deps, inputs=inputs, retries=retries,
+                       cost=Resources.detection_cost(n_events, exposure, tw), cores=mta,
+                       memory=partial(Resources.detection_memory, n_events, exposure, tw), cores_arg='mta')
+            tasks.append(det)
+            ren_deps = [det.name]
+        if 'rendering' in stages :
+            tasks.append(Task('{0} rendering {1}'.format(obs, name), rendering,
+                              args=(folder, obs, dl, tw, gtr, bs, force), deps=ren_deps,
+                              inputs=[os.path.join(out, FileNames.VARIABILITY)], retries=retries,
+                              cost=Resources.COST_RENDERING, memory=Resources.MEMORY_RENDERING))
+
+    return tasks
+
+
+def balance_tasks(tasks, cpus) :
+    """
+    Giving several CPUs to the detections that would otherwise outlast the
+    ideal makespan of the batch, the other ones run on a single CPU. The
+    detections built by a triage are balanced when it is over.
+    @param tasks: list of Task, see observation_tasks
+    @param cpus: Number of CPUs of the batch
+    """
+    ideal = sum(task.cost for task in tasks) / cpus
+
+    for task in tasks :
+        if task.fct is detection :
+            task.set_cores(Resources.detection_cores(task.cost, ideal, cpus))
+        elif task.fct is ccd_triage :
+            task.kwargs['cpus'] = cpus
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--folder", dest="folder", help="Folder containing the observations", type=str)
+    parser.add_argument("-obs", "--observations", dest="obs", help="Observations to process.\nDefault: all the folders 0* of FOLDER", nargs='*', default=None, type=str)
+    parser.add_argument("-dl", "--detection-level", dest="dl", help="Detection level.\nDefault: 8", default=8, type=float)
+    parser.add_argument("-tw", "--time-window", dest="tw", help="Time window.\nDefault: 100", default=100, type=float)
+    parser.add_argument("-gtr", "--good-time-ratio", dest="gtr", help="Good time ratio.\nDefault: 1.0", default=1.0, type=float)
+    parser.add_argument("-bs", "--box-size", dest="bs", help="Box size.\nDefault: 3", default=3, type=int)
+    parser.add_argument("-cpus", "--cpus", dest="cpus", help="Number of tasks run in parallel.\nDefault: 12", default=12, type=int)
+    parser.add_argument("-mta", "--max-threads-allowed", dest="mta", help="Number of CPUs used by each detection.\nDefault: chosen from the size of the observations", default=None, type=int)
+    parser.add_argument("-mem", "--memory", dest="mem", help="Memory budget of the batch in GB.\nDefault: 80%% of the physical memory", default=None, type=float)
+    parser.add_argument("-params", dest="params", help="Several sets of detection parameters DL_TW_GTR_BS, replacing -dl -tw -gtr -bs", nargs='*', default=None, type=str)
+    parser.add_argument("-retries", dest="retries", help="Number of times a failed task is run again.\nDefault: 1", default=1, type=int)
+    parser.add_argument("-stages", dest="stages", help="Stages to run, among the stages and download.\nDefault: all the stages, without download", nargs='*', default=STAGES, choices=STAGES + [DOWNLOAD], type=str)
+    parser.add_argument("--no-lc", dest="lc", help="Skip the lightcurve generation", action='store_false')
+    parser.add_argument("-padding", dest="padding", help="Time in seconds around the flare window covered by the lightcurves binned at the frame time.\nDefault: full exposure", default=None, type=float)
+    parser.add_argument("-triage", "--triage", dest="triage", help="Score the CCDs once per observation, the detections only computing the CCDs that may hold a flare, see triage.py", action='store_true')
+    parser.add_argument("-queue", dest="queue", help="SQLite database of a work queue: the tasks are submitted to it instead of being run, see work_queue.py", default=None, type=str)
+    parser.add_argument("--force", help="Running the stages even if their products are up to date", action='store_true')
+    args = parser.parse_args()
+
+    folder = os.path.abspath(args.folder)
+    if args.obs == None :
+        args.obs = sorted(os.path.basename(p) for p in glob.glob(os.path.join(folder, '0*')) if os.path.isdir(p))
+
+    params = parse_params(args.dl, args.tw, args.gtr, args.bs, args.params)
+    stages = [s for s in args.stages if s != 'lightcurve' or args.lc]
+
+    if 'lightcurve' in stages :
+        init_lightcurve_logs(folder, params)
+
+    tasks = []
+    for obs in args.obs :
+        if DOWNLOAD in stages :
+            tasks.append(Task('{0} download'.format(obs), download, args=(folder, obs, params, args.mta, args.cpus, args.retries, stages, args.force, args.padding, args.triage), retries=args.retries))
+            continue
+        tasks += observation_tasks(folder, obs, params, args.mta or 1, args.retries, stages, args.force, args.padding, args.triage)
+    if args.mta == None :
+        balance_tasks(tasks, args.cpus)
+
+    if args.queue != None :
+        from work_queue import WorkQueue
+        queue = WorkQueue(args.queue)
+        print(" {0} tasks submitted to {1}".format(queue.submit(tasks), args.queue))
+        queue.close()
+        sys.exit(0)
+
+    memory = args.mem * 1e9 if args.mem != None else Resources.available_memory()
+    scheduler = Scheduler(processes=args.cpus, memory=memory)
+    for task in tasks :
+        scheduler.add(task)
+
+    states = scheduler.run()
+
+    sys.exit(1 if FAILED in states.values() else 0)
@@ -110,7 +110,7 @@ lightcurves(){
   echo $FOLDER
 
   # Output file
-  echo "Observation Source DL TW P_chisq P_KS" >> $FOLDER/sources_variability_${DLf}_${TW}_${BSf}
+  echo "Observation Source Name DL TW P_chisq P_KS" >> $FOLDER/sources_variability_${DLf}_${TW}_${BSf}
 
   # Reading file
   let i=0
@@ -119,6 +119,7 @@ def render_variability(var_file, output_file, sources=True, pars=None, maximum_v
     plt.text(0.5, 0.95, "TW {0} s    DL {1}   BS {2}".format(header['TW'], header['DL'], header['BS']), color='white', fontsize=10, horizontalalignment='center', transform = ax.transAxes)
 
     plt.savefig(output_file, pad_inches=0, bbox_inches='tight', dpi=500)
+    plt.close()
 
 ########################################################################
 
@@ -191,6 +192,7 @@ def render_variability_all(var_file0, var_file1, var_file2, var_file3, output_fi
     fig.suptitle('OBS {0}'.format(header['OBS_ID']), x=0.5, y = 0.93, fontsize=18)
 
     plt.savefig(output_file, pad_inches=0, dpi=500, bbox_inches='tight')
+    plt.close()
 
 
 ########################################################################
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Resources needed by the pipeline stages                              #
+#                                                                      #
+########################################################################
+"""
+A priori estimation of the run time and of the peak memory of the pipeline
+stages, from the headers of the event files only. The estimates are used
+by the batch runner to start the longest jobs first, to give the largest
+observations several CPUs and to start jobs only while their memory fits
+in the budget of the node.
+"""
+
+# Built-in imports
+
+import os
+import glob
+from math import ceil
+
+# Third-party imports
+
+from astropy.io import fits
+
+# Internal imports
+
+import file_names as FileNames
+
+# Number of pixels of the EPIC-pn camera
+N_PIXELS = 12 * 64 * 200
+
+# Costs in seconds on one CPU, measured with the detector
+COST_PER_EVENT = 1e-4    # Extraction and counting of an event
+COST_PER_PIXEL = 4e-5    # Statistics of a pixel
+COST_PER_CELL  = 1e-8    # Statistics of a pixel in a time window
+
+# Filtering of the raw events, read once by filtering.py
+COST_PER_RAW_EVENT = 2e-6
+
+# Triage of the CCDs: clean events read once and counted in coarse pixels, measured
+COST_PER_TRIAGE_EVENT = 1e-6
+
+# Rendering of the two variability images
+COST_RENDERING = 10.0
+
+# Lightcurves of a source, per bin of its finest lightcurve, measured
+COST_PER_LC_BIN = 1.5e-5
+
+# Bin size of the finest lightcurves, lightcurve_extractor.FRAME_TIME
+FRAME_TIME = 0.0734
+
+# Memory in bytes
+MEMORY_PROCESS   = 150e6   # Interpreter with numpy and astropy loaded
+MEMORY_PER_EVENT = 50      # Event of the 15-byte record arrays, 45 bytes at the peak of the extraction
+MEMORY_PER_CELL  = 28      # Pixel in a time window: counts, corrected copy and median, measured
+MEMORY_RENDERING = 500e6
+MEMORY_FILTERING = 1e9     # Chunk of raw events and selected events
+MEMORY_PER_LC_BIN = 360    # Bin of the finest lightcurve of the source being extracted, measured
+MEMORY_PER_STATS_BIN = 8   # Bin of the rate and error of each source kept for the statistics
+
+########################################################################
+#                                                                      #
+# Observation size                                                     #
+#                                                                      #
+########################################################################
+
+def events_info(events_file) :
+    """
+    Number of events and exposure of an events file, read from its header.
+    @param events_file: events FITS file, possibly compressed
+    @return: n_events, exposure in seconds
+    """
+    header   = fits.getheader(events_file, 'EVENTS')
+    n_events = header['NAXIS2']
+    exposure = float(header.get('TSTOP', 0)) - float(header.get('TSTART', 0))
+
+    return n_events, exposure
+
+
+def observation_info(path, obs='') :
+    """
+    Number of events and exposure of an observation, from the clean events
+    file if it exists, from the raw events file otherwise.
+    @param path: Folder of the observation
+    @param obs: Observation identifier, selecting the raw events file
+    @return: clean, n_events, exposure. clean is False if the raw file was
+    read, None if no events file was found
+    """
+    clean_file = os.path.join(path, FileNames.CLEAN_FILE)
+    if os.path.isfile(clean_file) :
+        return (True,) + events_info(clean_file)
+
+    raw = sorted(glob.glob(os.path.join(path, '*{0}PN*PIEVLI*'.format(obs))))
+    if raw :
+        return (False,) + events_info(raw[0])
+
+    return None, 0, 0.0
+
+########################################################################
+#                                                                      #
+# Run time                                                             #
+#                                                                      #
+########################################################################
+
+def detection_cost(n_events, exposure, tw) :
+    """
+    Estimated run time of a detection on one CPU.
+    @param n_events: Number of clean events
+    @param exposure: Duration of the observation in seconds
+    @param tw: Time window in seconds
+    @return: seconds
+    """
+    n_bins = max(1, int(ceil(exposure / tw)))
+
+    return n_events * COST_PER_EVENT + N_PIXELS * (COST_PER_PIXEL + n_bins * COST_PER_CELL)
+
+
+def filtering_cost(n_raw_events) :
+    """
+    Estimated run time of the filtering of the raw events.
+    @param n_raw_events: Number of raw events
+    @return: seconds
+    """
+    return n_raw_events * COST_PER_RAW_EVENT
+
+
+def triage_cost(n_events) :
+    """
+    Estimated run time of the triage of the CCDs of an observation.
+    @param n_events: Number of clean events
+    @return: seconds
+    """
+    return n_events * COST_PER_TRIAGE_EVENT
+
+
+def lightcurve_bins(exposure, tw, padding=None) :
+    """
+    Number of bins of the finest lightcurve of a source and of the lightcurve
+    of its statistics, see lightcurve_extractor.extract_lightcurves.
+    """
+    fine = exposure if padding == None else min(exposure, 2 * padding + tw)
+    stats_bin = FRAME_TIME if padding == None else tw
+
+    return int(ceil(fine / FRAME_TIME)), int(ceil(exposure / stats_bin))
+
+
+def lightcurve_cost(n_events, exposure, tw, n_sources, padding=None) :
+    """
+    Estimated run time of the lightcurves of the sources of an observation.
+    @param n_events: Number of clean events, read once
+    @param n_sources: Number of sources
+    @param padding: see lightcurve_extractor.extract_lightcurves
+    @return: seconds
+    """
+    fine, stats = lightcurve_bins(exposure, tw, padding)
+
+    return n_events * COST_PER_RAW_EVENT + n_sources * fine * COST_PER_LC_BIN
+
+
+def detection_cores(cost, ideal, cpus, max_cores=12) :
+    """
+    Number of CPUs given to a detection so that it does not outlast the
+    ideal makespan of the batch. The CCDs are processed in parallel, hence
+    at most 12 CPUs are useful.
+    @param cost: Estimated run time of the detection on one CPU
+    @param ideal: Ideal makespan of the batch, total cost / number of CPUs
+    @param cpus: Number of CPUs of the batch
+    @return: Number of CPUs
+    """
+    if ideal <= 0 or cost <= ideal :
+        return 1
+
+    return int(min(max_cores, cpus, ceil(cost / ideal)))
+
+
+########################################################################
+#                                                                      #
+# Memory                                                               #
+#                                                                      #
+########################################################################
+
+def detection_memory(n_events, exposure, tw, mta=1, step=None) :
+    """
+    Estimated peak memory of a detection.
+    The events are held by the main process. Each process of the pool
+    receives the events of one CCD at a time, and holds their counts:
+    64 x 200 pixels x n_bins time windows. With overlapping windows, a window
+    starts every step: there are tw / step times more windows, read from
+    the prefix sums of as many base bins.
+    @param n_events: Number of clean events
+    @param exposure: Duration of the observation in seconds
+    @param tw: Time window in seconds
+    @param mta: Number of CPUs used by the detector
+    @param step: Step between the starts of overlapping time windows, None if they follow each other
+    @return: bytes
+    """
+    n_bins = max(1, int(ceil(exposure / (step if step != None else tw))))
+    workers = min(mta, 12)
+    memory = MEMORY_PROCESS + n_events * MEMORY_PER_EVENT + workers * (N_PIXELS / 12) * n_bins * MEMORY_PER_CELL
+    if mta > 1 :
+        memory += workers * (MEMORY_PROCESS + n_events / 12 * MEMORY_PER_EVENT)
+
+    return memory
+
+
+def triage_memory(n_events) :
+    """
+    Estimated peak memory of the triage of the CCDs of an observation: the
+    events, the coarse counts being negligible.
+    @param n_events: Number of clean events
+    @return: bytes
+    """
+    return MEMORY_PROCESS + n_events * MEMORY_PER_EVENT
+
+
+def lightcurve_memory(n_events, exposure, tw, n_sources, padding=None) :
+    """
+    Estimated peak memory of the lightcurves of the sources of an
+    observation: the events, the lightcurves of the source being extracted,
+    and the rates of all the sources kept for their statistics.
+    @return: bytes
+    """
+    fine, stats = lightcurve_bins(exposure, tw, padding)
+
+    return MEMORY_PROCESS + n_events * MEMORY_PER_EVENT + fine * MEMORY_PER_LC_BIN + n_sources * stats * MEMORY_PER_STATS_BIN
+
+
+def available_memory(fraction=0.8) :
+    """
+    Default memory budget of a node.
+    @param fraction: Fraction of the physical memory usable by the batch
+    @return: bytes, None if the physical memory is unknown
+    """
+    try :
+        return fraction * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError) :
+        return None
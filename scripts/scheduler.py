@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Dependency graph scheduler for the batch processing                  #
+#                                                                      #
+########################################################################
+"""
+Scheduler running a graph of tasks on a bounded pool of processes.
+A task is started as soon as all the tasks it depends on have succeeded
+and its input files exist, so that the stages of one observation do not
+wait for the other observations. A task returning a list of Task objects
+adds them to the graph (e.g. one lightcurve per detected source).
+Among the ready tasks, the ones heading the longest chains of estimated
+cost are started first, so that the large observations do not end up as
+stragglers at the end of the batch. Tasks are only started while their
+predicted memory fits in the budget, with fewer CPUs if needed.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# Task states
+PENDING   = "pending"
+RUNNING   = "running"
+DONE      = "done"
+FAILED    = "failed"
+SKIPPED   = "skipped"
+
+########################################################################
+#                                                                      #
+# Tasks                                                                #
+#                                                                      #
+########################################################################
+
+class Task(object):
+    """
+    Datastructure describing a unit of work of the graph.\n
+
+    Attributes:\n
+    name:     Unique identifier of the task\n
+    fct:      Function run by the task, defined at module level\n
+    args:     Positional arguments of fct\n
+    kwargs:   Keyword arguments of fct\n
+    deps:     Names of the tasks to be completed before this one\n
+    inputs:   Files that shall exist before the task is started\n
+    retries:  Number of times a failed task is run again\n
+    cost:     Estimated run time of the task, in seconds\n
+    cores:    Number of CPUs used by the task\n
+    memory:   Predicted peak memory in bytes, or function of the number of CPUs\n
+    cores_arg: Keyword argument of fct receiving the number of CPUs, if it can be lowered\n
+    state:    One of PENDING, RUNNING, DONE, FAILED, SKIPPED\n
+    attempts: Number of times the task has been started\n
+    suspect:  Running when a worker died, run alone until it succeeds or fails\n
+    result:   Value returned by fct, or the last exception raised
+    """
+
+    def __init__(self, name, fct, args=(), kwargs=None, deps=(), inputs=(), retries=1, cost=0.0, cores=1, memory=0, cores_arg=None):
+        super(Task, self).__init__()
+
+        self.name     = name
+        self.fct      = fct
+        self.args     = tuple(args)
+        self.kwargs   = dict(kwargs) if kwargs else {}
+        self.deps     = list(deps)
+        self.inputs   = list(inputs)
+        self.retries  = retries
+        self.cost     = cost
+        self.cores    = cores
+        self.memory   = memory
+        self.cores_arg = cores_arg
+        self.memory_factor = 1.0
+        self.state    = PENDING
+        self.attempts = 0
+        self.suspect  = False
+        self.result   = None
+        self.started  = None
+        self.duration = 0.0
+
+    def __repr__(self):
+        return "Task({0}, {1})".format(self.name, self.state)
+
+    def predicted_memory(self, cores=None) :
+        """
+        Predicted peak memory of the task run on `cores` CPUs.
+        """
+        cores = self.cores if cores == None else cores
+        memory = self.memory(cores) if callable(self.memory) else self.memory
+
+        return memory * self.memory_factor
+
+    def set_cores(self, cores) :
+        """
+        Changing the number of CPUs of the task.
+        """
+        self.cores = cores
+        if self.cores_arg != None :
+            self.kwargs[self.cores_arg] = cores
+
+
+def priorities(tasks) :
+    """
+    Estimated cost of the longest chain of tasks starting with each task.
+    @param tasks: list of Task
+    @return: dictionary task name -> cost
+    """
+    children = {}
+    for task in tasks :
+        for d in task.deps :
+            children.setdefault(d, []).append(task)
+
+    result = {}
+    def priority(task) :
+        if task.name not in result :
+            result[task.name] = 0.0
+            result[task.name] = task.cost + max([priority(c) for c in children.get(task.name, [])] + [0.0])
+        return result[task.name]
+
+    for task in tasks :
+        priority(task)
+
+    return result
+
+
+def _run_task(fct, args, kwargs) :
+    """
+    Running a task in a worker process.
+    The traceback is formatted here since it cannot be pickled.
+    """
+    try :
+        return True, fct(*args, **kwargs)
+    except Exception as e :
+        return False, "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+########################################################################
+#                                                                      #
+# Scheduler                                                            #
+#                                                                      #
+########################################################################
+
+class Scheduler(object):
+    """
+    Running a graph of tasks on at most `processes` worker processes.
+    """
+
+    def __init__(self, processes=12, log=sys.stdout, memory=None):
+        """
+        Constructor for Scheduler class.
+        @param processes: Maximal number of CPUs used at the same time
+        @param log: File where the progress is written, None for silence
+        @param memory: Memory budget in bytes, None for no limit
+        """
+        super(Scheduler, self).__init__()
+
+        self.processes = processes
+        self.log       = log
+        self.memory    = memory
+        self.tasks     = OrderedDict()
+        self.children  = {}
+        self.ranks     = {}
+
+    def add(self, task) :
+        """
+        Adding a task to the graph. The ranks of the graph, see priorities, are
+        updated here, only the ones of the tasks it depends on being able to grow.
+        @raise ValueError: if a task with the same name already exists
+        """
+        if task.name in self.tasks :
+            raise ValueError("Task {0} already exists".format(task.name))
+        self.tasks[task.name] = task
+        for d in task.deps :
+            self.children.setdefault(d, []).append(task.name)
+
+        # Tasks added before the ones they depend on
+        ranks = [self.ranks[c] for c in self.children.get(task.name, []) if c in self.ranks]
+        self.ranks[task.name] = task.cost + max(ranks + [0.0])
+        stack = [task]
+        while stack :
+            child = stack.pop()
+            for d in child.deps :
+                parent = self.tasks.get(d)
+                if parent != None and parent.cost + self.ranks[child.name] > self.ranks[d] :
+                    self.ranks[d] = parent.cost + self.ranks[child.name]
+                    stack.append(parent)
+
+        return task
+
+    def remove(self, name) :
+        """
+        Removing a finished task from the graph, with the tasks depending on it.
+        The ranks are not lowered: the tasks it depends on are finished too.
+        """
+        task = self.tasks.pop(name)
+        del self.ranks[name]
+        for d in task.deps :
+            siblings = self.children.get(d, [])
+            if name in siblings :
+                siblings.remove(name)
+            if not siblings :
+                self.children.pop(d, None)
+        for child in self.children.pop(name, []) :
+            if child in self.tasks :
+                self.remove(child)
+
+    def _print(self, message) :
+        if self.log != None :
+            print(" {0} {1}".format(time.strftime("%H:%M:%S"), message), file=self.log)
+            self.log.flush()
+
+    def _ready(self) :
+        """
+        Updating the states of the pending tasks.
+        @return: list of the tasks that can be started
+        """
+        ready  = []
+        failed = []
+        for task in self.tasks.values() :
+            if task.state != PENDING :
+                continue
+            deps = [self.tasks.get(d) for d in task.deps]
+            if any(d == None or d.state in (FAILED, SKIPPED) for d in deps) :
+                task.state = SKIPPED
+                failed.append(task.name)
+                self._print("SKIPPED  {0} (dependency failed)".format(task.name))
+            elif all(d.state == DONE for d in deps) :
+                missing = [f for f in task.inputs if not os.path.exists(f)]
+                if missing :
+                    task.state  = FAILED
+                    task.result = "Missing inputs: {0}".format(", ".join(missing))
+                    failed.append(task.name)
+                    self._print("FAILED   {0} ({1})".format(task.name, task.result))
+                else :
+                    ready.append(task)
+
+        # Failures propagate along the graph, whatever the order of the tasks
+        while failed :
+            for name in self.children.get(failed.pop(), []) :
+                child = self.tasks.get(name)
+                if child != None and child.state == PENDING :
+                    child.state = SKIPPED
+                    failed.append(name)
+                    self._print("SKIPPED  {0} (dependency failed)".format(name))
+
+        return ready
+
+    def _select(self, ready, running) :
+        """
+        Choosing the tasks to start among the ready ones: longest chains
+        first, as long as their CPUs are available and their memory fits in
+        the budget. A task that does not fit is given fewer CPUs if it can
+        be; a task that does not fit on its own is run alone. The tasks of a
+        broken pool are run alone, one at a time, to find the one that broke it.
+        @return: list of tasks
+        """
+        if any(t.suspect for t in running.values()) :
+            return []
+        suspects = [t for t in ready if t.suspect]
+        if suspects :
+            if running :
+                return []
+            ready = suspects[:1]
+
+        free   = self.processes - sum(self._cores(t) for t in running.values())
+        memory = sum(t.predicted_memory(self._cores(t)) for t in running.values())
+        selected = []
+        for task in sorted(ready, key=lambda t: self.ranks[t.name], reverse=True) :
+            cores = self._cores(task)
+            # The next task waits for its CPUs, the smaller ones shall not overtake it
+            if cores > free :
+                break
+            if self.memory != None :
+                while cores > 1 and task.cores_arg != None and memory + task.predicted_memory(cores) > self.memory :
+                    cores -= 1
+                if memory + task.predicted_memory(cores) > self.memory :
+                    if running or selected :
+                        break
+                    self._print("WARNING  {0} predicted memory {1:.1f} GB exceeds the budget, run alone".format(task.name, task.predicted_memory(cores) / 1e9))
+            if cores < self._cores(task) :
+                self._print("BACKOFF  {0} on {1} CPUs instead of {2}".format(task.name, cores, task.cores))
+                task.set_cores(cores)
+            selected.append(task)
+            free   -= cores
+            memory += task.predicted_memory(cores)
+
+        return selected
+
+    def _cores(self, task) :
+        return max(1, min(task.cores, self.processes))
+
+    def _finish(self, task, ok, result) :
+        """
+        Recording the outcome of a task, retrying or expanding the graph.
+        """
+        if ok :
+            task.state  = DONE
+            task.result = result
+            self._print("DONE     {0} ({1:.1f} s)".format(task.name, task.duration))
+            if isinstance(result, (list, tuple)) and all(isinstance(t, Task) for t in result) :
+                for child in result :
+                    if task.name not in child.deps :
+                        child.deps.append(task.name)
+                    self.add(child)
+        elif task.attempts <= task.retries :
+            task.state  = PENDING
+            task.result = result
+            self._print("RETRY    {0} (attempt {1} failed)\n{2}".format(task.name, task.attempts, result))
+        else :
+            task.state  = FAILED
+            task.result = result
+            self._print("FAILED   {0}\n{1}".format(task.name, result))
+
+    def run(self, source=None, interval=10.0) :
+        """
+        Running the tasks until all of them are done, failed or skipped.
+        @param source: Function of the scheduler called every interval seconds,
+        returning the tasks to add to the graph, or None once it has no more
+        tasks to give. The run goes on, with the same worker processes, as
+        long as the source gives tasks
+        @param interval: Time between two calls of the source, in seconds
+        @return: dictionary of the task states
+        """
+        running   = {}
+        t_start   = time.time()
+        next_poll = t_start
+        executor  = ProcessPoolExecutor(max_workers=self.processes)
+        try :
+            while True :
+                if source != None and time.time() >= next_poll :
+                    tasks = source(self)
+                    next_poll = time.time() + interval
+                    if tasks == None :
+                        source = None
+                    else :
+                        for task in tasks :
+                            self.add(task)
+
+                for task in self._select(self._ready(), running) :
+                    task.state    = RUNNING
+                    task.attempts += 1
+                    task.started  = time.time()
+                    self._print("START    {0}".format(task.name))
+                    future = executor.submit(_run_task, task.fct, task.args, task.kwargs)
+                    running[future] = task
+
+                if not running :
+                    if source == None :
+                        break
+                    time.sleep(max(0.0, next_poll - time.time()))
+                    continue
+
+                timeout = max(0.0, next_poll - time.time()) if source != None else None
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                broken = []
+                while finished :
+                    for future in finished :
+                        task = running.pop(future)
+                        task.duration = time.time() - task.started
+                        try :
+                            ok, result = future.result()
+                        except BrokenProcessPool as e :
+                            broken.append((task, repr(e)))
+                            continue
+                        except Exception as e :
+                            ok, result = False, repr(e)
+                        task.suspect = False
+                        self._finish(task, ok, result)
+                    # All the tasks of a broken pool end with it
+                    finished = wait(running)[0] if broken else []
+
+                if len(broken) == 1 :
+                    # A worker died (e.g. killed by the OOM killer) while the
+                    # task ran alone: its memory was underestimated
+                    task, result = broken[0]
+                    task.memory_factor *= 2
+                    task.suspect = False
+                    self._finish(task, False, result)
+                else :
+                    # Any of the tasks may have broken the pool, they are run
+                    # again one at a time without counting this attempt
+                    for task, result in broken :
+                        task.attempts -= 1
+                        task.state   = PENDING
+                        task.suspect = True
+                        self._print("REQUEUE  {0} (worker pool broken)".format(task.name))
+                if broken :
+                    executor.shutdown(wait=True)
+                    executor = ProcessPoolExecutor(max_workers=self.processes)
+        finally :
+            executor.shutdown(wait=True)
+
+        states = OrderedDict((name, task.state) for name, task in self.tasks.items())
+        counts = {s : list(states.values()).count(s) for s in (DONE, FAILED, SKIPPED)}
+        self._print("Finished: {0} done, {1} failed, {2} skipped".format(counts[DONE], counts[FAILED], counts[SKIPPED]))
+
+        # Lower bound of the makespan: the CPU time spread over all the CPUs
+        busy = sum(t.duration * self._cores(t) for t in self.tasks.values())
+        self._print("Makespan {0:.1f} s, ideal {1:.1f} s on {2} CPUs".format(time.time() - t_start, busy / self.processes, self.processes))
+
+        return states
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Spatial index of the events                                          #
+#                                                                      #
+########################################################################
+"""
+Grid index over the sky positions of the events, so that region queries
+(source and background circles, annuli, exclusion regions) only read the
+events of the grid cells overlapping the region, instead of filtering the
+whole events list for each region.
+The events are sorted by cell, the cells being numbered row by row, and an
+offset array gives the first event of each cell: the events of a row of
+cells are a contiguous slice.
+"""
+
+# Built-in imports
+
+import os
+
+# Third-party imports
+
+import numpy as np
+
+# Size of a cell in sky pixels, about the radius of a source
+CELL_SIZE = 64
+
+# Indexes of the events files already read, by (path, size, mtime, cell)
+_indexes = {}
+
+########################################################################
+#                                                                      #
+# Index                                                                #
+#                                                                      #
+########################################################################
+
+class SpatialIndex(object):
+    """
+    Grid index over positions x, y.\n
+
+    Attributes:\n
+    x, y:     Positions of the events\n
+    cell:     Size of a cell\n
+    x0, y0:   Lower corner of the grid\n
+    nx, ny:   Number of cells per row and per column\n
+    order:    Events sorted by cell\n
+    offsets:  Position in order of the first event of each cell, and of the end
+    """
+
+    def __init__(self, x, y, cell=CELL_SIZE):
+        """
+        Constructor for SpatialIndex class.
+        @param x, y: Positions of the events
+        @param cell: Size of a cell
+        """
+        super(SpatialIndex, self).__init__()
+
+        self.x    = np.asarray(x, dtype=float)
+        self.y    = np.asarray(y, dtype=float)
+        self.cell = float(cell)
+        if len(self.x) :
+            self.x0, self.y0 = self.x.min(), self.y.min()
+            self.nx = int((self.x.max() - self.x0) // self.cell) + 1
+            self.ny = int((self.y.max() - self.y0) // self.cell) + 1
+        else :
+            self.x0, self.y0, self.nx, self.ny = 0.0, 0.0, 1, 1
+
+        cells        = self._cell(self.x, self.y)
+        self.order   = np.argsort(cells, kind='stable')
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))))
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cell(self, x, y) :
+        ix = ((x - self.x0) // self.cell).astype(np.int64)
+        iy = ((y - self.y0) // self.cell).astype(np.int64)
+
+        return iy * self.nx + ix
+
+    def box(self, x_min, x_max, y_min, y_max) :
+        """
+        Events of the cells overlapping a box, a superset of the events within it.
+        @return: indices of the events
+        """
+        ix0 = max(0, int((x_min - self.x0) // self.cell))
+        ix1 = min(self.nx - 1, int((x_max - self.x0) // self.cell))
+        iy0 = max(0, int((y_min - self.y0) // self.cell))
+        iy1 = min(self.ny - 1, int((y_max - self.y0) // self.cell))
+        if ix0 > ix1 or iy0 > iy1 :
+            return np.empty(0, dtype=np.int64)
+
+        # One slice per row of cells
+        rows = [self.order[self.offsets[iy * self.nx + ix0]:self.offsets[iy * self.nx + ix1 + 1]] for iy in range(iy0, iy1 + 1)]
+
+        return np.concatenate(rows)
+
+    def circle(self, cx, cy, r) :
+        """
+        @return: indices of the events within a circle
+        """
+        return self.annulus(cx, cy, 0.0, r)
+
+    def annulus(self, cx, cy, r_in, r_out) :
+        """
+        @return: indices of the events within an annulus, r_in < distance <= r_out
+        (distance <= r_out if r_in is 0)
+        """
+        candidates = self.box(cx - r_out, cx + r_out, cy - r_out, cy + r_out)
+        d2 = (self.x[candidates] - cx)**2 + (self.y[candidates] - cy)**2
+        keep = d2 <= r_out**2
+        if r_in > 0 :
+            keep &= d2 > r_in**2
+
+        return candidates[keep]
+
+    def polygon(self, vertices) :
+        """
+        @param vertices: list of (x, y) vertices of the polygon
+        @return: indices of the events within a polygon (even-odd rule)
+        """
+        vx, vy = np.asarray(vertices, dtype=float).T
+        candidates = self.box(vx.min(), vx.max(), vy.min(), vy.max())
+        x, y = self.x[candidates], self.y[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        for i in range(len(vx)) :
+            x1, y1, x2, y2 = vx[i - 1], vy[i - 1], vx[i], vy[i]
+            crossing = (y1 > y) != (y2 > y)
+            with np.errstate(divide='ignore', invalid='ignore') :
+                inside ^= crossing & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+
+        return candidates[inside]
+
+    def mask(self, indices) :
+        """
+        Boolean mask over all the events from a list of indices.
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[indices] = True
+
+        return mask
+
+
+def events_index(events_file, x, y, cell=CELL_SIZE) :
+    """
+    Index of the events of a file, built once per version of the file.
+    @param events_file: File the events were read from
+    @param x, y: Positions of the events
+    @return: SpatialIndex
+    """
+    stat = os.stat(events_file)
+    key  = (os.path.abspath(events_file), stat.st_size, stat.st_mtime, cell)
+    if key not in _indexes :
+        _indexes.clear()
+        _indexes[key] = SpatialIndex(x, y, cell)
+
+    return _indexes[key]
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Streaming detection                                                  #
+#                                                                      #
+########################################################################
+"""
+Near real-time detection of the flares in a stream of events: batches of
+events in time order, read from a growing events file or replayed from a
+finished one. The time windows are closed as soon as an event after their
+end arrives, their counts (summed over 3x3 pixels) corrected by the good
+time ratio of the window, the windows below the good time ratio being left
+out as in the detector. Each pixel keeps the histogram of its corrected
+counts, with exact integer bins up to EXACT_COUNTS then bins growing by
+HISTOGRAM_RATIO, and its running median, maximum and minimum: its
+variability is the one of the detector, exact as long as the median is
+below EXACT_COUNTS and the windows are entirely within the good time
+intervals (gtr = 1). The counts of a window partly out of them, corrected
+by its ratio, are not integers: they fall in the bin of the integer below,
+and the median is then within one count below the one of the detector.
+An alert is emitted when the deviation of a closed
+window from the median, summed in a box, crosses the detection threshold,
+at most one time window after the flare; the box is armed again after a
+window below the threshold. The memory used does not depend on the
+duration of the stream.
+
+    streaming.py -evts PN_clean.fits -gti PN_gti.fits -tw 100 --replay -speed 100   (replay benchmark)
+    streaming.py -evts growing_file.fits -tw 100                                    (following a file)
+"""
+
+# Built-in imports
+
+import sys
+import time
+import argparse
+
+# Third-party imports
+
+import numpy as np
+
+# Internal imports
+
+from fits_extractor import read_events, extraction_deleted_periods
+
+# Columns of the streamed events
+STREAM_COLUMNS = ['TIME', 'RAWX', 'RAWY', 'CCDNR']
+
+# Closed windows needed before the variability of a pixel is computed
+MIN_WINDOWS = 2
+
+# Histograms of the corrected box counts of each pixel: exact integer bins up
+# to EXACT_COUNTS, then bins growing by HISTOGRAM_RATIO up to about 26000 counts
+EXACT_COUNTS    = 64
+HISTOGRAM_RATIO = 1.1
+HISTOGRAM_BINS  = 128
+HISTOGRAM_EDGES = np.concatenate((np.arange(EXACT_COUNTS, dtype=float),
+                                  EXACT_COUNTS * HISTOGRAM_RATIO ** np.arange(HISTOGRAM_BINS - EXACT_COUNTS)))
+
+########################################################################
+#                                                                      #
+# Event streams                                                        #
+#                                                                      #
+########################################################################
+
+def replay(events_file, batch=10.0, speed=None) :
+    """
+    Replaying a finished events file as a stream.
+    @param batch: Duration of the events of a batch, in seconds of event time
+    @param speed: Event time elapsed per second of wall time, as fast as
+    possible if None
+    @return: generator of record arrays of events sorted by TIME
+    """
+    header, events = read_events(events_file, STREAM_COLUMNS)
+    events = events[np.argsort(events['TIME'], kind='stable')]
+    if len(events) == 0 :
+        return
+
+    edges  = np.arange(events['TIME'][0], events['TIME'][-1] + batch, batch)
+    bounds = np.searchsorted(events['TIME'], edges)
+    start  = time.time()
+    for i in range(len(bounds) - 1) :
+        if speed != None :
+            # Batches on the schedule of the stream, whatever the time taken by their processing
+            time.sleep(max(start + (i + 1) * batch / speed - time.time(), 0))
+        yield events[bounds[i]:bounds[i + 1]]
+
+
+def follow_events(events_file, poll=1.0, timeout=60.0, extname='EVENTS') :
+    """
+    Following an events file being written, its new rows being read at
+    each poll.
+    @param poll: Time between two reads of the file, in seconds
+    @param timeout: Time without new rows after which the stream ends
+    @return: generator of record arrays of the new events
+    """
+    from astropy.io import fits
+
+    n_read = 0
+    last   = time.time()
+    while time.time() - last < timeout :
+        try :
+            with fits.open(events_file, memmap=True) as hdulist :
+                data = hdulist[extname].data
+                rows = data[n_read:]
+                events = np.rec.fromarrays([np.array(rows[c]) for c in STREAM_COLUMNS], names=STREAM_COLUMNS)
+        except (OSError, KeyError, ValueError) :
+            # File not written yet, or being written
+            events = np.empty(0)
+        if len(events) :
+            n_read += len(events)
+            last = time.time()
+            yield events
+        else :
+            time.sleep(poll)
+
+########################################################################
+#                                                                      #
+# Detection                                                            #
+#                                                                      #
+########################################################################
+
+class Alert(object):
+    """
+    Box crossing the detection threshold.\n
+
+    Attributes:\n
+    time:      End of the time window of the crossing, in event time\n
+    ccd:       CCD number\n
+    rawx, rawy: Centre of the box\n
+    box:       Deviation of the window summed in the box\n
+    threshold: Detection threshold of the box\n
+    latency:   Wall time between the end of the time window and the alert
+    """
+
+    def __init__(self, time, ccd, rawx, rawy, box, threshold, latency):
+        super(Alert, self).__init__()
+
+        self.time      = time
+        self.ccd       = ccd
+        self.rawx      = rawx
+        self.rawy      = rawy
+        self.box       = box
+        self.threshold = threshold
+        self.latency   = latency
+
+    def __str__(self):
+        return "Alert t={0:.1f} CCD {1} RAWX {2} RAWY {3} box {4:.1f} > {5:.1f} ({6:.3f} s)".format(
+               self.time, self.ccd, self.rawx, self.rawy, self.box, self.threshold, self.latency)
+
+
+class StreamingDetector(object):
+    """
+    Detector of the flares of a stream of events, with running statistics
+    of fixed size per pixel.\n
+
+    Attributes:\n
+    tw, bs, dl: Time window, box size and detection level\n
+    gti, gtr:  Good time intervals and acceptable good time ratio of the windows\n
+    speed:     Event time elapsed per second of wall time, giving the wall time of the window ends\n
+    window_end: End of the current time window\n
+    counts:    Counts of the current window, array of shape (12, 64, 200)\n
+    n_windows: Number of good windows closed\n
+    histogram: Histogram of the corrected box counts of each pixel\n
+    median_bin, below: Bin of the median of each pixel, and number of counts below it\n
+    maximum, minimum: Extreme corrected box counts of each pixel\n
+    v_matrix:  Running variability\n
+    alerted:   Boxes above the threshold in the last good window\n
+    n_events:  Number of events consumed
+    """
+
+    def __init__(self, tw=100.0, bs=3, dl=8, min_median=0.75, gti=None, gtr=1.0, speed=None):
+        """
+        Constructor for StreamingDetector class.
+        @param tw: Duration of the time windows
+        @param bs: Size of the detection box in pixels
+        @param dl: Number of times the median variability needed in a box
+        @param min_median: Lower limit of the median variability, as in the detector
+        @param gti: GTI table with START and STOP columns. If None, the windows
+        without any event are taken as outside the good time intervals
+        @param gtr: Acceptable good time ratio of the windows
+        @param speed: Event time elapsed per second of wall time. If None, the
+        latencies are measured from the arrival of the batch closing the window
+        """
+        super(StreamingDetector, self).__init__()
+
+        self.tw, self.bs, self.dl = tw, bs, dl
+        self.min_median = min_median
+        self.gti, self.gtr = gti, gtr
+        self.speed      = speed
+        self.origin     = None
+        self.window_end = None
+        self.counts     = np.zeros((12, 64, 200))
+        self.n_windows  = 0
+        self.histogram  = np.zeros((12 * 64 * 200, HISTOGRAM_BINS), dtype=np.uint32)
+        self.median_bin = np.zeros(12 * 64 * 200, dtype=np.int64)
+        self.below      = np.zeros(12 * 64 * 200, dtype=np.int64)
+        self.maximum    = np.full(12 * 64 * 200, -np.inf)
+        self.minimum    = np.full(12 * 64 * 200, np.inf)
+        self.v_matrix   = np.zeros((12, 64, 200))
+        self.alerted    = np.zeros((12, 64 - bs + 1, 200 - bs + 1), dtype=bool)
+        self.n_events   = 0
+
+    def _count(self, events) :
+        ccd = np.asarray(events['CCDNR'], dtype=np.int64) - 1
+        x   = np.asarray(events['RAWX'], dtype=np.int64) - 1
+        y   = np.asarray(events['RAWY'], dtype=np.int64) - 1
+        keep = (ccd >= 0) & (ccd < 12) & (x >= 0) & (x < 64) & (y >= 0) & (y < 200)
+        self.counts += np.bincount(((ccd * 64 + x) * 200 + y)[keep], minlength=12 * 64 * 200).reshape(12, 64, 200)
+
+    def _ratio(self) :
+        """
+        Good time ratio of the current window.
+        """
+        if self.gti is None :
+            return 1.0 if np.any(self.counts) else 0.0
+        start = np.asarray(self.gti['START'], dtype=float)
+        stop  = np.asarray(self.gti['STOP'], dtype=float)
+        good  = np.clip(np.minimum(stop, self.window_end) - np.maximum(start, self.window_end - self.tw), 0, None)
+
+        return np.sum(good) / self.tw
+
+    def _insert(self, rates) :
+        """
+        Adding the corrected box counts of a window to the histograms, and
+        moving the bin of the median of each pixel to the one of its
+        (n_windows - 1) // 2-th count, by at most the bins between them.
+        """
+        pixels = np.arange(len(rates))
+        b = np.clip(np.searchsorted(HISTOGRAM_EDGES, rates, side='right') - 1, 0, HISTOGRAM_BINS - 1)
+        self.histogram[pixels, b] += 1
+        self.below += b < self.median_bin
+        self.n_windows += 1
+
+        k = (self.n_windows - 1) // 2
+        down = np.flatnonzero(self.below > k)
+        while len(down) :
+            self.median_bin[down] -= 1
+            self.below[down] -= self.histogram[down, self.median_bin[down]]
+            down = down[self.below[down] > k]
+        up = np.flatnonzero(self.below + self.histogram[pixels, self.median_bin] <= k)
+        while len(up) :
+            self.below[up] += self.histogram[up, self.median_bin[up]]
+            self.median_bin[up] += 1
+            up = up[self.below[up] + self.histogram[up, self.median_bin[up]] <= k]
+
+    def median(self) :
+        """
+        Running median of the corrected box counts of each pixel, the mean of
+        the two middle counts for an even number of windows as numpy.median.
+        Exact for the integer counts below EXACT_COUNTS, within one count below
+        for the counts corrected by a good time ratio below 1, within a factor
+        HISTOGRAM_RATIO above EXACT_COUNTS.
+        """
+        lower = HISTOGRAM_EDGES[self.median_bin]
+        if self.n_windows % 2 == 1 :
+            return lower
+
+        # The upper middle count is in the next non-empty bin if the lower one is the last of its bin
+        upper = self.median_bin.copy()
+        after = np.flatnonzero(self.below + self.histogram[np.arange(len(upper)), upper] <= self.n_windows // 2)
+        upper[after] += 1
+        while len(after) :
+            after = after[self.histogram[after, upper[after]] == 0]
+            upper[after] += 1
+
+        return (lower + HISTOGRAM_EDGES[upper]) / 2
+
+    def _close_window(self, arrival) :
+        """
+        Updating the running statistics with the current window.
+        @return: list of Alert
+        """
+        alerts = []
+        ratio  = self._ratio()
+        if ratio >= self.gtr and ratio > 0 :
+            padded = np.pad(self.counts, ((0, 0), (1, 1), (1, 1)))
+            rates  = sum(padded[:, dx:dx+64, dy:dy+200] for dx in range(3) for dy in range(3)).ravel() / ratio
+
+            n_before = self.n_windows
+            self._insert(rates)
+            np.maximum(self.maximum, rates, out=self.maximum)
+            np.minimum(self.minimum, rates, out=self.minimum)
+
+            if n_before >= MIN_WINDOWS :
+                # Variability of the detector over the windows closed so far, and deviation of this window
+                med = self.median()
+                with np.errstate(divide='ignore', invalid='ignore') :
+                    v_matrix = np.where(med != 0, np.maximum(self.maximum - med, np.absolute(self.minimum - med)) / med, self.maximum)
+                    v_window = np.where(med != 0, np.absolute(rates - med) / med, rates)
+                self.v_matrix = v_matrix.reshape(12, 64, 200)
+                alerts = self._detect(v_window.reshape(12, 64, 200), arrival)
+
+        self.counts[:] = 0
+        self.window_end += self.tw
+
+        return alerts
+
+    def _wall_time(self, event_time, arrival) :
+        """
+        Wall time of an event time, from the first batch of the stream.
+        """
+        if self.speed == None :
+            return arrival
+        return self.origin[0] + (event_time - self.origin[1]) / self.speed
+
+    def _detect(self, v_window, arrival) :
+        """
+        Boxes of the deviation of the window crossing the threshold, one alert
+        per group of adjacent boxes. A box is alerted again only after a window
+        below the threshold.
+        """
+        from scipy.ndimage import label
+
+        median    = max(np.median(self.v_matrix), self.min_median)
+        threshold = self.dl * self.bs**2 * median
+        boxes = np.lib.stride_tricks.sliding_window_view(v_window, (self.bs, self.bs), axis=(1, 2)).sum(axis=(-1, -2))
+        above = boxes > threshold
+        new   = above & ~self.alerted
+        self.alerted = above
+
+        alerts = []
+        for ccd in np.flatnonzero(np.any(new, axis=(1, 2))) :
+            groups, n_groups = label(new[ccd])
+            for g in range(1, n_groups + 1) :
+                x, y = np.unravel_index(np.argmax(np.where(groups == g, boxes[ccd], -np.inf)), groups.shape)
+                alerts.append(Alert(self.window_end, ccd + 1, x + 1 + self.bs // 2, y + 1 + self.bs // 2, boxes[ccd, x, y],
+                                    threshold, time.time() - self._wall_time(self.window_end, arrival)))
+
+        return alerts
+
+    def process(self, events, arrival=None) :
+        """
+        Consuming a batch of events, following the previous ones in time.
+        @param events: record array with TIME, RAWX, RAWY and CCDNR, sorted by TIME
+        @param arrival: Wall time of the arrival of the batch, now if None
+        @return: list of Alert of the time windows closed by the batch
+        """
+        arrival = time.time() if arrival == None else arrival
+        alerts  = []
+        if len(events) == 0 :
+            return alerts
+        times = np.asarray(events['TIME'])
+        if self.window_end == None :
+            self.window_end = times[0] + self.tw
+            # The last event of the first batch arrived with it
+            self.origin = (arrival, times[-1])
+
+        i = 0
+        while i < len(events) :
+            j = np.searchsorted(times, self.window_end, side='left')
+            self._count(events[i:j])
+            i = j
+            if i < len(events) :
+                alerts += self._close_window(arrival)
+        self.n_events += len(events)
+
+        return alerts
+
+    def run(self, stream, verbose=True) :
+        """
+        Consuming a stream of batches of events.
+        @return: list of Alert, events per second of wall time
+        """
+        alerts = []
+        t = time.time()
+        for events in stream :
+            for alert in self.process(events) :
+                if verbose :
+                    print(alert)
+                alerts.append(alert)
+
+        return alerts, self.n_events / max(time.time() - t, 1e-9)
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-evts", help="Events file, finished if --replay, being written otherwise", type=str)
+    parser.add_argument("-tw", "--time-window", dest="tw", help="The duration of the time windows.\nDefault: 100", default=100.0, type=float)
+    parser.add_argument("-bs", "--box-size", dest="bs", help="Size of the detection box in pixels.\nDefault: 3", default=3, type=int)
+    parser.add_argument("-gti", help="GTI file of the events, the windows without events being left out if not given", default=None, type=str)
+    parser.add_argument("-gtr", "--good-time-ratio", dest="gtr", help="Ratio acceptability for a time window.\nDefault: 1.0", default=1.0, type=float)
+    parser.add_argument("-dl", "--detection-level", dest="dl", help="The number of times the median variability is required to trigger a detection.\nDefault: 8", default=8, type=float)
+    parser.add_argument("-batch", dest="batch", help="Duration of the replayed batches of events, in seconds.\nDefault: 10", default=10.0, type=float)
+    parser.add_argument("-speed", dest="speed", help="Speed of the stream, in seconds of event time per second.\nDefault: as fast as possible for --replay, 1 otherwise", default=None, type=float)
+    parser.add_argument("-poll", dest="poll", help="Time between two reads of the file being written, in seconds.\nDefault: 1", default=1.0, type=float)
+    parser.add_argument("-timeout", dest="timeout", help="Time without new events ending the stream, in seconds.\nDefault: 60", default=60.0, type=float)
+    parser.add_argument("--replay", help="Replay benchmark of a finished events file", action='store_true')
+    args = parser.parse_args()
+
+    if not args.replay and args.speed == None :
+        args.speed = 1.0
+    gti = None
+    if args.gti != None :
+        gti = extraction_deleted_periods(args.gti)
+
+    stream   = replay(args.evts, args.batch, args.speed) if args.replay else follow_events(args.evts, args.poll, args.timeout)
+    detector = StreamingDetector(args.tw, args.bs, args.dl, gti=gti, gtr=args.gtr, speed=args.speed)
+    alerts, rate = detector.run(stream)
+
+    latencies = [alert.latency for alert in alerts]
+    print(" {0} events, {1:.0f} events/s, {2} alerts".format(detector.n_events, rate, len(alerts)))
+    if latencies :
+        print(" Latency after the end of the time window: mean {0:.4f} s, max {1:.4f} s".format(np.mean(latencies), np.max(latencies)))
+
+    sys.exit(0)
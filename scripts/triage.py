@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Coarse triage of the CCDs                                            #
+#                                                                      #
+########################################################################
+"""
+Coarse pass telling the CCDs that may hold a flare from the quiet ones,
+before the full-resolution detection. The events are counted in pixels
+binned by 2x2 or 4x4 raw pixels, in a single long time window, and each
+CCD is scored by the Poisson significance (-log10 P) of its most deviant
+window over 2x2 boxes of binned pixels, corrected for the number of trials.
+Only the CCDs scoring at least TRIAGE_LEVEL are given to the full detection.
+
+The score is not the variability V of the detector. V is the deviation of
+the counts from their median relative to the median, compared to DL times
+the median V of the observation; the score is a probability, the one of the
+counts of the most deviant window given the mean rate of the box, so that
+the most deviant box of a quiet CCD scores about 0 whatever its count rate.
+There is no one-to-one conversion from DL to a score, the significance of a
+given V growing with the counts of the box. TRIAGE_LEVEL = 1.0 keeps the
+CCDs whose most deviant box is ten times less probable than the one
+expected by chance over all the boxes and windows tested. It is chosen
+conservatively, from the injection test of this module, below the scores of
+the flares found by the full detection at DL 8: flares injected in an
+observation, detected by the full detection, shall not be missed by the
+triage. A lower DL finds fainter flares, the false-negative rate at this
+DL shall then be measured again with -inject.
+
+    triage.py -path FOLDER/OBS -inject 200 -tws 100 1000
+"""
+
+# Built-in imports
+
+import os
+import json
+import argparse
+
+# Third-party imports
+
+import numpy as np
+
+# Internal imports
+
+import file_names as FileNames
+from fits_extractor import extraction_photons, extraction_deleted_periods
+from variability_utils import prefix_good_time, variability_computation, variable_areas_detection
+from variability_statistics import poisson_significance
+
+# Binning of the raw pixels and time window of the triage
+TRIAGE_BINNING = 4
+TRIAGE_TW      = 1000.0
+
+# Good time ratio of the windows of the triage: the long windows cut by the
+# GTIs are kept, their counts being corrected by their projection ratio
+TRIAGE_GTR     = 0.5
+
+# Score, -log10 P, from which a CCD is given to the full detection
+TRIAGE_LEVEL   = 1.0
+
+# Record of the injection test, in the folder of the observation
+INJECTION_FILE = "triage_injection.json"
+
+########################################################################
+#                                                                      #
+# Triage                                                               #
+#                                                                      #
+########################################################################
+
+def coarse_counts(data, gti, start_time, end_time, tw=TRIAGE_TW, gtr=TRIAGE_GTR, binning=TRIAGE_BINNING) :
+    """
+    Counts of the CCDs in binned pixels, summed over 2x2 boxes of binned
+    pixels so that a source on the edge of a binned pixel is not split.
+    @param data: E round, the events of each CCD
+    @param gti: G round, the good time intervals
+    @param tw: Time window
+    @param gtr: Good time ratio of the windows kept
+    @param binning: Number of raw pixels binned along each axis, dividing 64 and 200
+    @return: counts of shape (CCDs, 64 / binning - 1, 200 / binning - 1, good time windows),
+    projection ratio of the good time windows
+    """
+    n_bins = max(int(np.ceil((end_time - start_time) / tw)), 1)
+    ratio  = np.diff(prefix_good_time(gti, start_time, tw, n_bins)) / tw
+    nx, ny = 64 // binning, 200 // binning
+
+    counts = np.zeros((len(data), nx, ny, n_bins))
+    for ccd, events in enumerate(data) :
+        w = np.floor((np.asarray(events['TIME']) - start_time) / tw).astype(np.int64)
+        x = (np.asarray(events['RAWX']).astype(np.int64) - 1) // binning
+        y = (np.asarray(events['RAWY']).astype(np.int64) - 1) // binning
+        keep = (w >= 0) & (w < n_bins) & (x >= 0) & (x < nx) & (y >= 0) & (y < ny)
+        counts[ccd] = np.bincount(((x * ny + y) * n_bins + w)[keep], minlength=nx * ny * n_bins).reshape(nx, ny, n_bins)
+
+    boxes = counts[:, :-1, :-1] + counts[:, 1:, :-1] + counts[:, :-1, 1:] + counts[:, 1:, 1:]
+    good  = ratio >= gtr
+
+    return boxes[..., good], ratio[good]
+
+
+def triage_scores(data, gti, start_time, end_time, tw=TRIAGE_TW, gtr=TRIAGE_GTR, binning=TRIAGE_BINNING) :
+    """
+    Score of each CCD: the Poisson significance, -log10 P, of the most
+    deviant window of its boxes of binned pixels, see coarse_counts, minus
+    log10 of the number of (box, window) tested, so that a quiet CCD scores
+    about 0.
+    @return: array of the scores, infinite if the CCD cannot be triaged (less
+    than two good time windows)
+    """
+    counts, ratio = coarse_counts(data, gti, start_time, end_time, tw, gtr, binning)
+    if counts.shape[-1] < 2 :
+        return np.full(len(data), np.inf)
+
+    # Corrected for the number of boxes and windows tested per CCD
+    trials = np.log10(counts.shape[1] * counts.shape[2] * counts.shape[3])
+
+    return np.amax(poisson_significance(counts, ratio), axis=(1, 2)) - trials
+
+
+def triage_observation(path, evts=FileNames.CLEAN_FILE, gti=FileNames.GTI_FILE, level=TRIAGE_LEVEL, **kwargs) :
+    """
+    Triage of the CCDs of an observation.
+    @param kwargs: tw, gtr, binning, see coarse_counts
+    @return: list of the indices of the CCDs given to the full detection, scores
+    """
+    data, header = extraction_photons(os.path.join(path, evts))
+    gti_list = extraction_deleted_periods(os.path.join(path, gti))
+    t0, tf = _time_span(data)
+    scores = triage_scores(data, gti_list, t0, tf, **kwargs)
+
+    return [ccd for ccd in range(len(data)) if scores[ccd] >= level], scores
+
+
+def _time_span(data) :
+    times = [ccd['TIME'] for ccd in data if len(ccd)]
+
+    return min(t.min() for t in times), max(t.max() for t in times)
+
+########################################################################
+#                                                                      #
+# Injection test                                                       #
+#                                                                      #
+########################################################################
+
+def inject_flare(events, rawx, rawy, t_start, duration, counts, rng) :
+    """
+    Adding the events of a flare to the events of a CCD: a point source
+    spread over about one pixel, at a constant rate during the flare.
+    @return: events sorted by TIME
+    """
+    flare = np.zeros(counts, dtype=events.dtype)
+    flare['TIME'] = rng.uniform(t_start, t_start + duration, counts)
+    flare['RAWX'] = np.clip(np.rint(rng.normal(rawx, 0.7, counts)), 1, 64)
+    flare['RAWY'] = np.clip(np.rint(rng.normal(rawy, 0.7, counts)), 1, 200)
+    if 'CCDNR' in events.dtype.names :
+        flare['CCDNR'] = events['CCDNR'][0] if len(events) else 0
+    if 'PI' in events.dtype.names :
+        flare['PI'] = rng.integers(500, 12000, counts)
+    merged = np.concatenate((events, flare))
+
+    return merged[np.argsort(merged['TIME'], kind='stable')]
+
+
+def full_detection(gti, start_time, end_time, events, median, tw, gtr, bs, dl) :
+    """
+    Variable areas of a CCD found by the full-resolution detection.
+    @param median: Median variability of the observation at this time window
+    @return: list of sets of (RAWX - 1, RAWY - 1)
+    """
+    v_matrix = variability_computation(gti, tw, gtr, start_time, end_time, events)
+
+    return variable_areas_detection(max(median, 0.75), bs, dl, v_matrix)
+
+
+def injection_test(data, gti, n_trials=100, tws=(100.0,), gtr=1.0, bs=3, dl=8, level=TRIAGE_LEVEL,
+                   durations=(50.0, 2000.0), counts=(5, 200), seed=0, **kwargs) :
+    """
+    False-negative rate of the triage: flares are injected one at a time in
+    the events of an observation, and the ones detected by the full
+    detection at any of the time windows tws shall be kept by the triage.
+    A detection already there without the flare is not counted.
+    @param data, gti: E and G rounds of the observation
+    @param n_trials: Number of injected flares
+    @param tws, gtr, bs, dl: Parameters of the full detection
+    @param level: Triage threshold tested
+    @param durations, counts: Ranges of the duration and of the number of events of the flares
+    @param kwargs: tw, binning of the triage, see coarse_counts
+    @return: dictionary of the results
+    """
+    rng = np.random.default_rng(seed)
+    t0, tf = _time_span(data)
+
+    # Scores, median variability and variable areas of the observation without flare
+    scores  = triage_scores(data, gti, t0, tf, **kwargs)
+    medians = {tw : np.median([variability_computation(gti, tw, gtr, t0, tf, events) for events in data]) for tw in tws}
+    baseline = {tw : [set().union(*full_detection(gti, t0, tf, events, medians[tw], tw, gtr, bs, dl)) for events in data] for tw in tws}
+
+    detected, missed, trials = 0, 0, []
+    for i in range(n_trials) :
+        ccd      = int(rng.integers(len(data)))
+        rawx     = int(rng.integers(3, 63))
+        rawy     = int(rng.integers(3, 199))
+        duration = float(np.exp(rng.uniform(*np.log(durations))))
+        t_start  = float(rng.uniform(t0, max(t0, tf - duration)))
+        n_counts = int(np.exp(rng.uniform(*np.log(counts))))
+        events   = inject_flare(data[ccd], rawx, rawy, t_start, duration, n_counts, rng)
+
+        around = set((x, y) for x in range(rawx - 3, rawx + 2) for y in range(rawy - 3, rawy + 2))
+        found  = any(around & (set().union(*full_detection(gti, t0, tf, events, medians[tw], tw, gtr, bs, dl)) - baseline[tw][ccd])
+                     for tw in tws)
+        injected = list(data)
+        injected[ccd] = events
+        score = triage_scores(injected, gti, t0, tf, **kwargs)[ccd]
+        kept  = bool(score >= level)
+        if found :
+            detected += 1
+            missed   += not kept
+        trials.append({'CCD' : ccd + 1, 'RAWX' : rawx, 'RAWY' : rawy, 'DURATION' : duration, 'COUNTS' : n_counts,
+                       'DETECTED' : bool(found), 'SCORE' : float(score), 'KEPT' : kept})
+
+    return {
+            'LEVEL'          : level,
+            'TWS'            : list(tws),
+            'TRIALS'         : n_trials,
+            'DETECTED'       : detected,
+            'MISSED'         : missed,
+            'FALSE_NEGATIVE' : missed / detected if detected else None,
+            'QUIET_KEPT'     : int(np.sum(scores >= level)),
+            'QUIET_SCORES'   : [float(s) for s in scores],
+            'FLARES'         : trials
+           }
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-path", help="Path to the folder containing the observation files", type=str)
+    parser.add_argument("-evts", help="Name of the clean observation file", type=str, default=FileNames.CLEAN_FILE)
+    parser.add_argument("-gti", help="Name of the GTI file", type=str, default=FileNames.GTI_FILE)
+    parser.add_argument("-binning", dest="binning", help="Number of raw pixels binned along each axis, 2 or 4.\nDefault: {0}".format(TRIAGE_BINNING), default=TRIAGE_BINNING, type=int)
+    parser.add_argument("-tw", dest="tw", help="Time window of the triage.\nDefault: {0:g}".format(TRIAGE_TW), default=TRIAGE_TW, type=float)
+    parser.add_argument("-level", dest="level", help="Score from which a CCD is kept.\nDefault: {0:g}".format(TRIAGE_LEVEL), default=TRIAGE_LEVEL, type=float)
+    parser.add_argument("-gtr", dest="gtr", help="Good time ratio of the full detection.\nDefault: 1.0", default=1.0, type=float)
+    parser.add_argument("-inject", dest="inject", help="Number of flares of the injection test, none if 0.\nDefault: 0", default=0, type=int)
+    parser.add_argument("-tws", dest="tws", help="Time windows of the full detection of the injection test.\nDefault: 100", nargs='+', default=[100.0], type=float)
+    parser.add_argument("-bs", dest="bs", help="Box size of the full detection.\nDefault: 3", default=3, type=int)
+    parser.add_argument("-dl", dest="dl", help="Detection level of the full detection.\nDefault: 8", default=8, type=float)
+    parser.add_argument("-seed", dest="seed", help="Seed of the injected flares.\nDefault: 0", default=0, type=int)
+    args = parser.parse_args()
+
+    kept, scores = triage_observation(args.path, args.evts, args.gti, args.level, tw=args.tw, binning=args.binning)
+    print(" Scores\t{0}".format(" ".join("{0:.1f}".format(s) for s in scores)))
+    print(" CCDs kept for the full detection: {0}".format(" ".join(str(ccd + 1) for ccd in kept) or "none"))
+
+    if args.inject > 0 :
+        data, header = extraction_photons(os.path.join(args.path, args.evts))
+        gti_list = extraction_deleted_periods(os.path.join(args.path, args.gti))
+        record = injection_test(data, gti_list, args.inject, args.tws, args.gtr, args.bs, args.dl, args.level, seed=args.seed,
+                                tw=args.tw, binning=args.binning)
+        record.update({'TW' : args.tw, 'BINNING' : args.binning, 'SEED' : args.seed})
+        with open(os.path.join(args.path, INJECTION_FILE), 'w') as f :
+            json.dump(record, f, indent=1)
+        print(" Injection test: {0} of {1} flares detected, {2} missed by the triage, false-negative rate {3}".format(
+              record['DETECTED'], record['TRIALS'], record['MISSED'],
+              "{0:.3f}".format(record['FALSE_NEGATIVE']) if record['DETECTED'] else "undefined"))
+        print(" Quiet CCDs kept: {0} of {1}".format(record['QUIET_KEPT'], len(data)))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Variability statistics                                               #
+#                                                                      #
+########################################################################
+"""
+Statistics of variability computed from the count cube of a CCD, the counts
+of each pixel (summed over its 3x3 neighbourhood) in each good time window,
+and the projection ratio of the windows, the fraction of each window within
+the good time intervals. All of them work on whole arrays, the time windows
+on the last axis, so that any subset is computed from the same cube.
+Every statistic is registered in STATISTICS by the name of its map in the
+variability file.
+"""
+
+# Third-party imports
+
+import numpy as np
+
+# False alarm probability of a change point of the Bayesian blocks
+BLOCKS_P0 = 0.05
+
+# Maximal number of values of the arrays of a block of pixels of the Bayesian blocks
+CHUNK_VALUES = 1 << 20
+
+########################################################################
+#                                                                      #
+# Statistics                                                           #
+#                                                                      #
+########################################################################
+
+def _rates(counts, ratio) :
+    """
+    Counts of the windows corrected by their projection ratio, and mean rate
+    of each pixel in counts per (full) window.
+    """
+    rates = counts / ratio
+    mean  = np.sum(counts, axis=-1) / np.sum(ratio)
+
+    return rates, mean
+
+
+def max_deviation(counts, ratio) :
+    """
+    The EXOD variability: largest deviation of the corrected counts from
+    their median, divided by the median, or the maximum if the median is null.
+    """
+    rates = counts / ratio
+    max = np.amax(rates, axis=-1)
+    min = np.amin(rates, axis=-1)
+    med = np.median(rates, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        return np.where(med != 0, np.maximum(max - med, np.absolute(min - med)) / med, max)
+
+
+def poisson_significance(counts, ratio) :
+    """
+    Poisson probability of the most deviant window, given the mean rate of the
+    pixel, as -log10(P): the lower of the probabilities of at least (excess)
+    and at most (deficit) the counts of the window.
+    """
+    from scipy.stats import poisson
+
+    rates, mean = _rates(counts, ratio)
+    expected    = mean[..., None] * ratio
+    log_p = np.minimum(poisson.logsf(counts - 1, expected), poisson.logcdf(counts, expected))
+
+    return np.clip(-np.amin(log_p, axis=-1) / np.log(10), 0, None)
+
+
+def excess_variance(counts, ratio) :
+    """
+    Fractional excess variance Fvar: variance of the corrected counts in
+    excess of their Poisson variance, relative to the mean, 0 if the
+    variance is within the noise.
+    """
+    rates, mean = _rates(counts, ratio)
+    excess = np.var(rates, axis=-1, ddof=1) - np.mean(counts / ratio**2, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        return np.where((mean > 0) & (excess > 0), np.sqrt(np.clip(excess, 0, None)) / mean, 0.0)
+
+
+def chisq_constancy(counts, ratio) :
+    """
+    Reduced chi-square of the counts against a constant rate, the expected
+    counts of a window being its Poisson variance.
+    """
+    rates, mean = _rates(counts, ratio)
+    expected    = mean[..., None] * ratio
+    with np.errstate(divide='ignore', invalid='ignore') :
+        chisq = np.sum(np.where(expected > 0, (counts - expected)**2 / expected, 0.0), axis=-1)
+
+    return chisq / (counts.shape[-1] - 1)
+
+
+def _change_points(counts, cum_ratio, ncp_prior) :
+    """
+    Number of change points of the optimal partition of each row of counts.
+    @param counts: array of shape (pixels, windows)
+    @param cum_ratio: cumulated projection ratio, starting at 0
+    """
+    n_pix, n_bins = counts.shape
+    cum_counts = np.concatenate((np.zeros((n_pix, 1)), np.cumsum(counts, axis=1)), axis=1)
+    best = np.zeros((n_pix, n_bins))
+    last = np.zeros((n_pix, n_bins), dtype=np.int32)
+    for r in range(n_bins) :
+        # Blocks k..r for every first cell k
+        n_k = cum_counts[:, r + 1:r + 2] - cum_counts[:, :r + 1]
+        t_k = cum_ratio[r + 1] - cum_ratio[:r + 1]
+        with np.errstate(divide='ignore', invalid='ignore') :
+            fit = np.where(n_k > 0, n_k * np.log(n_k / t_k), 0.0) - ncp_prior
+        fit[:, 1:] += best[:, :r]
+        last[:, r] = np.argmax(fit, axis=1)
+        best[:, r] = fit[np.arange(n_pix), last[:, r]]
+
+    # Walking back the change points
+    change_points = np.zeros(n_pix, dtype=np.int32)
+    index  = np.full(n_pix, n_bins)
+    active = np.arange(n_pix)
+    while len(active) :
+        index[active] = last[active, index[active] - 1]
+        active = active[index[active] > 0]
+        change_points[active] += 1
+
+    return change_points
+
+
+def bayesian_blocks(counts, ratio, p0=BLOCKS_P0, chunk=CHUNK_VALUES) :
+    """
+    Number of change points of the Bayesian blocks of the counts (Scargle et
+    al. 2013, binned data), the windows being the cells and their projection
+    ratio their exposure. The optimal partition is computed for blocks of
+    pixels at once, of at most chunk values per array, in a time quadratic
+    with the number of windows: it suits the long time windows.
+    """
+    shape  = counts.shape[:-1]
+    counts = counts.reshape(-1, counts.shape[-1])
+    n_pix, n_bins = counts.shape
+    ncp_prior = 4 - np.log(73.53 * p0 * n_bins**-0.478)
+    cum_ratio = np.concatenate(([0.0], np.cumsum(ratio)))
+
+    step = max(1, chunk // max(1, n_bins))
+    change_points = np.concatenate([_change_points(counts[i:i + step], cum_ratio, ncp_prior) for i in range(0, n_pix, step)] or [np.zeros(0)])
+
+    return change_points.reshape(shape).astype(float)
+
+
+# Statistics by name, each one computing a map from (counts, ratio)
+STATISTICS = {
+    'VARIABILITY' : max_deviation,
+    'POISSON'     : poisson_significance,
+    'FVAR'        : excess_variance,
+    'CHISQ'       : chisq_constancy,
+    'BLOCKS'      : bayesian_blocks,
+}
+
+
+def compute_statistics(names, counts, ratio) :
+    """
+    Maps of several statistics computed from the same count cube.
+    @param names: names of the statistics, keys of STATISTICS
+    @param counts: counts of the good time windows, on the last axis
+    @param ratio: projection ratio of the windows
+    @return: dictionary of the maps by name, null if there are less than two windows
+    """
+    if counts.shape[-1] < 2 :
+        return {name : np.zeros(counts.shape[:-1]) for name in names}
+
+    return {name : STATISTICS[name](counts, ratio) for name in names}
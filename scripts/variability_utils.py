@@ -14,6 +14,9 @@
 Implementation of variability-related procedures specified into the documentation
 """
 
+# Built-in imports
+
+import zlib
 from math import *
 
 # Third-party imports
@@ -24,6 +27,10 @@ from numpy import inf
 # Internal imports
 
 from file_utils import *
+from variability_statistics import max_deviation, compute_statistics
+
+# Number of window lengths of the adaptive mode, time_interval * 2**k
+ADAPTIVE_LEVELS = 8
 
 ########################################################################
 #                                                                      #
@@ -31,27 +38,22 @@ from file_utils import *
 #                                                                      #
 ########################################################################
 
-def variability_computation(gti, time_interval, acceptable_ratio, start_time, end_time, data) :
+def good_time_windows(gti, time_interval, acceptable_ratio, start_time, end_time) :
 	"""
-	Function implementing the variability calculation using average technique.
+	Function cutting the observation into time windows and computing their good time ratio.
 	@param  gti:     G round, the list of TW cut-off the observation
 	@param  time_interval:   The duration of a time window
 	@param  acceptable_ratio:  The acceptability ratio for a TW - good time ratio
 	@param  start_time:  The t0 instant of the observation
 	@param  end_time: THe tf instant of the observation
-	@param  data:    E round, the list of events sorted by their TIME attribute
-	@return: The matrix V_round
+	@return: The start of the time windows, their good time ratio
 	"""
-
-	# Defining the variables and matrices
 	n_bins = int(np.ceil((end_time - start_time )/time_interval))
 	stop_time = start_time + n_bins*time_interval
 	if (stop_time - end_time)/time_interval > acceptable_ratio :
 		n_bins = n_bins - 1
 		stop_time = start_time + n_bins * time_interval
 
-	V_mat = np.ones([64,200])
-	counted_events = np.zeros([64,200,n_bins])
 	time_windows = np.arange(start_time, stop_time, time_interval)
 	projection_ratio = np.ones(n_bins)
 
@@ -66,8 +68,6 @@ def variability_computation(gti, time_interval, acceptable_ratio, start_time, en
 		if len(stop) != 0 :
 			cdt_stop.append(stop[0])
 
-	# Counting events
-	i = 0			# Data counts
 	n_last = None	# Last time window with a stop on it
 	for n in range(n_bins) :
 		# Good time
@@ -89,40 +89,430 @@ def variability_computation(gti, time_interval, acceptable_ratio, start_time, en
 		else :
 			projection_ratio[n] = 0
 
-		# Counting events
-		while i < len(data) and data[i]['TIME'] <= time_windows[n] + time_interval :
-			j = int(data[i]['RAWX'])-1
-			k = int(data[i]['RAWY'])-1
-			for x in range(j-1,j+2) :
-				for y in range(k-1,k+2) :
-					if 0<=x<64 and 0<=y<200 :
-						counted_events[x][y][n] += 1
-			i += 1
-		i += 1
-
-	# Correcting with projection ratio
+	return time_windows, projection_ratio
+
+
+def count_dtype(n_events) :
+	"""
+	Smallest signed integer type holding the counts of n_events events
+	summed over 3x3 pixels.
+	"""
+	for dtype in (np.int16, np.int32) :
+		if 9 * n_events <= np.iinfo(dtype).max :
+			return dtype
+	return np.int64
+
+
+def box_counts(data, window, n_windows, bands=None, dtype=None) :
+	"""
+	Function counting the events of each pixel, over its 3x3 neighbourhood,
+	in the time windows given for each event. The counts are accumulated
+	directly in the smallest integer type holding them, the peak memory being
+	two cubes of this type.
+	@param  data:    E round, the list of events
+	@param  window:  Time window of each event, out of 0..n_windows-1 if not counted
+	@param  n_windows: The number of time windows
+	@param  bands:   Edges of PI energy bands, see count_cube
+	@param  dtype:   Integer type of the counts, count_dtype(len(data)) if None
+	@return: The counts, of shape (1 + bands, 64, 200, n_windows)
+	"""
+	n_bands = len(bands) - 1 if bands != None else 0
+	n_planes = 1 + n_bands
+	dtype = count_dtype(len(data)) if dtype == None else dtype
+
+	# Time window, pixel and plane of each event
+	w = np.asarray(window, dtype=np.int64)
+	x = np.asarray(data['RAWX']).astype(np.int64) - 1
+	y = np.asarray(data['RAWY']).astype(np.int64) - 1
+	keep = (w >= 0) & (w < n_windows) & (x >= 0) & (x < 64) & (y >= 0) & (y < 200)
+	w, x, y = w[keep], x[keep], y[keep]
+	plane = np.zeros(len(w), dtype=np.int64)
+	if n_bands > 0 :
+		band = np.searchsorted(bands, np.asarray(data['PI'])[keep], side='right') - 1
+		band[np.asarray(data['PI'])[keep] == bands[-1]] = n_bands - 1
+		in_band = (band >= 0) & (band < n_bands)
+		w, x, y = np.concatenate((w, w[in_band])), np.concatenate((x, x[in_band])), np.concatenate((y, y[in_band]))
+		plane = np.concatenate((plane, 1 + band[in_band]))
+	size = n_planes * 64 * 200 * n_windows
+
+	# Few events: each one counted in its 3x3 pixels. Otherwise, the
+	# events are binned, and the 3x3 sums computed in place on the counts,
+	# along RAWX then RAWY
+	if 9 * len(w) < size :
+		index = np.concatenate([((plane * 64 + x + dx) * 200 + y + dy) * n_windows + w for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+		valid = np.concatenate([(x + dx >= 0) & (x + dx < 64) & (y + dy >= 0) & (y + dy < 200) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+		counts = np.zeros(size, dtype=dtype)
+		np.add.at(counts, index[valid], 1)
+		return counts.reshape(n_planes, 64, 200, n_windows)
+
+	counts = np.zeros(size, dtype=dtype)
+	np.add.at(counts, ((plane * 64 + x) * 200 + y) * n_windows + w, 1)
+	counts = counts.reshape(n_planes, 64, 200, n_windows)
+	del w, x, y, plane
+	rows = counts.copy()
+	rows[:, 1:] += counts[:, :-1]
+	rows[:, :-1] += counts[:, 1:]
+	counts[:] = rows
+	counts[:, :, 1:] += rows[:, :, :-1]
+	counts[:, :, :-1] += rows[:, :, 1:]
+
+	return counts
+
+
+def event_windows(times, time_windows, time_interval) :
+	"""
+	Function giving the time window of each event as the original loop over
+	the events did: the windows include their end, and the event following
+	the end of each window is not counted. The window n starts from the event
+	n + max(0, max(after[m] - m, m < n)), after[m] being the number of events
+	up to the end of the window m.
+	@param  times:   TIME of the events, sorted
+	@param  time_windows: The start of the time windows
+	@return: The window of each event, -1 if it is not counted
+	"""
+	n_bins = len(time_windows)
+	event  = np.arange(len(times))
+	after  = np.searchsorted(times, time_windows + time_interval, side='right')
+	offset = np.zeros(n_bins, dtype=np.int64)
+	offset[1:] = after[:-1] - np.arange(n_bins - 1)
+	first  = np.arange(n_bins) + np.maximum.accumulate(offset).clip(0) if n_bins else offset
+	window = np.searchsorted(after, event, side='right')
+	window[window >= n_bins] = -1
+	window[event < first[window]] = -1
+
+	return window
+
+
+def count_cube(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands=None, step=None) :
+	"""
+	Function counting the events of each pixel, over its 3x3 neighbourhood, in
+	the good time windows.
+	@param  gti:     G round, the list of TW cut-off the observation
+	@param  time_interval:   The duration of a time window
+	@param  acceptable_ratio:  The acceptability ratio for a TW - good time ratio
+	@param  start_time:  The t0 instant of the observation
+	@param  end_time: THe tf instant of the observation
+	@param  data:    E round, the list of events sorted by their TIME attribute
+	@param  bands:   Edges of PI energy bands, the counts of each band being
+	accumulated in the same pass over the events. The last edge is included
+	@param  step:    Step between the starts of overlapping time windows,
+	dividing time_interval. The windows follow each other if None
+	@return: The counts, of shape (1 + bands, 64, 200, good time windows) with
+	all the events then each band, and the projection ratio of the good time windows
+	"""
+
+	if step != None :
+		return sliding_count_cube(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands, step)
+
+	# Defining the variables and matrices
+	time_windows, projection_ratio = good_time_windows(gti, time_interval, acceptable_ratio, start_time, end_time)
+	n_bins = len(time_windows)
+
+	counted_events = box_counts(data, event_windows(data['TIME'], time_windows, time_interval), n_bins, bands)
+
+	# Keeping the good time windows
 	cdt = np.where(projection_ratio >= acceptable_ratio)[0]
-	counted_events = counted_events[:,:,cdt] / projection_ratio[cdt]
-	time_windows   = time_windows[cdt]
-
-	# Computing variability
-	if len(counted_events[0][0]) > 1 :
-		for i in range(len(counted_events)) :
-			for j in range(len(counted_events[i])) :
-				max = np.amax(counted_events[i][j])
-				min = np.amin(counted_events[i][j])
-				med = np.median(counted_events[i][j])
-				if med != 0 :
-					V_mat[i][j] = np.amax([(max - med),np.absolute(min - med)])/med
-				else :
-					V_mat[i][j] = max
-
-	elif len(counted_events[0][0]) == 1 :
+
+	return counted_events[...,cdt], projection_ratio[cdt]
+
+
+def variability_computation(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands=None, statistics=None, step=None, target=None) :
+	"""
+	Function implementing the variability calculation using average technique.
+	@param  gti:     G round, the list of TW cut-off the observation
+	@param  time_interval:   The duration of a time window
+	@param  acceptable_ratio:  The acceptability ratio for a TW - good time ratio
+	@param  start_time:  The t0 instant of the observation
+	@param  end_time: THe tf instant of the observation
+	@param  data:    E round, the list of events sorted by their TIME attribute
+	@param  bands:   Edges of PI energy bands, the counts of each band being
+	accumulated in the same pass over the events. The last edge is included
+	@param  statistics: Names of statistics of variability_statistics.STATISTICS
+	computed from the same counts, for all the events
+	@param  step:    Step between the starts of overlapping time windows,
+	dividing time_interval, e.g. half of it. The windows follow each other if None
+	@param  target:  Target number of counts per time window of the adaptive
+	mode, see adaptive_variability. The TW map is returned with the statistics
+	@return: The matrix V_round, or if bands are given an array of shape
+	(1 + bands, 64, 200) with V_round of all the events then of each band.
+	If statistics are given, a dictionary of their (64, 200) maps by name is
+	returned with it
+	"""
+
+	if target != None :
+		if step != None :
+			raise ValueError("The adaptive time windows follow each other, without step")
+		V_mat, maps = adaptive_variability(gti, time_interval, acceptable_ratio, start_time, end_time, data, target, bands, statistics)
+		return V_mat if bands != None else V_mat[0], maps
+
+	counted_events, projection_ratio = count_cube(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands, step)
+	V_mat = np.ones(counted_events.shape[:-1])
+
+	# Computing variability, with the counts corrected by the projection ratio
+	if counted_events.shape[-1] > 1 :
+		V_mat = max_deviation(counted_events, projection_ratio)
+
+	elif counted_events.shape[-1] == 1 :
 		print("No data within the GTI")
 
+	if bands == None :
+		V_mat = V_mat[0]
+	if statistics != None :
+		return V_mat, compute_statistics(statistics, counted_events[0], projection_ratio)
+
 	return V_mat
 
 
+########################################################################
+#                                                                      #
+# Prefix sums of the counts                                            #
+#                                                                      #
+########################################################################
+
+def prefix_counts(data, start_time, base, n_base, bands=None) :
+	"""
+	Function computing the cumulative counts of each pixel, over its 3x3
+	neighbourhood, on a grid of base time bins, so that the counts of any time
+	window made of base bins are the difference of two of them.
+	The counts of the base bins are accumulated in place, in the smallest
+	integer type holding the total counts, see box_counts.
+	@param  data:    E round, the list of events
+	@param  start_time:  The start of the first base bin
+	@param  base:    The duration of a base bin
+	@param  n_base:  The number of base bins
+	@param  bands:   Edges of PI energy bands, see count_cube
+	@return: The cumulative counts, of shape (1 + bands, 64, 200, n_base + 1),
+	the counts before each edge of the base bins
+	"""
+	# Base bin of each event, shifted by one so that the first edge counts nothing
+	b = np.floor((np.asarray(data['TIME']) - start_time) / base).astype(np.int64)
+	b[(b < 0) | (b >= n_base)] = -2
+	prefix = box_counts(data, b + 1, n_base + 1, bands)
+
+	return np.cumsum(prefix, axis=-1, out=prefix)
+
+
+def prefix_good_time(gti, start_time, base, n_base) :
+	"""
+	Function computing the cumulative good time on a grid of base time bins.
+	@param  gti:     G round, the list of TW cut-off the observation
+	@return: The good time before each edge of the base bins
+	"""
+	edges = start_time + base * np.arange(n_base + 1)
+	start = np.asarray(gti['START'], dtype=float)
+	stop  = np.asarray(gti['STOP'], dtype=float)
+
+	return np.sum(np.clip(edges[:, None] - start[None, :], 0, stop - start), axis=1)
+
+
+def sliding_count_cube(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands, step) :
+	"""
+	Function counting the events of each pixel in overlapping time windows of
+	duration time_interval starting every step, from the prefix sums on a grid
+	of base bins of duration step: the counts of a window are the difference
+	of two prefix sums, so that the overlapping windows cost about the same as
+	a single binning.
+	@param  step:    Step between the starts of the windows, dividing time_interval
+	@return: The counts and the projection ratio of the good time windows, see count_cube
+	"""
+	length = int(round(time_interval / step))
+	if length < 1 or not np.isclose(length * step, time_interval) :
+		raise ValueError("The step {0} s does not divide the time window {1} s".format(step, time_interval))
+
+	n_base = int(np.ceil((end_time - start_time) / step))
+	prefix = prefix_counts(data, start_time, step, n_base, bands)
+	good   = prefix_good_time(gti, start_time, step, n_base)
+
+	# Windows first..first+length of the base bins
+	first = np.arange(max(n_base - length + 1, 0))
+	projection_ratio = (good[first + length] - good[first]) / time_interval
+	first = first[projection_ratio >= acceptable_ratio]
+
+	counts = prefix[..., first + length]
+	counts -= prefix[..., first]
+
+	return counts, projection_ratio[projection_ratio >= acceptable_ratio]
+
+
+def adaptive_variability(gti, time_interval, acceptable_ratio, start_time, end_time, data, target, bands=None, statistics=None, levels=ADAPTIVE_LEVELS) :
+	"""
+	Function computing the variability with a time window chosen for each
+	pixel from its count rate: the shortest of time_interval * 2**k, k < levels,
+	with target counts on average, the longest one for the faint pixels.
+	All the windows are read from the prefix sums of a single binning at
+	time_interval, the pixels of each window length being computed together.
+	Every event is counted, as with the windows following each other of
+	sliding_count_cube, not dropping the event after each window as count_cube.
+	@param  time_interval:   The shortest time window, base of the prefix sums
+	@param  target:  Target number of counts per time window
+	@param  levels:  Number of window lengths
+	@return: The variability of shape (1 + bands, 64, 200), and a dictionary of
+	the maps of the statistics and of the chosen time window 'TW', see
+	variability_computation
+	"""
+	n_base = int(np.ceil((end_time - start_time) / time_interval))
+	prefix = prefix_counts(data, start_time, time_interval, n_base, bands)
+	good   = prefix_good_time(gti, start_time, time_interval, n_base)
+
+	# Window length of each pixel, in base bins
+	with np.errstate(divide='ignore') :
+		wanted = target / (prefix[0,:,:,-1] / max(good[-1], time_interval)) / time_interval
+	level  = np.clip(np.ceil(np.log2(np.clip(wanted, 1, None))), 0, levels - 1).astype(int)
+	level[prefix[0,:,:,-1] == 0] = levels - 1
+
+	V_mat = np.ones(prefix.shape[:-1])
+	maps  = {name : np.zeros((64,200)) for name in (statistics if statistics != None else [])}
+	for l in np.unique(level) :
+		pixels = np.where(level == l)
+		length = 2**l
+		first  = np.arange(0, n_base - length + 1, length)
+		projection_ratio = (good[first + length] - good[first]) / (length * time_interval)
+		first  = first[projection_ratio >= acceptable_ratio]
+		projection_ratio = projection_ratio[projection_ratio >= acceptable_ratio]
+		if len(first) < 2 :
+			continue
+
+		pixel_prefix = prefix[:, pixels[0], pixels[1]]
+		counts = (pixel_prefix[..., first + length] - pixel_prefix[..., first]).astype(float)
+		V_mat[:, pixels[0], pixels[1]] = max_deviation(counts, projection_ratio)
+		for name, stat in compute_statistics(maps.keys(), counts[0], projection_ratio).items() :
+			maps[name][pixels] = stat
+	maps['TW'] = time_interval * 2.0**level
+
+	return V_mat, maps
+
+
+########################################################################
+#                                                                      #
+# Incremental variability                                              #
+#                                                                      #
+########################################################################
+
+def event_checksum(data) :
+	"""
+	Checksum of events, telling whether the events already counted changed.
+	"""
+	return zlib.crc32(np.ascontiguousarray(data).view(np.uint8)) if len(data) else 0
+
+
+def update_counts(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands=None, state=None) :
+	"""
+	Function updating the counts of the time windows of a previous run with
+	the events appended after it: only the windows from the one holding the
+	last event counted are counted again. The windows and the counts are the
+	ones of count_cube, hence the same as a full run. All the windows are
+	counted again if the events of the previous run changed.
+	@param  state:   (counts of all the windows, time of the last event counted,
+	number and checksum of the events counted) of the previous run with the
+	same start_time, time_interval and bands, or None to count all the windows
+	@return: The new state
+	"""
+	time_windows, projection_ratio = good_time_windows(gti, time_interval, acceptable_ratio, start_time, end_time)
+	n_bins = len(time_windows)
+	times  = np.asarray(data['TIME'])
+	window = event_windows(times, time_windows, time_interval)
+	last_time = times[-1] if len(times) else start_time
+
+	if state != None :
+		old_counts, old_last, old_n, old_checksum = state
+		n_old = np.searchsorted(times, old_last, side='right')
+		if n_old != old_n or event_checksum(data[:n_old]) != old_checksum :
+			state = None
+	if state == None :
+		return box_counts(data, window, n_bins, bands, np.int32), last_time, len(data), event_checksum(data)
+
+	# Windows ending before the last event counted are complete
+	first  = int(min(np.searchsorted(time_windows + time_interval, old_last, side='left'), old_counts.shape[-1], n_bins))
+	counts = np.zeros(old_counts.shape[:-1] + (n_bins,), dtype=np.int32)
+	counts[..., :first] = old_counts[..., :first]
+	new = window >= first
+	counts[..., first:] = box_counts(data[new], window[new] - first, n_bins - first, bands, np.int32)
+
+	return counts, last_time, len(data), event_checksum(data)
+
+
+def incremental_variability(gti, time_interval, acceptable_ratio, start_time, end_time, bands, statistics, ccd) :
+	"""
+	Function computing the variability of a CCD from the updated counts of
+	its time windows, see update_counts, as variability_computation does.
+	@param  ccd:     (events of the CCD, state of the previous run or None)
+	@return: The variability, the maps of the statistics, see
+	variability_computation, and the new state
+	"""
+	data, state = ccd
+	state = update_counts(gti, time_interval, acceptable_ratio, start_time, end_time, data, bands, state)
+	time_windows, projection_ratio = good_time_windows(gti, time_interval, acceptable_ratio, start_time, end_time)
+
+	# Good time windows
+	cdt = projection_ratio >= acceptable_ratio
+	counted_events, projection_ratio = state[0][..., cdt], projection_ratio[cdt]
+
+	V_mat = np.ones(counted_events.shape[:-1])
+	if counted_events.shape[-1] > 1 :
+		V_mat = max_deviation(counted_events, projection_ratio)
+	maps = compute_statistics(statistics if statistics != None else [], counted_events[0], projection_ratio)
+
+	return V_mat if bands != None else V_mat[0], maps, state
+
+
+########################################################################
+#                                                                      #
+# Quick-look lightcurves                                               #
+#                                                                      #
+########################################################################
+
+def quick_look_lightcurves(data, areas, time_windows, projection_ratio, time_interval, acceptable_ratio) :
+	"""
+	Function summing the counts of the pixels of each detected area in the
+	time windows of variability_computation, corrected by their good time ratio.
+	An event is counted in the 3x3 pixels around it, the sums are divided by
+	9 to be close to the number of events of the area.
+	@param  data:    The events of each CCD, sorted by their TIME attribute
+	@param  areas:   list of (ccd, set of (x, y) pixels), as returned by source_areas
+	@param  time_windows, projection_ratio: as returned by good_time_windows
+	@return: array of shape (areas, time windows kept), start of the time windows kept
+	"""
+	cdt  = np.where(projection_ratio >= acceptable_ratio)[0]
+	ends = time_windows + time_interval
+	lightcurves = np.zeros((len(areas), len(cdt)))
+
+	for i, (ccd, area) in enumerate(areas) :
+		events = data[ccd]
+		if len(events) == 0 or len(cdt) == 0 :
+			continue
+		# Area on the CCD, with a margin of one pixel
+		mask = np.zeros([66,202])
+		x, y = np.array(sorted(area)).T
+		mask[x + 1, y + 1] = 1
+
+		# Number of pixels of the area among the 3x3 pixels around each event
+		j = np.asarray(events['RAWX'], dtype=int) - 1
+		k = np.asarray(events['RAWY'], dtype=int) - 1
+		on_ccd = (0 <= j) & (j < 64) & (0 <= k) & (k < 200)
+		j, k = np.where(on_ccd, j, 0), np.where(on_ccd, k, 0)
+		weights = sum(mask[j + 1 + dx, k + 1 + dy] for dx in (-1, 0, 1) for dy in (-1, 0, 1)) * on_ccd
+
+		n = np.searchsorted(ends, events['TIME'], side='left')
+		keep = (n < len(time_windows)) & (weights > 0)
+		counts = np.bincount(n[keep], weights=weights[keep], minlength=len(time_windows))
+		lightcurves[i] = counts[cdt] / projection_ratio[cdt] / 9
+
+	return lightcurves, time_windows[cdt]
+
+
+def flare_epochs(lightcurves) :
+	"""
+	Function finding the time window where each lightcurve is the furthest from its median.
+	@param lightcurves: array of shape (sources, time windows)
+	@return: index of the time window of each source
+	"""
+	if lightcurves.shape[1] == 0 :
+		return np.zeros(len(lightcurves), dtype=int)
+	med = np.median(lightcurves, axis=1, keepdims=True)
+
+	return np.argmax(np.abs(lightcurves - med), axis=1)
+
+
 ########################################################################
 #                                                                      #
 # Detecting variable areas                                             #
@@ -222,19 +612,13 @@ def variable_areas_detection(lower_limit, box_size, detection_level, variability
 
 	return output
 
-def variable_sources_position(variable_areas_matrix, obs, path_out, reg_file, log_file, img_file) :
+def _source_areas(variable_areas_matrix) :
 	"""
-	Function computing the position of the detected varable sources.
-	@param variable_areas_matrix: variable_areas_detection output
-	@param obs: EPIC-pn OBSID. It will be written in the output file
-	@file_out: region file where the sources will be written
-	@return: astropy.table.Table object containing the source parameters
+	Function computing the center and radius of the detected areas, the ones
+	centered on bad pixels excluded.
+	@return: list of (ccd, area, center_x, center_y, r), ccd starting from 0
 	"""
-
-	sources = []
-	cpt_source = 0
-
-	# Computing source position
+	areas = []
 	for ccd in range(12) :
 	    for source in variable_areas_matrix[ccd] :
 	        center_x = round(sum([p[0] for p in source]) / len(source), 2)
@@ -244,9 +628,32 @@ def variable_sources_position(variable_areas_matrix, obs, path_out, reg_file, lo
 
 	        # Avoiding bad pixels
 	        if [ccd, int(center_x)] not in [[4,11], [4,12], [4,13], [5,12], [10,28]] :
-	            cpt_source += 1
-	            sources.append([cpt_source, ccd+1, center_x, center_y, r])
+	            areas.append((ccd, source, center_x, center_y, r))
+
+	return areas
+
+
+def source_areas(variable_areas_matrix) :
+	"""
+	Function returning the pixels of the detected sources, in the order of
+	the table of variable_sources_position.
+	@return: list of (ccd, set of (x, y) pixels), ccd starting from 0
+	"""
+	return [(ccd, area) for ccd, area, center_x, center_y, r in _source_areas(variable_areas_matrix)]
+
+
+def variable_sources_position(variable_areas_matrix, obs, path_out, reg_file, log_file, img_file) :
+	"""
+	Function computing the position of the detected varable sources.
+	@param variable_areas_matrix: variable_areas_detection output
+	@param obs: EPIC-pn OBSID. It will be written in the output file
+	@file_out: region file where the sources will be written
+	@return: astropy.table.Table object containing the source parameters
+	"""
+
+	from astropy.table import Table
 
+	sources = [[i + 1, ccd + 1, center_x, center_y, r] for i, (ccd, area, center_x, center_y, r) in enumerate(_source_areas(variable_areas_matrix))]
 
 	# Making output table
 	source_table = Table(names=('ID', 'CCDNR', 'RAWX', 'RAWY', 'RAWR', 'X', 'Y', 'SKYR', 'RA', 'DEC', 'R'), dtype=('i2', 'i2', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8'))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Watch-folder service                                                 #
+#                                                                      #
+########################################################################
+"""
+Long-running service processing the observations as they land in the data
+folder. The folder is polled for new complete observations (raw events,
+FBKTSR and SUM.ASC files, whose sizes did not change since the previous
+poll), whose filtering, detection and lightcurve tasks are added to a
+scheduler running all along: its worker processes, and the detectors they
+keep warm, are reused from one observation to the next. A status file gives
+the queue depth, the throughput and the time from arrival to results.
+
+    watcher.py -f FOLDER -status FOLDER/exod_status.json
+"""
+
+# Built-in imports
+
+import sys
+import os
+import glob
+import json
+import time
+import signal
+import argparse
+
+# Internal imports
+
+import manifest as Manifest
+import resources as Resources
+from scheduler import Scheduler, PENDING, RUNNING, FAILED, SKIPPED
+from pipeline import STAGES, observation_tasks, balance_tasks, params_name, parse_params, init_lightcurve_logs
+from downloader import is_downloaded
+
+# Time between two polls of the data folder, in seconds
+POLL_INTERVAL = 30.0
+
+# Number of processed observations listed in the status file
+STATUS_HISTORY = 20
+
+########################################################################
+#                                                                      #
+# Watcher                                                              #
+#                                                                      #
+########################################################################
+
+class Watcher(object):
+    """
+    Source of tasks of the scheduler, see Scheduler.run: the tasks of the
+    observations landing in the data folder.\n
+
+    Attributes:\n
+    folder:    Folder containing the observations\n
+    known:     Observations already queued or skipped\n
+    initial:   Observations already in the folder at start-up\n
+    sizes:     Sizes of the files of the incomplete observations at the last poll\n
+    queued:    Arrival time of the observations being processed\n
+    processed: (observation, arrival, end, failed) of the processed observations\n
+    stopping:  The service stops once the queued observations are processed
+    """
+
+    def __init__(self, folder, params, stages=STAGES, mta=None, cpus=12, retries=1, padding=None,
+                 status_file=None, backlog=False, once=False, triage=False):
+        """
+        Constructor for Watcher class.
+        @param folder, params, stages, retries, padding, triage: see pipeline.observation_tasks
+        @param mta: Number of CPUs of each detection, chosen from the size of the observation if None
+        @param cpus: Number of CPUs of the scheduler
+        @param status_file: JSON file where the status is written at each poll
+        @param backlog: Processing the observations already in the folder at
+        start-up even if their detections are there
+        @param once: Stopping once the observations of the first poll are processed
+        """
+        super(Watcher, self).__init__()
+
+        self.folder   = os.path.abspath(folder)
+        self.params   = params
+        self.stages   = stages
+        self.mta      = mta
+        self.cpus     = cpus
+        self.retries  = retries
+        self.padding  = padding
+        self.triage   = triage
+        self.status_file = status_file
+        self.backlog  = backlog
+        self.once     = once
+        self.stopping = False
+        self.known    = set()
+        self.initial  = set()
+        self.sizes    = {}
+        self.queued   = {}
+        self.processed = []
+        self.t_start  = time.time()
+        self.first    = True
+
+    def _processed_before(self, obs) :
+        """
+        Checking whether the detections of an observation are already there.
+        """
+        return all(os.path.isfile(Manifest.manifest_file(os.path.join(self.folder, obs, params_name(*p)), 'detection')) for p in self.params)
+
+    def _arrivals(self) :
+        """
+        New observations whose files are complete and did not change since the
+        previous poll, the ones already there at start-up included: only their
+        detections already being there tells them apart.
+        @return: list of observation identifiers
+        """
+        arrivals = []
+        for path in sorted(glob.glob(os.path.join(self.folder, '0*'))) :
+            obs = os.path.basename(path)
+            if obs in self.known or not os.path.isdir(path) or not is_downloaded(path, obs) :
+                continue
+            sizes = sorted((f, os.path.getsize(f)) for f in glob.glob(os.path.join(path, '*')) if os.path.isfile(f))
+            if self.first :
+                self.initial.add(obs)
+            if self.sizes.get(obs) != sizes :
+                # Still being copied, or seen for the first time
+                self.sizes[obs] = sizes
+                continue
+            self.sizes.pop(obs, None)
+            self.known.add(obs)
+            if obs in self.initial and not self.backlog and self._processed_before(obs) :
+                continue
+            arrivals.append(obs)
+
+        return arrivals
+
+    def _collect(self, scheduler) :
+        """
+        Recording the observations whose tasks are all finished, and removing
+        their tasks from the graph so that it does not grow with time.
+        """
+        for obs, arrival in list(self.queued.items()) :
+            names = [name for name in scheduler.tasks if name.split(' ')[0] == obs]
+            states = [scheduler.tasks[name].state for name in names]
+            if any(s in (PENDING, RUNNING) for s in states) :
+                continue
+            failed = any(s in (FAILED, SKIPPED) for s in states)
+            self.processed.append((obs, arrival, time.time(), failed))
+            del self.queued[obs]
+            for name in names :
+                if name in scheduler.tasks :
+                    scheduler.remove(name)
+            print(" {0} {1} {2} in {3:.0f} s".format(time.strftime("%H:%M:%S"), obs, "FAILED" if failed else "processed", time.time() - arrival))
+
+    def write_status(self, scheduler) :
+        """
+        Writing the status file, replaced atomically.
+        """
+        if self.status_file == None :
+            return
+
+        states  = [task.state for task in scheduler.tasks.values()]
+        hour    = [p for p in self.processed if p[2] > time.time() - 3600]
+        elapsed = min(time.time() - self.t_start, 3600)
+        latency = [p[2] - p[1] for p in self.processed[-STATUS_HISTORY:]]
+        status  = {
+                   'updated'          : time.strftime("%Y-%m-%d %H:%M:%S"),
+                   'running_since'    : time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.t_start)),
+                   'queue_depth'      : len(self.queued),
+                   'queued'           : sorted(self.queued),
+                   'tasks'            : {s : states.count(s) for s in (PENDING, RUNNING)},
+                   'processed'        : len(self.processed),
+                   'failed'           : sum(1 for p in self.processed if p[3]),
+                   'throughput_per_hour' : len(hour) * 3600 / max(elapsed, 1.0),
+                   'mean_latency_s'   : sum(latency) / len(latency) if latency else None,
+                   'last'             : [{'obs' : obs, 'arrival' : time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(arrival)),
+                                          'latency_s' : round(end - arrival, 1), 'failed' : failed}
+                                         for obs, arrival, end, failed in self.processed[-STATUS_HISTORY:]],
+                   'stopping'         : self.stopping
+                  }
+        tmp = self.status_file + '.tmp'
+        with open(tmp, 'w') as f :
+            json.dump(status, f, indent=1)
+        os.replace(tmp, self.status_file)
+
+    def __call__(self, scheduler) :
+        """
+        Polling the data folder.
+        @return: list of the tasks of the new observations, None to stop
+        """
+        self._collect(scheduler)
+        tasks = []
+        if not self.stopping :
+            for obs in self._arrivals() :
+                print(" {0} {1} queued".format(time.strftime("%H:%M:%S"), obs))
+                obs_tasks = observation_tasks(self.folder, obs, self.params, self.mta or 1, self.retries, self.stages, False, self.padding, self.triage)
+                if self.mta == None :
+                    balance_tasks(obs_tasks, self.cpus)
+                self.queued[obs] = time.time()
+                tasks += obs_tasks
+            # The observations of the first poll are queued once their files are stable
+            if self.once and self.initial <= self.known :
+                self.stopping = True
+        self.first = False
+        self.write_status(scheduler)
+
+        # Stopping once the queued observations are processed
+        if self.stopping and not tasks and not self.queued :
+            return None
+
+        return tasks
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--folder", dest="folder", help="Folder where the observations land", type=str)
+    parser.add_argument("-dl", "--detection-level", dest="dl", help="Detection level.\nDefault: 8", default=8, type=float)
+    parser.add_argument("-tw", "--time-window", dest="tw", help="Time window.\nDefault: 100", default=100, type=float)
+    parser.add_argument("-gtr", "--good-time-ratio", dest="gtr", help="Good time ratio.\nDefault: 1.0", default=1.0, type=float)
+    parser.add_argument("-bs", "--box-size", dest="bs", help="Box size.\nDefault: 3", default=3, type=int)
+    parser.add_argument("-params", dest="params", help="Several sets of detection parameters DL_TW_GTR_BS, replacing -dl -tw -gtr -bs", nargs='*', default=None, type=str)
+    parser.add_argument("-cpus", "--cpus", dest="cpus", help="Number of tasks run in parallel.\nDefault: 12", default=12, type=int)
+    parser.add_argument("-mta", "--max-threads-allowed", dest="mta", help="Number of CPUs used by each detection.\nDefault: chosen from the size of the observations", default=None, type=int)
+    parser.add_argument("-mem", "--memory", dest="mem", help="Memory budget in GB.\nDefault: 80%% of the physical memory", default=None, type=float)
+    parser.add_argument("-retries", dest="retries", help="Number of times a failed task is run again.\nDefault: 1", default=1, type=int)
+    parser.add_argument("-stages", dest="stages", help="Stages to run.\nDefault: all the stages", nargs='*', default=STAGES, choices=STAGES, type=str)
+    parser.add_argument("--no-lc", dest="lc", help="Skip the lightcurve generation", action='store_false')
+    parser.add_argument("-padding", dest="padding", help="Time in seconds around the flare window covered by the lightcurves binned at the frame time.\nDefault: full exposure", default=None, type=float)
+    parser.add_argument("-triage", "--triage", dest="triage", help="Score the CCDs once per observation, the detections only computing the CCDs that may hold a flare, see triage.py", action='store_true')
+    parser.add_argument("-interval", dest="interval", help="Time between two polls of the folder, in seconds.\nDefault: {0:g}".format(POLL_INTERVAL), default=POLL_INTERVAL, type=float)
+    parser.add_argument("-status", dest="status", help="JSON status file.\nDefault: FOLDER/exod_status.json", default=None, type=str)
+    parser.add_argument("--backlog", help="Process the observations already in the folder, even if their detections are there", action='store_true')
+    parser.add_argument("--once", help="Stop once the observations already in the folder are processed", action='store_true')
+    args = parser.parse_args()
+
+    folder = os.path.abspath(args.folder)
+    params = parse_params(args.dl, args.tw, args.gtr, args.bs, args.params)
+    stages = [s for s in args.stages if s != 'lightcurve' or args.lc]
+    if 'lightcurve' in stages :
+        init_lightcurve_logs(folder, params)
+
+    watcher = Watcher(folder, params, stages, args.mta, args.cpus, args.retries, args.padding,
+                      args.status or os.path.join(folder, 'exod_status.json'), args.backlog, args.once, args.triage)
+
+    # SIGTERM and SIGINT stop the service once the queued observations are processed
+    def stop(signum, frame) :
+        print(" Stopping once the {0} queued observations are processed".format(len(watcher.queued)))
+        watcher.stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    memory = args.mem * 1e9 if args.mem != None else Resources.available_memory()
+    scheduler = Scheduler(processes=args.cpus, memory=memory)
+    scheduler.run(source=watcher, interval=args.interval)
+    watcher.write_status(scheduler)
+
+    sys.exit(1 if any(p[3] for p in watcher.processed) else 0)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+########################################################################
+#                                                                      #
+# EXOD - EPIC-pn XMM-Newton Outburst Detector                          #
+#                                                                      #
+# Work queue shared by several hosts                                   #
+#                                                                      #
+########################################################################
+"""
+Work queue of pipeline tasks stored in a SQLite file on a shared filesystem.
+Any number of workers, on any number of hosts, pull the tasks whose
+dependencies are done. A worker holds a lease on its task and renews it
+while the task runs. The task of a worker that died is given back to the
+queue once its lease expires. Scaling out only means starting more workers:
+
+    pipeline.py -f FOLDER -queue queue.db ...     (submitting the tasks)
+    work_queue.py -queue queue.db                 (on each host, as many times as wanted)
+
+The rollback journal of SQLite is used rather than WAL, which needs shared
+memory and does not work on network filesystems.
+"""
+
+# Built-in imports
+
+import sys
+import os
+import time
+import json
+import socket
+import sqlite3
+import importlib
+import threading
+import argparse
+
+# Internal imports
+
+from scheduler import Task, priorities, _run_task, PENDING, RUNNING, DONE, FAILED, SKIPPED
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name        TEXT PRIMARY KEY,
+    module      TEXT NOT NULL,
+    fct         TEXT NOT NULL,
+    args        TEXT NOT NULL,
+    kwargs      TEXT NOT NULL,
+    inputs      TEXT NOT NULL,
+    retries     INTEGER NOT NULL,
+    priority    REAL NOT NULL,
+    state       TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    started     REAL,
+    duration    REAL,
+    result      TEXT
+);
+CREATE TABLE IF NOT EXISTS deps (
+    job TEXT NOT NULL,
+    dep TEXT NOT NULL,
+    PRIMARY KEY (job, dep)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority);
+"""
+
+########################################################################
+#                                                                      #
+# Queue                                                                #
+#                                                                      #
+########################################################################
+
+def _module_name(fct) :
+    """
+    Name of the module defining a function, importable by the workers.
+    """
+    module = fct.__module__
+    if module == '__main__' :
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+
+    return module
+
+
+class WorkQueue(object):
+    """
+    Queue of tasks stored in a SQLite database.
+    """
+
+    def __init__(self, file, lease=600.0):
+        """
+        Constructor for WorkQueue class.
+        @param file: SQLite database, created if needed
+        @param lease: Time in seconds after which the task of a silent worker is given back
+        """
+        super(WorkQueue, self).__init__()
+
+        self.file  = file
+        self.lease = lease
+        self.db    = sqlite3.connect(file, timeout=600, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def close(self) :
+        self.db.close()
+
+    def _transaction(self) :
+        """
+        Starting a transaction holding the write lock of the database.
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def submit(self, tasks) :
+        """
+        Adding tasks to the queue. Tasks already in the queue are left unchanged,
+        so that a batch can be submitted again after an interruption.
+        @param tasks: list of Task, their functions defined at module level
+        @return: number of tasks added
+        """
+        self._transaction()
+        try :
+            added = self._insert(tasks)
+            self.db.execute("COMMIT")
+        except :
+            self.db.execute("ROLLBACK")
+            raise
+
+        return added
+
+    def _insert(self, tasks) :
+        """
+        Inserting tasks within the current transaction, see submit.
+        """
+        ranks = priorities(tasks)
+        added = 0
+        for task in tasks :
+            cursor = self.db.execute("INSERT OR IGNORE INTO jobs (name, module, fct, args, kwargs, inputs, retries, priority, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (task.name, _module_name(task.fct), task.fct.__name__, json.dumps(task.args), json.dumps(task.kwargs),
+                                      json.dumps(task.inputs), task.retries, ranks[task.name], PENDING))
+            if cursor.rowcount :
+                added += 1
+                self.db.executemany("INSERT OR IGNORE INTO deps (job, dep) VALUES (?, ?)", [(task.name, d) for d in task.deps])
+
+        return added
+
+    def _requeue_expired(self, now) :
+        """
+        Giving back the tasks whose lease expired, their worker being dead.
+        """
+        expired = self.db.execute("SELECT name, attempts, retries, worker FROM jobs WHERE state = ? AND lease_until < ?", (RUNNING, now)).fetchall()
+        for name, attempts, retries, worker in expired :
+            state = PENDING if attempts <= retries else FAILED
+            self.db.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, result = ? WHERE name = ?",
+                            (state, "Lease of worker {0} expired".format(worker), name))
+
+    def _skip_failed(self) :
+        """
+        Skipping the pending tasks depending on a failed or skipped task.
+        """
+        changed = True
+        while changed :
+            changed = self.db.execute("""UPDATE jobs SET state = ?, result = 'Dependency failed' WHERE state = ? AND EXISTS
+                                         (SELECT 1 FROM deps d LEFT JOIN jobs p ON p.name = d.dep
+                                          WHERE d.job = jobs.name AND (p.state IS NULL OR p.state IN (?, ?)))""",
+                                      (SKIPPED, PENDING, FAILED, SKIPPED)).rowcount > 0
+
+    def claim(self, worker) :
+        """
+        Taking the ready task of highest priority.
+        @param worker: Identifier of the worker
+        @return: Task, None if no task is ready
+        """
+        now = time.time()
+        self._transaction()
+        try :
+            self._requeue_expired(now)
+            self._skip_failed()
+            row = self.db.execute("""SELECT name, module, fct, args, kwargs, inputs, retries, attempts FROM jobs WHERE state = ? AND NOT EXISTS
+                                     (SELECT 1 FROM deps d JOIN jobs p ON p.name = d.dep WHERE d.job = jobs.name AND p.state != ?)
+                                     ORDER BY priority DESC LIMIT 1""", (PENDING, DONE)).fetchone()
+            if row != None :
+                self.db.execute("UPDATE jobs SET state = ?, worker = ?, lease_until = ?, started = ?, attempts = attempts + 1 WHERE name = ?",
+                                (RUNNING, worker, now + self.lease, now, row[0]))
+            self.db.execute("COMMIT")
+        except :
+            self.db.execute("ROLLBACK")
+            raise
+
+        if row == None :
+            return None
+
+        name, module, fct, args, kwargs, inputs, retries, attempts = row
+        task = Task(name, getattr(importlib.import_module(module), fct), json.loads(args), json.loads(kwargs),
+                    inputs=json.loads(inputs), retries=retries)
+        task.state    = RUNNING
+        task.attempts = attempts + 1
+        task.started  = now
+
+        return task
+
+    def heartbeat(self, task, worker) :
+        """
+        Renewing the lease of a running task.
+        @return: False if the task is no longer held by the worker
+        """
+        cursor = self.db.execute("UPDATE jobs SET lease_until = ? WHERE name = ? AND worker = ? AND state = ?",
+                                 (time.time() + self.lease, task.name, worker, RUNNING))
+
+        return cursor.rowcount > 0
+
+    def complete(self, task, worker, ok, result) :
+        """
+        Recording the outcome of a task. A failed task is given back to the
+        queue while it has retries left; the tasks it returned are added in
+        the same transaction, so that they are not lost if the worker dies.
+        @return: new state of the task, None if the task was no longer held by the worker
+        """
+        children = []
+        if ok and isinstance(result, (list, tuple)) and all(isinstance(t, Task) for t in result) :
+            children = list(result)
+            for child in children :
+                if task.name not in child.deps :
+                    child.deps.append(task.name)
+            result = "{0} tasks added".format(len(children))
+        if ok :
+            state = DONE
+        else :
+            state = PENDING if task.attempts <= task.retries else FAILED
+
+        self._transaction()
+        try :
+            cursor = self.db.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, duration = ?, result = ? WHERE name = ? AND worker = ? AND state = ?",
+                                     (state, time.time() - task.started, str(result), task.name, worker, RUNNING))
+            held = cursor.rowcount > 0
+            if held :
+                self._insert(children)
+            self.db.execute("COMMIT")
+        except :
+            self.db.execute("ROLLBACK")
+            raise
+
+        return state if held else None
+
+    def counts(self) :
+        """
+        @return: dictionary state -> number of tasks
+        """
+        counts = {s : 0 for s in (PENDING, RUNNING, DONE, FAILED, SKIPPED)}
+        for state, n in self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state") :
+            counts[state] = n
+
+        return counts
+
+    def failures(self) :
+        """
+        @return: list of (name, result) of the failed tasks
+        """
+        return self.db.execute("SELECT name, result FROM jobs WHERE state = ? ORDER BY name", (FAILED,)).fetchall()
+
+########################################################################
+#                                                                      #
+# Worker                                                               #
+#                                                                      #
+########################################################################
+
+def worker_name() :
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+
+def run_worker(file, lease=600.0, poll=10.0, log=sys.stdout) :
+    """
+    Running the tasks of a queue one after the other, until no task is
+    pending or running any more.
+    @param file: SQLite database of the queue
+    @param lease: Time in seconds after which the task of a silent worker is given back
+    @param poll: Time in seconds between two claims when no task is ready
+    @param log: File where the progress is written, None for silence
+    @return: number of tasks run
+    """
+    queue  = WorkQueue(file, lease)
+    worker = worker_name()
+    n_run  = 0
+
+    def message(text) :
+        if log != None :
+            print(" {0} {1} {2}".format(time.strftime("%H:%M:%S"), worker, text), file=log)
+            log.flush()
+
+    try :
+        while True :
+            task = queue.claim(worker)
+            if task == None :
+                counts = queue.counts()
+                if counts[PENDING] + counts[RUNNING] == 0 :
+                    break
+                time.sleep(poll)
+                continue
+
+            message("START    {0}".format(task.name))
+
+            # The lease is renewed from another connection while the task runs
+            stop = threading.Event()
+            def beat() :
+                beat_queue = WorkQueue(file, lease)
+                while not stop.wait(lease / 3) :
+                    if not beat_queue.heartbeat(task, worker) :
+                        message("LOST     {0}".format(task.name))
+                beat_queue.close()
+            thread = threading.Thread(target=beat, daemon=True)
+            thread.start()
+
+            missing = [f for f in task.inputs if not os.path.exists(f)]
+            if missing :
+                ok, result = False, "Missing inputs: {0}".format(", ".join(missing))
+            else :
+                ok, result = _run_task(task.fct, task.args, task.kwargs)
+
+            stop.set()
+            thread.join()
+            state = queue.complete(task, worker, ok, result)
+            n_run += 1
+            if state == DONE :
+                message("DONE     {0} ({1:.1f} s)".format(task.name, time.time() - task.started))
+            elif state == None :
+                message("LOST     {0}, completed by another worker".format(task.name))
+            else :
+                message("{0:<8} {1}\n{2}".format(state.upper() if state == FAILED else "RETRY", task.name, result))
+    finally :
+        queue.close()
+
+    return n_run
+
+########################################################################
+#                                                                      #
+# Main programme                                                       #
+#                                                                      #
+########################################################################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-queue", dest="queue", help="SQLite database of the queue", type=str)
+    parser.add_argument("-lease", dest="lease", help="Time in seconds after which the task of a silent worker is given back.\nDefault: 600", default=600.0, type=float)
+    parser.add_argument("-poll", dest="poll", help="Time in seconds between two claims when no task is ready.\nDefault: 10", default=10.0, type=float)
+    parser.add_argument("--status", help="Printing the state of the queue instead of running a worker", action='store_true')
+    args = parser.parse_args()
+
+    if args.status :
+        queue = WorkQueue(args.queue, args.lease)
+        print(" " + ", ".join("{0} {1}".format(n, s) for s, n in queue.counts().items()))
+        for name, result in queue.failures() :
+            print(" FAILED   {0}\n{1}".format(name, result))
+        queue.close()
+        sys.exit(0)
+
+    run_worker(args.queue, args.lease, args.poll)
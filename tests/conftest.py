@@ -0,0 +1,10 @@
+# coding=utf-8
+"""
+The EXOD scripts are run from the scripts folder and import each other by
+their module name.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
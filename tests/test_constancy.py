@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+Probabilities of constancy of the lightcurves, see scripts/constancy.py.
+"""
+
+import math
+
+import numpy as np
+import pytest
+from scipy.stats import kstwo
+
+from constancy import constancy, good_bins
+from test_variability_utils import gti, T0
+
+BIN = 10.0
+
+
+def test_hand_computed() :
+    # Rates 1, 3, 1, 3 with unit errors: chi-square 4 with 3 degrees of freedom
+    p_chisq, p_ks = constancy([np.array([1.0, 3.0, 1.0, 3.0])], [np.ones(4)], T0, BIN, gti((0, 40)))
+    assert p_chisq[0] == pytest.approx(math.erfc(math.sqrt(2.0)) + math.sqrt(8.0 / math.pi) * math.exp(-2.0))
+    # 80 counts, cumulated 1/8, 1/2, 5/8, 1 against 1/4, 1/2, 3/4, 1: the largest distance is 1/4
+    assert p_ks[0] == pytest.approx(kstwo.sf(0.25, 80))
+
+
+def test_constant_and_variable() :
+    rng = np.random.default_rng(0)
+    counts = np.array([rng.poisson(20, 200), rng.poisson(np.where(np.arange(200) // 20 == 5, 60, 20))], dtype=float)
+    rates, errors = counts / BIN, np.sqrt(counts) / BIN
+    p_chisq, p_ks = constancy(rates, errors, T0, BIN, gti((0, 2000)))
+    assert p_chisq[0] > 1e-3 and p_ks[0] > 1e-3
+    assert p_chisq[1] < 1e-10 and p_ks[1] < 1e-10
+
+    # A flat rate: no deviation from the mean, cumulated counts on the cumulated time
+    p_chisq, p_ks = constancy([np.full(200, 2.0)], [np.full(200, 0.5)], T0, BIN, gti((0, 2000)))
+    assert p_chisq[0] == 1.0 and p_ks[0] == pytest.approx(kstwo.sf(1.0 / 200, 4000))
+
+    # Same probabilities for lightcurves processed by blocks
+    p_blocks = constancy(list(rates) * 5, list(errors) * 5, T0, BIN, gti((0, 2000)), chunk=450)
+    assert np.allclose(p_blocks, np.tile(constancy(rates, errors, T0, BIN, gti((0, 2000))), 5))
+
+
+def test_gti_cut_bins() :
+    rng = np.random.default_rng(1)
+    counts = rng.poisson(20, 100).astype(float)
+    rates, errors = counts / BIN, np.sqrt(counts) / BIN
+    # A flare in the bins out of the GTI, one of them partly covered
+    g = gti((0, 405), (600, 1000))
+    assert np.array_equal(np.flatnonzero(~good_bins(T0, 100, BIN, g)), np.arange(40, 60))
+    flared = rates.copy()
+    flared[40:60] *= 10
+
+    good = np.r_[0:40, 60:100]
+    expected = constancy([rates[good]], [errors[good]], T0, BIN, gti((0, 800)))
+    assert np.allclose(constancy([flared], [errors], T0, BIN, g), expected)
+
+
+def test_empty_lightcurves() :
+    assert [len(p) for p in constancy([], [], T0, BIN, gti((0, 100)))] == [0, 0]
+
+    # No bin within the GTI, no count at all, a single bin: the tests are not defined
+    p_chisq, p_ks = constancy([np.ones(10)], [np.ones(10)], T0, BIN, gti((500, 600)))
+    assert p_chisq[0] == 1.0 and p_ks[0] == 1.0
+    p_chisq, p_ks = constancy([np.zeros(10)], [np.zeros(10)], T0, BIN, gti((0, 100)))
+    assert p_chisq[0] == 1.0 and p_ks[0] == 1.0
+    p_chisq, p_ks = constancy([np.full(10, np.nan)], [np.full(10, np.nan)], T0, BIN, gti((0, 100)))
+    assert p_chisq[0] == 1.0 and p_ks[0] == 1.0
+    assert constancy([np.ones(1)], [np.ones(1)], T0, BIN, gti((0, 10)))[0][0] == 1.0
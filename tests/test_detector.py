@@ -0,0 +1,54 @@
+# coding=utf-8
+"""
+State of the incremental detection, see scripts/detector.py.
+"""
+
+import os
+from functools import partial
+
+import numpy as np
+
+import file_names as FileNames
+from detector import read_state, write_state, _incremental_ccd
+from variability_utils import update_counts, incremental_variability, variability_computation
+from test_variability_utils import events, gti, T0
+
+# Largest size of the state file of a CCD per event counted, in bytes: an
+# index and a count of 4 bytes each for the 3x3 pixels of the event, in all
+# the events and in its band
+MAX_STATE_BYTES_PER_EVENT = 2 * 9 * 8
+
+
+def test_state_round_trip(tmp_path) :
+    data  = events(3000, 5000.0, flare=(30, 150, 3000.0, 3200.0, 40))
+    state = update_counts(gti((0, 5000)), 10.0, 1.0, T0, T0 + 5000.0, data, [500, 2000, 12000])
+    state_file = str(tmp_path / FileNames.STATE.format(3))
+    write_state(state_file, 10.0, [500, 2000, 12000], T0, state)
+
+    counts, last, n_events, checksum = read_state(state_file, 10.0, [500, 2000, 12000], T0)
+    assert np.array_equal(counts, state[0]) and counts.dtype == np.int32
+    assert (last, n_events, checksum) == state[1:]
+
+    # The file grows with the events, not with the 3 x 64 x 200 x 500 counts
+    assert os.path.getsize(state_file) < MAX_STATE_BYTES_PER_EVENT * len(data) < state[0].nbytes / 100
+
+    # Not used with other parameters
+    assert read_state(state_file, 20.0, [500, 2000, 12000], T0) == None
+    assert read_state(state_file, 10.0, None, T0) == None
+    assert read_state(state_file, 10.0, [500, 2000, 12000], T0 + 1) == None
+    assert read_state(str(tmp_path / FileNames.STATE.format(4)), 10.0, None, T0) == None
+
+
+def test_incremental_ccd_as_full(tmp_path) :
+    data = events(6000, 5000.0, flare=(30, 150, 3000.0, 3200.0, 40))
+    g, part = gti((0, 5000)), data[:4000]
+    state_file = str(tmp_path / FileNames.STATE)
+    variability = partial(incremental_variability, g, 100.0, 1.0, T0, T0 + 5000.0, None, ['CHISQ'])
+
+    # A first run on the events of the first part, then on all of them
+    _incremental_ccd(variability, state_file, 100.0, None, T0, (part, 7))
+    assert os.path.isfile(state_file.format(7))
+    V, maps = _incremental_ccd(variability, state_file, 100.0, None, T0, (data, 7))
+    V_full, maps_full = variability_computation(g, 100.0, 1.0, T0, T0 + 5000.0, data, None, ['CHISQ'])
+    assert np.array_equal(V, V_full) and np.array_equal(maps['CHISQ'], maps_full['CHISQ'])
+    assert read_state(state_file.format(7), 100.0, None, T0)[2] == len(data)
@@ -0,0 +1,190 @@
+# coding=utf-8
+"""
+Downloads from a local HTTP server, see scripts/downloader.py.
+"""
+
+import io
+import os
+import gzip
+import tarfile
+import threading
+import http.server
+
+import pytest
+
+import downloader
+from downloader import download_file, download_observation, observation_files, prefetch, SUMMARY
+
+########################################################################
+# Local archive
+
+class Handler(http.server.BaseHTTPRequestHandler) :
+    """
+    Serving server.files by path, with byte ranges unless server.ranges is False.
+    """
+    def do_GET(self) :
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        data = self.server.files.get(self.path)
+        if data == None :
+            self.send_error(404)
+            return
+        start = 0
+        if self.server.ranges and self.headers.get('Range') :
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start >= len(data) :
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(data) - 1, len(data)))
+        else :
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args) :
+        pass
+
+
+@pytest.fixture
+def server() :
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.files, server.ranges, server.requests = {}, True, []
+    server.url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _gzip(size=200000) :
+    return gzip.compress(os.urandom(size))
+
+
+def _tar(members) :
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar :
+        for name, data in members.items() :
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+########################################################################
+
+def test_resume(server, tmp_path) :
+    data = _gzip()
+    server.files['/a.FTZ'] = data
+    file = str(tmp_path / 'a.FTZ')
+    with open(file + '.part', 'wb') as f :
+        f.write(data[:50000])
+
+    assert download_file(server.url + '/a.FTZ', file, retries=0) == file
+    assert server.requests == [('/a.FTZ', 'bytes=50000-')]
+    assert open(file, 'rb').read() == data
+    assert not os.path.exists(file + '.part')
+
+
+def test_partial_file_already_complete(server, tmp_path) :
+    data = _gzip()
+    server.files['/a.FTZ'] = data
+    file = str(tmp_path / 'a.FTZ')
+    with open(file + '.part', 'wb') as f :
+        f.write(data)
+
+    download_file(server.url + '/a.FTZ', file, retries=0)
+    assert open(file, 'rb').read() == data
+
+
+def test_server_ignoring_range(server, tmp_path) :
+    data = _gzip()
+    server.files['/a.FTZ'] = data
+    server.ranges = False
+    file = str(tmp_path / 'a.FTZ')
+    with open(file + '.part', 'wb') as f :
+        f.write(data[:50000])
+
+    download_file(server.url + '/a.FTZ', file, retries=0)
+    assert open(file, 'rb').read() == data
+
+
+@pytest.mark.parametrize('name, corrupt', [('a.FTZ', lambda d : d[:-8] + bytes(8)),
+                                           ('sas.TAR', lambda d : d[:len(d) // 2]),
+                                           ('noext', lambda d : d[:len(d) // 2])])
+def test_corrupted(server, tmp_path, name, corrupt) :
+    data = _gzip() if name.endswith('.FTZ') else _tar({'0123_SUM.ASC' : os.urandom(100000)})
+    server.files['/' + name] = corrupt(data)
+    file = str(tmp_path / name)
+
+    with pytest.raises(IOError) :
+        download_file(server.url + '/' + name, file, retries=0)
+    assert not os.path.exists(file)
+    assert not os.path.exists(file + '.part')
+
+
+def test_only_missing_files(server, tmp_path) :
+    obs   = '0123456789'
+    files = observation_files(obs, archive=server.url + '/')
+    for name, url in files :
+        path = url[len(server.url):]
+        server.files[path] = _tar({'{0}_SUM.ASC'.format(obs) : b'summary'}) if name == SUMMARY[0] else _gzip(1000)
+    os.makedirs(str(tmp_path / obs))
+    with open(str(tmp_path / obs / files[0][0]), 'wb') as f :
+        f.write(server.files[files[0][1][len(server.url):]])
+
+    download_observation(str(tmp_path), obs, archive=server.url + '/')
+    assert sorted(path for path, r in server.requests) == sorted(url[len(server.url):] for name, url in files[1:])
+    assert os.path.isfile(str(tmp_path / obs / '{0}_SUM.ASC'.format(obs)))
+
+    # Nothing fetched again once the observation is complete, the tarball replaced by its summary
+    server.requests[:] = []
+    os.remove(str(tmp_path / obs / files[-1][0]))
+    download_observation(str(tmp_path), obs, archive=server.url + '/')
+    assert [path for path, r in server.requests] == [files[-1][1][len(server.url):]]
+
+
+def _archive(server, obs) :
+    files = observation_files(obs, archive=server.url + '/')
+    for name, url in files :
+        server.files[url[len(server.url):]] = _tar({'{0}_SUM.ASC'.format(obs) : b'summary'}) if name == SUMMARY[0] else _gzip(1000)
+    return files
+
+
+def test_tarball_failing_extraction(server, tmp_path, monkeypatch) :
+    obs   = '0123456789'
+    files = _archive(server, obs)
+    extract = downloader.extract_summary
+    calls = []
+    def fail_once(path, tar_file) :
+        calls.append(tar_file)
+        if len(calls) == 1 :
+            raise tarfile.ReadError("bad member")
+        extract(path, tar_file)
+    monkeypatch.setattr(downloader, 'extract_summary', fail_once)
+
+    download_observation(str(tmp_path), obs, archive=server.url + '/')
+    tar_url = [url for name, url in files if name == SUMMARY[0]][0][len(server.url):]
+    assert [path for path, r in server.requests].count(tar_url) == 2
+    assert os.path.isfile(str(tmp_path / obs / '{0}_SUM.ASC'.format(obs)))
+
+
+def test_prefetch_goes_on_after_corrupted_archive(server, tmp_path, monkeypatch) :
+    observations = ['0123456789', '0987654321', '0111111111']
+    for obs in observations :
+        _archive(server, obs)
+    def corrupted(path, tar_file) :
+        if '0123456789' in path :
+            raise tarfile.ReadError("bad member")
+        with open(os.path.join(path, 'SUM.ASC'), 'w') as f :
+            f.write('summary')
+        os.remove(tar_file)
+    monkeypatch.setattr(downloader, 'extract_summary', corrupted)
+
+    results = list(prefetch(str(tmp_path), observations, archive=server.url + '/'))
+    assert [obs for obs, error in results] == observations
+    assert [error == None for obs, error in results] == [False, True, True]
+    assert not os.path.exists(str(tmp_path / observations[0] / SUMMARY[0]))
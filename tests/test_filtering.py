@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+Filtering of the raw events without SAS, see scripts/filtering.py.
+"""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+
+import file_names as FileNames
+from filtering import filter_events, rate_curve, flaring_threshold, good_time_intervals, RATE_BIN
+from fits_extractor import read_events, extraction_deleted_periods
+
+T0 = 1.0e8
+
+
+def raw_events(path, duration=10000.0, flare=(4000.0, 5000.0), seed=0) :
+    """
+    Raw events file: a quiet background with a background flare of high
+    energy single events during the flare interval.
+    """
+    rng = np.random.default_rng(seed)
+    n_quiet, n_flare = 40000, 8000
+    times = np.concatenate((rng.uniform(0, duration, n_quiet), rng.uniform(*flare, n_flare)))
+    n = len(times)
+    data = np.zeros(n, dtype=[('TIME', '>f8'), ('RAWX', '>i2'), ('RAWY', '>i2'), ('X', '>i4'), ('Y', '>i4'),
+                              ('CCDNR', 'u1'), ('PI', '>i2'), ('PATTERN', 'u1'), ('FLAG', '>i4')])
+    data['TIME']    = T0 + times
+    data['RAWX']    = rng.integers(1, 65, n)
+    data['RAWY']    = rng.integers(1, 201, n)
+    data['X']       = rng.integers(1, 40001, n)
+    data['Y']       = rng.integers(1, 40001, n)
+    data['CCDNR']   = rng.integers(1, 13, n)
+    data['PI']      = np.where(np.arange(n) < n_quiet, rng.integers(200, 12500, n), rng.integers(10000, 12000, n))
+    data['PATTERN'] = np.where(np.arange(n) < n_quiet, rng.integers(0, 6, n), 0)
+    data = data[np.argsort(data['TIME'])]
+
+    hdu = fits.BinTableHDU(data, name='EVENTS')
+    hdu.header['TSTART'] = T0
+    hdu.header['TSTOP']  = T0 + duration
+    hdu.header['OBS_ID'] = '0123456789'
+    for i, name in enumerate(data.dtype.names, 1) :
+        if name in ('X', 'Y') :
+            hdu.header['TLMIN{0}'.format(i)] = 1
+            hdu.header['TLMAX{0}'.format(i)] = 40000
+    file = os.path.join(str(path), 'P0123456789PNS001PIEVLI0000.FIT')
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(file)
+
+    return file, data
+
+
+def test_quiet_rate_curve_not_cut() :
+    rng = np.random.default_rng(1)
+    cut = [np.mean(rate > flaring_threshold(rate)) for rate in rng.poisson(50, (50, 100)) / RATE_BIN]
+    assert np.mean(cut) < 0.005
+
+
+def test_flaring_interval_excluded(tmp_path) :
+    file, data = raw_events(tmp_path)
+    rate = filter_events(file, str(tmp_path))
+
+    # The rate curve of the high energy single events sets the threshold between the quiet and the flaring rates
+    high = data['TIME'][(data['PI'] >= 10000) & (data['PI'] <= 12000) & (data['PATTERN'] == 0)]
+    bin_starts, rates = rate_curve(high, T0, T0 + 10000.0)
+    flaring = (bin_starts >= T0 + 4000) & (bin_starts < T0 + 5000)
+    assert rates[~flaring].max() < rate < rates[flaring].min()
+
+    gti = extraction_deleted_periods(str(tmp_path / FileNames.GTI_FILE))
+    assert np.allclose(np.array(gti.tolist()), [(T0, T0 + 4000), (T0 + 5000, T0 + 10000)])
+    start, stop = good_time_intervals(bin_starts, rates, rate)
+    assert np.allclose(start, gti['START']) and np.allclose(stop, gti['STOP'])
+
+    # Clean events: out of the flare, and passing the cuts of filtering.sh
+    header, clean = read_events(str(tmp_path / FileNames.CLEAN_FILE), None)
+    expected = (data['PI'] >= 500) & (data['PI'] <= 12000) & (data['PATTERN'] <= 4)
+    expected &= (data['TIME'] < T0 + 4000) | (data['TIME'] >= T0 + 5000)
+    assert np.array_equal(clean['TIME'], data['TIME'][expected])
+    assert header['OBS_ID'] == '0123456789'
+
+    image = fits.getdata(str(tmp_path / FileNames.IMG_FILE))
+    assert image.shape == (500, 500) and image.sum() == expected.sum()
+    assert os.path.isfile(str(tmp_path / FileNames.RATE_FILE))
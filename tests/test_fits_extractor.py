@@ -0,0 +1,71 @@
+# coding=utf-8
+"""
+Streamed reading and cleaning of the events, see scripts/fits_extractor.py.
+"""
+
+import gzip
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from fits_extractor import read_events, cleaning, extraction_photons, XMMEA_EP, EVENT_COLUMNS
+from test_variability_utils import gti
+
+
+def events_file(path, n=1000, seed=0, compressed=True) :
+    """
+    Raw events file with an extension before the events, gzip-compressed as the
+    archive files. FLAG is unsigned, stored with TZERO.
+    @return: file name, events as written
+    """
+    rng = np.random.default_rng(seed)
+    data = np.zeros(n, dtype=[('TIME', '>f8'), ('RAWX', '>i2'), ('RAWY', '>i2'), ('CCDNR', 'u1'),
+                              ('PI', '>i2'), ('PATTERN', 'u1'), ('FLAG', '>u4')])
+    data['TIME']    = np.sort(1.0e8 + rng.uniform(0, 1000, n))
+    data['RAWX']    = rng.integers(1, 65, n)
+    data['RAWY']    = rng.integers(1, 201, n)
+    data['CCDNR']   = rng.integers(1, 13, n)
+    data['PI']      = rng.integers(0, 15000, n)
+    data['PATTERN'] = rng.integers(0, 13, n)
+    data['FLAG']    = np.where(rng.uniform(size=n) < 0.2, rng.choice([1, 4, 0x10000, 0x80000000], n), 0)
+
+    offsets = fits.BinTableHDU.from_columns([fits.Column(name='CCDNR', format='B', array=np.arange(1, 13))], name='OFFSETS')
+    table   = fits.BinTableHDU(data, name='EVENTS')
+    file    = str(path / ('events.FTZ' if compressed else 'events.FIT'))
+    hdulist = fits.HDUList([fits.PrimaryHDU(), offsets, table])
+    if compressed :
+        with gzip.open(file, 'wb') as f :
+            hdulist.writeto(f)
+    else :
+        hdulist.writeto(file)
+
+    return file, data
+
+
+@pytest.mark.parametrize('compressed, chunk_rows', [(True, 7), (True, 1000), (True, 10000), (False, 333)])
+def test_read_events_as_astropy(tmp_path, compressed, chunk_rows) :
+    file, data = events_file(tmp_path, compressed=compressed)
+    header, events = read_events(file, None, chunk_rows=chunk_rows)
+    assert header['EXTNAME'] == 'EVENTS' and len(events) == len(data)
+    for c in data.dtype.names :
+        assert np.array_equal(events[c], data[c]), c
+
+
+@pytest.mark.parametrize('chunk_rows', [7, 1000])
+def test_cleaning_cuts(tmp_path, chunk_rows) :
+    file, data = events_file(tmp_path)
+    g = gti((100, 300.5), (600, 1000))
+    header, events = read_events(file, EVENT_COLUMNS, cleaning(g), chunk_rows=chunk_rows)
+
+    keep = ((data['FLAG'] & XMMEA_EP) == 0) & (data['PATTERN'] <= 4) & (data['PI'] >= 500) & (data['PI'] <= 12000)
+    keep &= np.any([(data['TIME'] >= a) & (data['TIME'] < b) for a, b in g], axis=0)
+    assert 0 < keep.sum() < len(data)
+    assert np.array_equal(events['TIME'], data['TIME'][keep])
+    assert events.dtype.names == tuple(EVENT_COLUMNS)
+
+    # Raw file read by CCD, as the clean file written by the filtering
+    ccds, header = extraction_photons(file, g)
+    assert sum(len(ccd) for ccd in ccds) == keep.sum()
+    for i, ccd in enumerate(ccds) :
+        assert np.all(ccd['CCDNR'] == i + 1) and np.all(np.diff(ccd['TIME']) >= 0)
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""
+Log of the lightcurve results, written by scripts/pipeline.py and
+scripts/lightcurve_extractor.py, read by scripts/lcurve.py.
+"""
+
+import os
+
+import numpy as np
+
+from pipeline import init_lightcurve_logs, params_name
+from lightcurve_extractor import log_line, write_log, lightcurve_file
+from lcurve import read_log
+
+
+def test_log_read_back(tmp_path) :
+    folder, params = str(tmp_path), [(8, 100.0, 1.0, 3)]
+    init_lightcurve_logs(folder, params)
+    log_file = os.path.join(folder, 'sources_variability_{0}'.format(params_name(*params[0])))
+    with open(log_file, 'a') as f :
+        f.write(log_line('0123456789', 1, '4XMM_J001122.3-445566', 8, 100.0, 0.25, 1e-5))
+        f.write(log_line('0123456789', 2, '4XMM_J001122.4-445567', None, 100.0, np.nan, np.nan))
+
+    with open(log_file) as f :
+        header = f.readline().split()
+        rows   = [dict(zip(header, line.split())) for line in f]
+    assert all(len(row) == len(header) for row in rows)
+    assert rows[0] == {'Observation' : '0123456789', 'Source' : '1', 'Name' : '4XMM_J001122.3-445566',
+                       'DL' : '8', 'TW' : '100', 'P_chisq' : '0.25', 'P_KS' : '1e-05'}
+    assert rows[1]['DL'] == 'nan' and rows[1]['P_KS'] == 'nan'
+
+    # The lightcurve files of the sources, named as by the extractor, are read by lcurve.py from the same lines
+    src_file = lightcurve_file(os.path.join(folder, '0123456789'), 100.0, '4XMM_J001122.3-445566', 100.0, 'src')
+    assert src_file.endswith(os.path.join('lcurve_100', '4XMM_J001122.3-445566_lc_100_src.lc'))
+    os.makedirs(os.path.dirname(src_file))
+    open(src_file, 'w').close()
+    lightcurves = read_log(log_file, folder, 100.0)
+    assert [(lc['n'], lc['name'], lc['pcs'], lc['pks']) for lc in lightcurves] == [('1', '4XMM_J001122.3-445566', 0.25, 1e-5)]
+    assert lightcurves[0]['src_file'] == src_file
+
+    # The background subtracted lightcurve is used when written
+    corr_file = lightcurve_file(os.path.join(folder, '0123456789'), 100.0, '4XMM_J001122.3-445566', 100.0, 'lccorr')
+    open(corr_file, 'w').close()
+    assert read_log(log_file, folder, 100.0)[0]['src_file'] == corr_file
+
+
+def test_log_rewritten_per_observation(tmp_path) :
+    folder, params = str(tmp_path), [(8, 100.0, 1.0, 3)]
+    init_lightcurve_logs(folder, params)
+    log_file = os.path.join(folder, 'sources_variability_{0}'.format(params_name(*params[0])))
+    first  = [log_line('0123456789', i, 'SRC{0}'.format(i), 8, 100.0, 0.5, 0.5) for i in (1, 2)]
+    other  = [log_line('0987654321', 1, 'SRC9', 8, 100.0, 0.5, 0.5)]
+    second = [log_line('0123456789', 1, 'SRC1', 8, 100.0, 0.1, 0.1)]
+    write_log(log_file, '0123456789', first)
+    write_log(log_file, '0987654321', other)
+
+    # Lightcurves extracted again, then the sources gone
+    write_log(log_file, '0123456789', second)
+    with open(log_file) as f :
+        assert f.readlines()[1:] == other + second
+    init_lightcurve_logs(folder, params)
+    write_log(log_file, '0123456789', [])
+    with open(log_file) as f :
+        assert f.readlines() == ["Observation Source Name DL TW P_chisq P_KS\n"] + other
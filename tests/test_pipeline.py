@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Tasks of the batch processing, see scripts/pipeline.py.
+"""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+
+import file_names as FileNames
+import pipeline
+import resources as Resources
+from test_variability_utils import events, gti, T0
+
+OBS = '0123456789'
+PARAMS = [(8, 100, 1.0, 3), (8, 1000, 1.0, 3)]
+
+
+def clean_events(folder, n=1000, exposure=5000.0, data=None) :
+    """
+    Clean events file of the observation, with only a TIME column if no events are given.
+    """
+    path = os.path.join(str(folder), OBS)
+    os.makedirs(path, exist_ok=True)
+    if data is None :
+        hdu = fits.BinTableHDU.from_columns([fits.Column(name='TIME', format='D', array=np.linspace(0, exposure, n))], name='EVENTS')
+        hdu.header['TSTART'], hdu.header['TSTOP'] = 0.0, exposure
+    else :
+        hdu = fits.BinTableHDU(data, name='EVENTS')
+        hdu.header['TSTART'], hdu.header['TSTOP'] = T0, T0 + exposure
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(os.path.join(path, FileNames.CLEAN_FILE))
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU(gti((0, exposure)), name='STDGTI')]).writeto(os.path.join(path, FileNames.GTI_FILE))
+    return path
+
+
+def observation(folder, flare) :
+    """
+    Clean events of the 12 CCDs over 10 ks, with a flare on the fifth one if flare.
+    """
+    data = events(300000, 10000.0, seed=4, flare=(30, 100, 4000.0, 4100.0, 500) if flare else None)
+    data['CCDNR'] = np.random.default_rng(4).integers(1, 13, len(data))
+    if flare :
+        data['CCDNR'][(data['RAWX'] == 30) & (data['RAWY'] == 100) & (data['TIME'] >= T0 + 4000) & (data['TIME'] < T0 + 4100)] = 5
+    return clean_events(folder, exposure=10000.0, data=data)
+
+
+class Detected(object) :
+    def __init__(self, n_sources) :
+        self.sources = list(range(n_sources))
+
+    def detect(self, path, **kwargs) :
+        return self
+
+
+def test_lightcurve_task_resources(tmp_path, monkeypatch) :
+    clean_events(tmp_path)
+    monkeypatch.setattr(pipeline, 'get_detector', lambda mta=1 : Detected(3))
+    tasks = pipeline.detection(str(tmp_path), OBS, 8, 100, 1.0, 3, lightcurves=True, retries=2, padding=1000.0)
+
+    assert len(tasks) == 1 and tasks[0].fct is pipeline.lightcurve
+    assert tasks[0].retries == 2
+    assert tasks[0].cost == Resources.lightcurve_cost(1000, 5000.0, 100, 3, 1000.0) > 0
+    assert tasks[0].memory == Resources.lightcurve_memory(1000, 5000.0, 100, 3, 1000.0) > Resources.MEMORY_PROCESS
+
+    # The retries of the command line reach the lightcurve stage through the detection
+    det = [t for t in pipeline.observation_tasks(str(tmp_path), OBS, [(8, 100, 1.0, 3)], retries=2) if t.fct is pipeline.detection][0]
+    assert det.kwargs['retries'] == 2
+
+
+def test_triage_once_per_observation(tmp_path, monkeypatch) :
+    observation(tmp_path, flare=True)
+    tasks = pipeline.observation_tasks(str(tmp_path), OBS, PARAMS, stages=['detection', 'rendering'], triage=True)
+    assert [t.fct for t in tasks] == [pipeline.ccd_triage]
+    pipeline.balance_tasks(tasks, 6)
+    assert tasks[0].kwargs['cpus'] == 6
+
+    # The detections of every set of parameters only compute the CCD with the flare
+    children = tasks[0].fct(*tasks[0].args, **tasks[0].kwargs)
+    detections = [t for t in children if t.fct is pipeline.detection]
+    assert len(detections) == len(PARAMS) and len(children) == 2 * len(PARAMS)
+    assert all(t.kwargs['ccds'] == [4] for t in detections)
+
+    # Scored once: the triage file is read again while the events do not change
+    import triage
+    monkeypatch.setattr(triage, 'triage_observation', None)
+    assert [t.kwargs['ccds'] for t in pipeline.ccd_triage(str(tmp_path), OBS, PARAMS) if t.fct is pipeline.detection] == [[4], [4]]
+
+    # The CCDs kept reach the detector
+    detect = {}
+    class Detector(object) :
+        def detect(self, path, **kwargs) :
+            detect.update(kwargs)
+            return Detected(0)
+    monkeypatch.setattr(pipeline, 'get_detector', lambda mta=1 : Detector())
+    detections[0].fct(*detections[0].args, **detections[0].kwargs)
+    assert detect['ccds'] == [4]
+
+
+def test_quiet_observation_skipped(tmp_path) :
+    observation(tmp_path, flare=False)
+    assert pipeline.ccd_triage(str(tmp_path), OBS, PARAMS) == []
@@ -0,0 +1,82 @@
+# coding=utf-8
+"""
+Dependency graph scheduler, see scripts/scheduler.py.
+"""
+
+import numpy as np
+
+from scheduler import Scheduler, Task, priorities, PENDING, DONE, FAILED, SKIPPED
+
+
+def noop() :
+    pass
+
+
+def random_graph(n, seed=0) :
+    """
+    Tasks with random costs, each depending on up to two earlier tasks.
+    """
+    rng = np.random.default_rng(seed)
+    tasks = []
+    for i in range(n) :
+        deps = ["t{0}".format(d) for d in set(rng.integers(0, i, 2))] if i else []
+        tasks.append(Task("t{0}".format(i), noop, deps=deps, cost=float(rng.uniform(0, 10))))
+    return tasks
+
+
+def test_ranks_as_priorities() :
+    tasks = random_graph(300)
+    scheduler = Scheduler(log=None)
+    # Tasks added in any order, some before the ones they depend on
+    for task in tasks[::2] + tasks[1::2] :
+        scheduler.add(task)
+        assert scheduler.ranks == priorities(scheduler.tasks.values())
+
+    # Children added at the end of a task, as by Scheduler._finish
+    child = Task("child", noop, deps=["t0"], cost=1000.0)
+    scheduler.add(child)
+    assert scheduler.ranks == priorities(scheduler.tasks.values())
+
+    # The tasks a finished task depends on are finished, their ranks are not used again
+    scheduler.remove("child")
+    assert "child" not in scheduler.ranks
+    assert "child" not in scheduler.children.get("t0", [])
+
+
+def test_failure_propagated() :
+    tasks = random_graph(300)
+    scheduler = Scheduler(log=None)
+    for task in tasks[::-1] :
+        scheduler.add(task)
+    scheduler.tasks["t0"].state = FAILED
+    ready = scheduler._ready()
+
+    descendants = {"t0"}
+    for task in tasks[1:] :
+        if descendants & set(task.deps) :
+            descendants.add(task.name)
+    assert {t.name for t in tasks if t.state == SKIPPED} == descendants - {"t0"}
+    assert all(t.state == PENDING and not t.deps for t in ready)
+
+
+def sleep(duration) :
+    import time
+    time.sleep(duration)
+
+
+def kill(duration) :
+    import os, signal, time
+    time.sleep(duration)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_broken_pool_culprit() :
+    scheduler = Scheduler(processes=3, log=None)
+    culprit = scheduler.add(Task("culprit", kill, args=(0.5,), memory=1))
+    others  = [scheduler.add(Task("t{0}".format(i), sleep, args=(1.0,), memory=1)) for i in range(2)]
+    states = scheduler.run()
+
+    # The tasks running with the culprit are not charged for its failures
+    assert states == {"culprit" : FAILED, "t0" : DONE, "t1" : DONE}
+    assert [(t.attempts, t.memory_factor) for t in others] == [(1, 1.0), (1, 1.0)]
+    assert culprit.attempts == 2 and culprit.memory_factor == 4.0
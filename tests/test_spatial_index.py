@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+Grid index of the events positions, see scripts/spatial_index.py.
+"""
+
+import numpy as np
+import pytest
+
+from spatial_index import SpatialIndex
+
+
+def positions(n=5000, seed=0) :
+    """
+    Integer sky positions, as in the events files: many events lie on the
+    edges of the cells.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(1000, 3000, n).astype(float), rng.integers(500, 1800, n).astype(float)
+
+
+def inside_convex(x, y, vertices) :
+    """
+    Points strictly inside a convex polygon with counter-clockwise vertices.
+    """
+    inside = np.ones(len(x), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]) :
+        inside &= (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1) > 0
+    return inside
+
+
+def as_set(indices) :
+    return set(indices.tolist())
+
+
+@pytest.mark.parametrize('cell', [64, 100, 5000])
+def test_queries_as_brute_force(cell) :
+    x, y = positions()
+    index = SpatialIndex(x, y, cell)
+    d2 = lambda cx, cy : (x - cx)**2 + (y - cy)**2
+
+    # Circles centred inside, on the edges and across the corners of the grid
+    for cx, cy, r in [(2000, 1000, 80), (1000, 500, 150), (2999, 1799, 64), (1000 + cell, 500 + cell, cell), (3100, 1900, 200)] :
+        assert as_set(index.circle(cx, cy, r)) == set(np.flatnonzero(d2(cx, cy) <= r**2))
+        expected = (d2(cx, cy) <= r**2) & (d2(cx, cy) > (r / 2)**2)
+        assert as_set(index.annulus(cx, cy, r / 2, r)) == set(np.flatnonzero(expected))
+
+    # Boxes: a superset of the events within, with no event counted twice
+    for x_min, x_max, y_min, y_max in [(1500, 1700, 600, 900), (0, 5000, 0, 5000), (2900, 3500, 1700, 2500)] :
+        found = index.box(x_min, x_max, y_min, y_max)
+        assert len(found) == len(as_set(found))
+        within = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        assert set(np.flatnonzero(within)) <= as_set(found)
+
+    # Polygon with no event on its edges: non-integer vertices
+    vertices = [(1200.31, 600.47), (2600.73, 800.19), (2200.11, 1700.83), (1100.59, 1300.27)]
+    assert as_set(index.polygon(vertices)) == set(np.flatnonzero(inside_convex(x, y, vertices)))
+
+
+def test_query_outside_grid() :
+    x, y = positions()
+    index = SpatialIndex(x, y)
+    assert len(index.circle(10000, 10000, 100)) == 0
+    assert len(index.box(0, 900, 0, 400)) == 0
+    assert len(index.polygon([(-10, -10), (0, -10), (0, 0)])) == 0
+
+
+def test_empty_index() :
+    index = SpatialIndex([], [])
+    assert len(index) == 0
+    assert len(index.circle(0, 0, 100)) == 0
+    assert len(index.annulus(0, 0, 10, 100)) == 0
+    assert len(index.box(-100, 100, -100, 100)) == 0
+    assert len(index.polygon([(-10, -10), (10, -10), (0, 10)])) == 0
+    assert not index.mask(index.circle(0, 0, 100)).any()
@@ -0,0 +1,86 @@
+# coding=utf-8
+"""
+Streaming detection, see scripts/streaming.py.
+"""
+
+import numpy as np
+
+from streaming import StreamingDetector, EXACT_COUNTS
+from variability_utils import variability_computation, count_cube
+from test_variability_utils import T0, events, gti
+
+
+def stream(data, batch=10.0) :
+    """
+    Batches of the events of CCD 1, in time order.
+    """
+    data = data.copy()
+    data['CCDNR'] = 1
+    edges = np.arange(data['TIME'][0], data['TIME'][-1] + batch, batch)
+    bounds = np.searchsorted(data['TIME'], edges)
+    return [data[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def flares(*flares) :
+    """
+    Quiet events over 5 ks with the events of each flare (rawx, rawy, t_start, t_stop, n_flare).
+    """
+    data = [events(30000, 5000.0, seed=1)]
+    data += [events(f[-1], 5000.0, seed=2 + i, flare=f) for i, f in enumerate(flares)]
+    return np.sort(np.concatenate(data), order='TIME')
+
+
+def run(data, g=None, gtr=1.0) :
+    detector = StreamingDetector(100.0, gti=g, gtr=gtr)
+    alerts = []
+    for batch in stream(data) :
+        alerts += detector.process(batch)
+    return detector, alerts
+
+
+def test_variability_as_detector() :
+    data = flares((40, 100, 3000, 3050, 200))
+    g = gti((0, 2050), (2130, 5000))
+    detector, alerts = run(data, g)
+    expected = variability_computation(g, 100.0, 1.0, data['TIME'][0], T0 + 5000.0, data, step=100.0)
+    assert np.allclose(detector.v_matrix[0], expected)
+    assert [(a.ccd, a.rawx, a.rawy) for a in alerts] == [(1, 40, 100)]
+
+
+def test_median_of_partial_windows() :
+    # One window in two with 80 s of good time: its corrected counts are not integers
+    g = gti(*[(100 * k, 100 * k + (100 if k % 2 == 0 else 80)) for k in range(50)])
+    data = np.sort(np.concatenate([events(100000, 5000.0, seed=s) for s in range(3)]), order='TIME')
+    data = data[(data['TIME'] - T0) % 200 < 180]
+    data['CCDNR'] = 1
+    detector, alerts = run(data, g, 0.5)
+
+    # The last window is not closed, no event coming after it
+    end = data['TIME'][0] + 4900.0
+    counts, ratio = count_cube(g, 100.0, 0.5, data['TIME'][0], end, data, step=100.0)
+    assert np.all(np.isclose(ratio, 0.8, atol=1e-3) | (ratio == 1.0))
+    exact  = np.median(counts[0] / ratio, axis=-1)
+    median = detector.median().reshape(12, 64, 200)[0]
+    assert np.all(exact < EXACT_COUNTS)
+    assert np.all((median <= exact) & (median > exact - 1))
+
+    # The variability is the one of the detector where the median is an integer count
+    expected = variability_computation(g, 100.0, 0.5, data['TIME'][0], end, data, step=100.0)
+    integer  = exact == np.floor(exact)
+    assert 0 < np.count_nonzero(integer) < integer.size
+    assert np.allclose(detector.v_matrix[0][integer], expected[integer])
+    assert not np.allclose(detector.v_matrix[0], expected)
+
+
+def test_alerts_rearmed_after_quiet_window() :
+    data = flares((40, 100, 1000, 1050, 200), (40, 100, 2000, 2050, 200), (40, 100, 3000, 3200, 800))
+    detector, alerts = run(data)
+    # The flare lasting two windows is alerted once
+    assert [(a.rawx, a.rawy) for a in alerts] == [(40, 100)] * 3
+    assert [int((a.time - T0) // 1000) for a in alerts] == [1, 2, 3]
+
+
+def test_no_alert_outside_gti() :
+    data = flares((40, 100, 2060, 2120, 300))
+    assert len(run(data)[1]) == 1
+    assert run(data, gti((0, 2050), (2130, 5000)))[1] == []
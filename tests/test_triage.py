@@ -0,0 +1,22 @@
+# coding=utf-8
+"""
+False-negative rate of the triage of the CCDs, see scripts/triage.py.
+"""
+
+from triage import injection_test
+from test_variability_utils import events, gti
+
+# Highest false-negative rate of the triage accepted by the injection test
+MAX_FALSE_NEGATIVE = 0.05
+
+
+def test_injection_false_negative_rate() :
+    data = []
+    for ccd in range(3) :
+        data.append(events(30000, 10000.0, seed=ccd))
+        data[-1]['CCDNR'] = ccd + 1
+    record = injection_test(data, gti((0, 10000)), n_trials=40, seed=0)
+
+    assert record['DETECTED'] >= 10
+    assert record['FALSE_NEGATIVE'] <= MAX_FALSE_NEGATIVE
+    assert record['QUIET_KEPT'] == 0
@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Statistics of variability of the count cubes, see scripts/variability_statistics.py.
+"""
+
+import numpy as np
+import pytest
+
+from variability_statistics import STATISTICS, BLOCKS_P0, bayesian_blocks, compute_statistics
+
+N_WINDOWS = 40
+
+
+def cubes(seed=0) :
+    """
+    Count cubes of 8x10 pixels: a constant one, and a Poisson one with a
+    flare of the pixel (2, 3) during windows 10 to 14, on a constant rate.
+    """
+    rng = np.random.default_rng(seed)
+    ratio    = np.ones(N_WINDOWS)
+    constant = np.full((8, 10, N_WINDOWS), 20.0)
+    flared   = rng.poisson(20, constant.shape).astype(float)
+    flared[2, 3] = 20
+    flared[2, 3, 10:15] += 200
+
+    return ratio, constant, flared
+
+
+def blocks_change_points(counts, ratio, p0=BLOCKS_P0) :
+    """
+    Change points of the Bayesian blocks of a single lightcurve, one block
+    end at a time.
+    """
+    n = len(counts)
+    ncp_prior = 4 - np.log(73.53 * p0 * n**-0.478)
+    best, last = [], []
+    for r in range(n) :
+        fits = []
+        for k in range(r + 1) :
+            n_k, t_k = sum(counts[k:r + 1]), sum(ratio[k:r + 1])
+            fits.append((n_k * np.log(n_k / t_k) if n_k > 0 else 0.0) - ncp_prior + (best[k - 1] if k else 0.0))
+        last.append(int(np.argmax(fits)))
+        best.append(max(fits))
+
+    starts, end = [], n
+    while end > 0 :
+        starts.append(last[end - 1])
+        end = last[end - 1]
+
+    return len(starts) - 1
+
+
+def test_constant_cube() :
+    ratio, constant, flared = cubes()
+    maps = compute_statistics(list(STATISTICS), constant, ratio)
+    assert all(m.shape == (8, 10) for m in maps.values())
+    assert np.all(maps['VARIABILITY'] == 0) and np.all(maps['FVAR'] == 0)
+    assert np.all(maps['CHISQ'] == 0) and np.all(maps['BLOCKS'] == 0)
+    assert np.all(maps['POISSON'] < 1)
+
+    # Counts in proportion to the projection ratio: a constant rate
+    ratio = np.linspace(0.25, 1, N_WINDOWS)
+    maps = compute_statistics(list(STATISTICS), constant * ratio, ratio)
+    assert np.allclose(maps['VARIABILITY'], 0) and np.all(maps['BLOCKS'] == 0)
+    assert np.allclose(maps['CHISQ'], 0) and np.all(maps['FVAR'] == 0)
+
+
+def test_flared_cube() :
+    ratio, constant, flared = cubes()
+    maps  = compute_statistics(list(STATISTICS), flared, ratio)
+    quiet = np.ones((8, 10), dtype=bool)
+    quiet[2, 3] = False
+    for name, threshold in [('VARIABILITY', 5), ('POISSON', 20), ('FVAR', 0.5), ('CHISQ', 10)] :
+        assert maps[name][2, 3] > threshold > maps[name][quiet].max(), name
+    # The flare starts and ends: two change points, the quiet pixels having false ones at about BLOCKS_P0
+    assert maps['BLOCKS'][2, 3] == 2
+    assert np.mean(maps['BLOCKS'][quiet] > 0) < 2 * BLOCKS_P0
+
+
+def test_blocks_walk_back() :
+    rng = np.random.default_rng(1)
+    ratio = rng.uniform(0.3, 1, 30)
+    steps = np.repeat([5.0, 40.0, 10.0, 60.0, 5.0], 6)
+    counts = rng.poisson(np.vstack((np.tile(steps, (20, 1)), np.full((20, 30), 10.0), np.zeros((1, 30)))) * ratio).astype(float)
+
+    expected = [blocks_change_points(c, ratio) for c in counts]
+    assert expected[0] == 4 and expected[-1] == 0
+    assert np.array_equal(bayesian_blocks(counts, ratio), expected)
+    # Pixels processed by blocks of a few lightcurves
+    assert np.array_equal(bayesian_blocks(counts.reshape(41, 1, 30), ratio, chunk=70), np.reshape(expected, (41, 1)))
+
+
+def test_too_few_windows() :
+    maps = compute_statistics(list(STATISTICS), np.ones((4, 5, 1)), np.ones(1))
+    assert all(np.array_equal(m, np.zeros((4, 5))) for m in maps.values())
@@ -0,0 +1,157 @@
+# coding=utf-8
+"""
+Counting of the events in time windows, see scripts/variability_utils.py.
+"""
+
+import numpy as np
+import pytest
+
+from variability_utils import good_time_windows, count_cube, sliding_count_cube, variability_computation, adaptive_variability, update_counts, incremental_variability
+
+T0 = 1.0e8
+
+
+def events(n, duration, seed=0, flare=None) :
+    """
+    Events of a CCD sorted by TIME, uniform over the CCD and the duration,
+    with the events of flare=(rawx, rawy, t_start, t_stop, n_flare) added.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.zeros(n, dtype=[('TIME', '<f8'), ('RAWX', '<i2'), ('RAWY', '<i2'), ('CCDNR', 'u1'), ('PI', '<i2')])
+    data['TIME'] = T0 + rng.uniform(0, duration, n)
+    data['RAWX'] = rng.integers(1, 65, n)
+    data['RAWY'] = rng.integers(1, 201, n)
+    data['PI']   = rng.integers(500, 12001, n)
+    if flare != None :
+        x, y, start, stop, n_flare = flare
+        data['TIME'][:n_flare] = T0 + rng.uniform(start, stop, n_flare)
+        data['RAWX'][:n_flare] = x
+        data['RAWY'][:n_flare] = y
+    return np.sort(data, order='TIME')
+
+
+def gti(*intervals) :
+    return np.array([(T0 + a, T0 + b) for a, b in intervals], dtype=[('START', '<f8'), ('STOP', '<f8')])
+
+
+def legacy_count_cube(gti, tw, gtr, t0, tf, data, bands) :
+    """
+    The original loop over the events, one event at a time.
+    """
+    time_windows, projection_ratio = good_time_windows(gti, tw, gtr, t0, tf)
+    n_bands = len(bands) - 1 if bands != None else 0
+    counts = np.zeros([1 + n_bands, 64, 200, len(time_windows)])
+    i = 0
+    for n in range(len(time_windows)) :
+        while i < len(data) and data[i]['TIME'] <= time_windows[n] + tw :
+            j, k = int(data[i]['RAWX']) - 1, int(data[i]['RAWY']) - 1
+            b = -1
+            if n_bands > 0 :
+                b = np.searchsorted(bands, data[i]['PI'], side='right') - 1
+                b = n_bands - 1 if data[i]['PI'] == bands[-1] else (b if b < n_bands else -1)
+            for x in range(j - 1, j + 2) :
+                for y in range(k - 1, k + 2) :
+                    if 0 <= x < 64 and 0 <= y < 200 :
+                        counts[0][x][y][n] += 1
+                        if b >= 0 :
+                            counts[1 + b][x][y][n] += 1
+            i += 1
+        i += 1
+    cdt = projection_ratio >= gtr
+    return counts[..., cdt], projection_ratio[cdt]
+
+
+@pytest.mark.parametrize('n, tw, gtr, bands', [(3000, 100.0, 1.0, None),
+                                               (3000, 100.0, 0.5, [500, 2000, 12000]),
+                                               (3000, 100.0, 1.0, [1000, 5000, 8000]),
+                                               (20, 100.0, 1.0, None),
+                                               (3000, 7.3, 1.0, None),
+                                               (0, 100.0, 1.0, None)])
+def test_count_cube_as_legacy_loop(n, tw, gtr, bands) :
+    data = events(n, 5000.0)
+    g = gti((0, 2050), (2130, 5000))
+    counts, ratio = count_cube(g, tw, gtr, T0, T0 + 5000.0, data, bands)
+    expected, expected_ratio = legacy_count_cube(g, tw, gtr, T0, T0 + 5000.0, data, bands)
+    assert np.array_equal(counts, expected)
+    assert np.array_equal(ratio, expected_ratio)
+
+
+@pytest.mark.parametrize('n, bands', [(20, None), (30000, [500, 2000, 12000])])
+def test_sliding_windows_as_direct_counts(n, bands) :
+    data = events(n, 5000.0, flare=(10, 20, 1000.0, 1100.0, 10))
+    g = gti((0, 2050), (2130, 5000))
+    counts, ratio = sliding_count_cube(g, 100.0, 0.5, T0, T0 + 5000.0, data, bands, 25.0)
+
+    # Counts of each window [start, start + 100 s) summed over the 3x3 pixels
+    starts = T0 + 25.0 * np.arange(int(np.ceil(5000.0 / 25.0)) - 3)
+    good   = np.array([sum(max(0, min(s + 100.0, b) - max(s, a)) for a, b in g) for s in starts]) / 100.0
+    starts = starts[good >= 0.5]
+    assert np.allclose(ratio, good[good >= 0.5])
+    for i, start in enumerate(starts[::17]) :
+        window = data[(data['TIME'] >= start) & (data['TIME'] < start + 100.0)]
+        near = (np.abs(window['RAWX'] - 10) <= 1) & (np.abs(window['RAWY'] - 20) <= 1)
+        assert counts[0, 9, 19, 17 * i] == np.count_nonzero(near)
+    assert counts.dtype.kind == 'i'
+
+
+def test_adaptive_as_fixed_windows() :
+    # Pixels of a bright, a medium and a faint rate, the GTI cutting some windows of every length
+    bright = events(2000, 12800.0, seed=1, flare=(10, 20, 0.0, 12800.0, 2000))
+    medium = events(300, 12800.0, seed=2, flare=(40, 150, 0.0, 12800.0, 300))
+    data = np.sort(np.concatenate((events(20000, 12800.0), bright, medium)), order='TIME')
+    g, bands, statistics = gti((0, 5050), (5330, 12800)), [500, 2000, 12000], ['POISSON', 'FVAR']
+    data = data[(data['TIME'] < T0 + 5050) | (data['TIME'] >= T0 + 5330)]
+    V, maps = adaptive_variability(g, 100.0, 1.0, T0, T0 + 12800.0, data, 10, bands, statistics, levels=6)
+
+    # Shortest window with the target counts on average over the 125.2 windows of 100 s of good time, the longest one below
+    counts, ratio = count_cube(gti((0, 12800)), 100.0, 1.0, T0, T0 + 12800.0, data, step=100.0)
+    rate = counts[0].sum(axis=-1) / 125.2
+    expected = np.clip(2.0**np.ceil(np.log2(np.clip(10 / rate, 1, None))), 1, 32)
+    assert np.array_equal(maps['TW'], 100.0 * expected)
+    assert maps['TW'][10, 20] == 100.0 and maps['TW'][40, 150] == 800.0
+    assert len(np.unique(maps['TW'])) >= 3
+
+    # Same variability and statistics as a run at the window of each pixel, every event counted
+    for tw in np.unique(maps['TW']) :
+        pixels = maps['TW'] == tw
+        V_fixed, maps_fixed = variability_computation(g, tw, 1.0, T0, T0 + 12800.0, data, bands, statistics, step=tw)
+        assert np.allclose(V[:, pixels], V_fixed[:, pixels])
+        for name in statistics :
+            assert np.allclose(maps[name][pixels], maps_fixed[name][pixels]), (tw, name)
+
+
+def _incremental(g1, g2, part, data, bands, statistics, tamper=False) :
+    t0 = data['TIME'][0]
+    state = update_counts(g1, 100.0, 1.0, t0, part['TIME'][-1], part, bands)
+    if tamper :
+        state[0][..., 0, 0, 0] = 1000
+    return incremental_variability(g2, 100.0, 1.0, t0, data['TIME'][-1], bands, statistics, (data, state))
+
+
+@pytest.mark.parametrize('split, bands', [(0.6, None), (0.9, [500, 2000, 12000]), (0.2, None)])
+def test_incremental_as_full(split, bands) :
+    data = events(6000, 5000.0, flare=(30, 150, 3000.0, 3200.0, 40))
+    part = data[:int(split * len(data))]
+    g1, g2 = gti((0, part['TIME'][-1] - T0)), gti((0, 2050), (2130, 5000))
+    statistics = ['POISSON', 'CHISQ']
+
+    V, maps, state = _incremental(g1, g2, part, data, bands, statistics)
+    V_full, maps_full = variability_computation(g2, 100.0, 1.0, data['TIME'][0], data['TIME'][-1], data, bands, statistics)
+    assert np.array_equal(V, V_full)
+    assert all(np.array_equal(maps[name], maps_full[name]) for name in statistics)
+
+    # The windows before the appended events are not counted again
+    V, maps, state = _incremental(g1, g2, part, data, bands, statistics, tamper=True)
+    assert state[0][0, 0, 0, 0] == 1000
+
+
+def test_incremental_with_reprocessed_events() :
+    data = events(6000, 5000.0)
+    part = data[:4000].copy()
+    data = data.copy()
+    data['RAWX'][100] = data['RAWX'][100] % 64 + 1
+    g = gti((0, 5000))
+
+    V, maps, state = _incremental(g, g, part, data, None, [], tamper=True)
+    assert np.array_equal(V, variability_computation(g, 100.0, 1.0, data['TIME'][0], data['TIME'][-1], data))
+    assert state[0][0, 0, 0, 0] != 1000
@@ -0,0 +1,62 @@
+# coding=utf-8
+"""
+Arrival of the observations in the watched folder, see scripts/watcher.py.
+"""
+
+import os
+
+import manifest as Manifest
+from pipeline import params_name
+from watcher import Watcher
+
+PARAMS = [(8, 100, 1.0, 3)]
+
+
+def observation(folder, obs, size=100) :
+    path = os.path.join(str(folder), obs)
+    os.makedirs(path, exist_ok=True)
+    for name in ('P{0}PNS003PIEVLI0000.FTZ', 'P{0}OBX000FBKTSR0000.FTZ', '{0}SUM.ASC') :
+        with open(os.path.join(path, name.format(obs)), 'wb') as f :
+            f.write(b'\0' * size)
+    return path
+
+
+def detected(folder, obs) :
+    out = os.path.join(str(folder), obs, params_name(*PARAMS[0]))
+    os.makedirs(out, exist_ok=True)
+    open(Manifest.manifest_file(out, 'detection'), 'w').close()
+
+
+def polls(watcher, n) :
+    arrivals = []
+    for i in range(n) :
+        arrivals.append(watcher._arrivals())
+        watcher.first = False
+    return arrivals
+
+
+def test_observation_copied_at_startup(tmp_path) :
+    observation(tmp_path, '0123456789', 100)
+    watcher = Watcher(tmp_path, PARAMS)
+    assert watcher._arrivals() == []
+    watcher.first = False
+
+    # Still being copied at the second poll
+    observation(tmp_path, '0123456789', 200)
+    assert polls(watcher, 3) == [[], ['0123456789'], []]
+
+
+def test_backlog_processed_before(tmp_path) :
+    observation(tmp_path, '0123456789')
+    observation(tmp_path, '0987654321')
+    detected(tmp_path, '0123456789')
+    assert polls(Watcher(tmp_path, PARAMS), 2) == [[], ['0987654321']]
+    assert polls(Watcher(tmp_path, PARAMS, backlog=True), 2) == [[], ['0123456789', '0987654321']]
+
+
+def test_new_observation_processed_before(tmp_path) :
+    watcher = Watcher(tmp_path, PARAMS)
+    assert polls(watcher, 1) == [[]]
+    observation(tmp_path, '0123456789')
+    detected(tmp_path, '0123456789')
+    assert polls(watcher, 2) == [[], ['0123456789']]
@@ -0,0 +1,135 @@
+# coding=utf-8
+"""
+Work queue shared by worker processes, see scripts/work_queue.py.
+"""
+
+import os
+import time
+import sqlite3
+import multiprocessing
+
+from scheduler import Task, DONE, RUNNING
+from work_queue import WorkQueue, run_worker
+
+# Processes started as on separate hosts, sharing nothing but the queue file
+CONTEXT = multiprocessing.get_context('spawn')
+
+########################################################################
+# Task functions, imported by the workers
+
+def record(log, name, delay=0.05) :
+    """
+    Appending the name of the task to the log, one line per run.
+    """
+    time.sleep(delay)
+    with open(log, 'a') as f :
+        f.write("{0} {1}\n".format(name, time.time()))
+
+
+def spawn(log, n) :
+    """
+    Recording, then returning n child tasks.
+    """
+    record(log, 'parent')
+    return [Task('child {0}'.format(i), record, (log, 'child {0}'.format(i))) for i in range(n)]
+
+
+def hang_once(log, marker) :
+    """
+    Hanging forever at the first run, recording at the next one.
+    """
+    if not os.path.exists(marker) :
+        open(marker, 'w').close()
+        time.sleep(3600)
+    record(log, 'hang')
+
+########################################################################
+
+def _runs(log) :
+    with open(log) as f :
+        lines = [line.split() for line in f]
+    return [' '.join(line[:-1]) for line in lines], {' '.join(line[:-1]) : float(line[-1]) for line in lines}
+
+
+def _start_workers(file, n, lease) :
+    workers = [CONTEXT.Process(target=run_worker, args=(file, lease, 0.05, None)) for i in range(n)]
+    for worker in workers :
+        worker.start()
+    return workers
+
+
+def _join(workers, timeout=60) :
+    for worker in workers :
+        worker.join(timeout)
+        assert worker.exitcode == 0
+
+
+def test_every_task_runs_once(tmp_path) :
+    file, log = str(tmp_path / 'queue.db'), str(tmp_path / 'runs.log')
+    tasks  = [Task('job {0}'.format(i), record, (log, 'job {0}'.format(i))) for i in range(30)]
+    tasks += [Task('after', record, (log, 'after'), deps=['job {0}'.format(i) for i in range(30)]),
+              Task('parent', spawn, (log, 5), deps=['after'])]
+    queue = WorkQueue(file)
+    assert queue.submit(tasks) == 32
+    assert queue.submit(tasks) == 0
+    queue.close()
+
+    _join(_start_workers(file, 3, 30.0))
+
+    names, times = _runs(log)
+    expected = ['job {0}'.format(i) for i in range(30)] + ['after', 'parent'] + ['child {0}'.format(i) for i in range(5)]
+    assert sorted(names) == sorted(expected)
+    # Dependent tasks released only once their dependencies are complete
+    assert all(times['after'] > times['job {0}'.format(i)] for i in range(30))
+    assert all(times['child {0}'.format(i)] > times['parent'] for i in range(5))
+
+    queue = WorkQueue(file)
+    assert queue.counts()[DONE] == 37
+    queue.close()
+
+
+def test_lease_of_killed_worker_requeued(tmp_path) :
+    file, log, marker = str(tmp_path / 'queue.db'), str(tmp_path / 'runs.log'), str(tmp_path / 'marker')
+    queue = WorkQueue(file, lease=1.0)
+    queue.submit([Task('hang', hang_once, (log, marker), retries=1),
+                  Task('next', record, (log, 'next'), deps=['hang'])])
+
+    worker = _start_workers(file, 1, 1.0)[0]
+    t = time.time()
+    while not os.path.exists(marker) and time.time() - t < 30 :
+        time.sleep(0.05)
+    assert queue.db.execute("SELECT state FROM jobs WHERE name = 'hang'").fetchone()[0] == RUNNING
+    worker.kill()
+    worker.join()
+    queue.close()
+
+    _join(_start_workers(file, 2, 1.0))
+
+    names, times = _runs(log)
+    assert sorted(names) == ['hang', 'next']
+    db = sqlite3.connect(file)
+    assert db.execute("SELECT state, attempts FROM jobs WHERE name = 'hang'").fetchone() == (DONE, 2)
+    db.close()
+
+
+def test_children_inserted_with_parent(tmp_path) :
+    file, log = str(tmp_path / 'queue.db'), str(tmp_path / 'runs.log')
+    queue = WorkQueue(file)
+    queue.submit([Task('parent', spawn, (log, 3))])
+    task = queue.claim('worker')
+    children = spawn(log, 3)
+
+    # Worker dying while the children are inserted
+    def die(tasks) :
+        raise KeyboardInterrupt
+    queue._insert = die
+    try :
+        queue.complete(task, 'worker', True, children)
+    except KeyboardInterrupt :
+        pass
+    assert queue.counts() == {'pending' : 0, 'running' : 1, 'done' : 0, 'failed' : 0, 'skipped' : 0}
+
+    del queue._insert
+    assert queue.complete(task, 'worker', True, children) == DONE
+    assert queue.counts()['pending'] == 3
+    queue.close()